@@ -0,0 +1,162 @@
+import base64
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from config import (CACHE_DIR, ANSWER_CACHE_SIMILARITY, ANSWER_CACHE_TTL_SECONDS, ANSWER_CACHE_MAX_ENTRIES)
+from utils import ensure_dir_exists
+from token_counter import estimate_tokens
+from cache_manager import file_lock
+
+# Answers are grouped by (document key, model, retrieved chunk ids); within a
+# group a cached answer is reused if its question embedding is close enough
+# to the new one. Entries live in memory and are appended to a JSON lines log
+# (embeddings as base64 float16) so they survive restarts. Appends run on a
+# background thread under a file lock; the log is rewritten only when it has
+# grown to twice ANSWER_CACHE_MAX_ENTRIES lines.
+ANSWER_CACHE_FILE = "answer_cache.jsonl"
+LOCK_FILE = ".answer_cache.lock"
+
+_entries = None
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "saved_tokens": 0}
+# One writer thread keeps appends in order and off the chat path
+_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="answer-cache")
+# Lines in the log as last seen by the writer thread; counted once, then tracked
+_log_lines = None
+
+def _cache_path(cache_dir):
+    return os.path.join(cache_dir, ANSWER_CACHE_FILE)
+
+def _group_key(doc_key, model, chunk_ids):
+    return f"{doc_key}|{model}|{','.join(str(i) for i in sorted(chunk_ids))}"
+
+def _encode(entry):
+    embedding = base64.b64encode(entry["embedding"].astype('float16').tobytes()).decode("ascii")
+    return json.dumps(dict(entry, embedding=embedding), ensure_ascii=False, separators=(",", ":")) + "\n"
+
+def _read_log(path):
+    """Parse the log into entries, skipping lines a crashed writer left truncated."""
+    entries = []
+    if not os.path.exists(path):
+        return entries
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+                entry["embedding"] = np.frombuffer(base64.b64decode(entry["embedding"]), dtype='float16').astype('float32')
+            except Exception:
+                continue
+            entries.append(entry)
+    return entries
+
+def _load(cache_dir):
+    """Load entries from disk on first use. Caller holds the lock."""
+    global _entries
+    if _entries is not None:
+        return _entries
+    try:
+        _entries = _read_log(_cache_path(cache_dir))
+    except Exception as e:
+        print(f"Error loading answer cache: {e}")
+        _entries = []
+    return _entries
+
+def _append(cache_dir, entry, max_entries, ttl):
+    """Append one entry to the log, compacting it once it holds 2 * max_entries lines. Runs on the writer thread."""
+    global _log_lines
+    try:
+        ensure_dir_exists(cache_dir)
+        path = _cache_path(cache_dir)
+        with file_lock(cache_dir, LOCK_FILE):
+            if _log_lines is None:
+                with open(path, "a+b") as f:
+                    f.seek(0)
+                    _log_lines = sum(1 for _ in f)
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(_encode(entry))
+            _log_lines += 1
+            # Other processes' appends aren't counted, which only delays compaction
+            if _log_lines <= 2 * max_entries:
+                return
+            # Re-read so entries appended by other processes are kept
+            now = time.time()
+            entries = [entry for entry in _read_log(path) if not _expired(entry, now, ttl)]
+            entries.sort(key=lambda entry: entry["created"])
+            tmp_path = f"{path}.tmp-{os.getpid()}"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.writelines(_encode(entry) for entry in entries[-max_entries:])
+            os.replace(tmp_path, path)
+            _log_lines = min(len(entries), max_entries)
+    except Exception as e:
+        print(f"Error saving answer cache: {e}")
+
+def _expired(entry, now, ttl):
+    return ttl and now - entry["created"] > ttl
+
+def lookup_answer(doc_key, model, chunk_ids, query_embedding, threshold=ANSWER_CACHE_SIMILARITY,
+                  ttl=ANSWER_CACHE_TTL_SECONDS, cache_dir=CACHE_DIR):
+    """Return a cached answer for a semantically equivalent question, or None.
+
+    Only answers generated from the same document, model and retrieved
+    chunks qualify; among those the most similar question at or above
+    threshold (cosine) wins. Expired entries are ignored.
+    """
+    group = _group_key(doc_key, model, chunk_ids)
+    query = np.asarray(query_embedding, dtype='float32').ravel()
+    query = query / (np.linalg.norm(query) + 1e-12)
+    now = time.time()
+    
+    with _lock:
+        best, best_similarity = None, threshold
+        for entry in _load(cache_dir):
+            if entry["group"] != group or _expired(entry, now, ttl):
+                continue
+            similarity = float(np.dot(entry["embedding"], query))
+            if similarity >= best_similarity:
+                best, best_similarity = entry, similarity
+        
+        if best is None:
+            _stats["misses"] += 1
+            return None
+        _stats["hits"] += 1
+        _stats["saved_tokens"] += best["tokens"]
+        best["last_used"] = now
+        return best["answer"]
+
+def store_answer(doc_key, model, chunk_ids, query_text, query_embedding, answer, tokens=None,
+                 max_entries=ANSWER_CACHE_MAX_ENTRIES, ttl=ANSWER_CACHE_TTL_SECONDS, cache_dir=CACHE_DIR):
+    """Cache an answer, evicting expired and least-recently-used entries, and queue it for the on-disk log.
+
+    tokens is what replaying this answer saves (prompt + completion); it is
+    estimated from the answer length when not given.
+    """
+    embedding = np.asarray(query_embedding, dtype='float32').ravel()
+    embedding = embedding / (np.linalg.norm(embedding) + 1e-12)
+    now = time.time()
+    
+    with _lock:
+        entries = _load(cache_dir)
+        entries[:] = [entry for entry in entries if not _expired(entry, now, ttl)]
+        entry = {
+            "group": _group_key(doc_key, model, chunk_ids),
+            "query": query_text,
+            "embedding": embedding,
+            "answer": answer,
+            "tokens": tokens or estimate_tokens(answer),
+            "created": now,
+            "last_used": now
+        }
+        entries.append(entry)
+        if len(entries) > max_entries:
+            entries.sort(key=lambda entry: entry["last_used"])
+            del entries[:len(entries) - max_entries]
+    _writer.submit(_append, cache_dir, dict(entry), max_entries, ttl)
+
+def get_answer_cache_stats():
+    """Return hits, misses, hit rate and estimated tokens saved in this process."""
+    with _lock:
+        lookups = _stats["hits"] + _stats["misses"]
+        return dict(_stats, hit_rate=_stats["hits"] / lookups if lookups else 0.0)
@@ -1,13 +1,24 @@
 import streamlit as st
 import os
+import time
 import tempfile
 from groq import Groq
 from config import *
 from utils import ensure_dir_exists, generate_session_id
-from pdf_processing import parse_pdf, chunk_text
-from embedding import generate_embeddings, build_index
-from retrieval import query_index, format_context_from_results
+from token_counter import estimate_tokens
+# torch, sentence_transformers, FAISS and PyMuPDF are imported on first use
+# (PDF processing, retrieval) or by the background warm-up, not on page load
+from retrieval import (retrieve, retrieve_with_speculation, format_context_from_results, context_token_budget,
+                       get_query_cache_stats, embed_query)
+from answer_cache import lookup_answer, store_answer, get_answer_cache_stats
+from lexical_index import build_bm25_index
+from metadata_filter import toc_page_ranges
 from chat_utils import rewrite_query
+from model_registry import start_background_warm_up
+from index_manager import get_document, put_document, get_index_manager_stats
+from streaming import iter_stream_text, render_stream, escape_math, CURSOR
+from tracing import (span, start_trace, start_span, finish_span, annotate, set_context_tracing, is_tracing_enabled,
+                     get_spans, get_trace_stats, trace_rows, export_prometheus, export_json_lines)
 
 st.set_page_config(page_title="PDF Assistant", layout="wide")
 st.title('PDF Assistant')
@@ -24,9 +35,21 @@ if 'sessions' not in st.session_state:
 if 'pdf_indices' not in st.session_state:
     st.session_state['pdf_indices'] = {}
 
+if 'ttft_history' not in st.session_state:
+    st.session_state['ttft_history'] = {"sequential": [], "speculative": []}
+if 'throughput_history' not in st.session_state:
+    st.session_state['throughput_history'] = []
+
+if 'rewrite_stats' not in st.session_state:
+    st.session_state['rewrite_stats'] = {"llm_calls": 0, "skipped_by_gate": 0, "cache_hits": 0}
+
 # Ensure cache directory exists
 ensure_dir_exists(CACHE_DIR)
 
+# Tracing is switched per session, for this script run and the threads it starts; the
+# sidebar toggle is read here so PDF processing below is traced too. Metrics stay process-wide
+set_context_tracing(st.session_state.get('trace_pipeline', TRACING_ENABLED))
+
 # Sidebar for session management
 st.sidebar.title('Sessions')
 
@@ -69,30 +92,92 @@ if uploaded_file is not None:
         pdf_path = tmp_file.name
     
     if st.sidebar.button("Process PDF"):
-        with st.sidebar.status("Processing PDF..."):
-            pdf_name = uploaded_file.name.replace('.pdf', '')
-            safe_pdf_name = ''.join(c if c.isalnum() or c in ['-', '_'] else '_' for c in pdf_name)
-            
-            st.sidebar.text("Extracting text...")
-            parsed_data = parse_pdf(pdf_path)
-            
-            st.sidebar.text("Creating chunks...")
-            chunks = chunk_text(parsed_data["text_content"], CHUNK_SIZE, OVERLAP)
-            
-            st.sidebar.text("Generating embeddings...")
-            embeddings_cache = os.path.join(CACHE_DIR, f"{safe_pdf_name}_embeddings.pkl")
-            embeddings = generate_embeddings(chunks, cache_file=embeddings_cache)
-            
-            st.sidebar.text("Building search index...")
-            index = build_index(embeddings)
-            
-            st.session_state['pdf_indices'][safe_pdf_name] = {
-                "index": index,
-                "chunks": chunks,
-                "metadata": parsed_data["metadata"]
-            }
-            st.session_state['session_pdf_mapping'][current_session_name] = safe_pdf_name
-            st.sidebar.success(f"PDF processed: {pdf_name}")
+        from ingestion import ingest_pdf_streaming
+        from incremental import update_document
+        from document_store import compute_document_key, save_document
+        
+        ingest_span = start_trace("ingest.process_pdf", bytes=uploaded_file.size)
+        # Finished on every exit path so a failed run is recorded and stops being the current span
+        ingest_error = None
+        try:
+            with st.sidebar.status("Processing PDF..."):
+                pdf_name = uploaded_file.name.replace('.pdf', '')
+                safe_pdf_name = ''.join(c if c.isalnum() or c in ['-', '_'] else '_' for c in pdf_name)
+                doc_key = compute_document_key(uploaded_file.getvalue())
+                
+                # Indexes are shared process-wide by content hash; sessions only keep a reference
+                cached_doc = get_document(doc_key)
+                # A different revision of a PDF with the same name only needs its changed pages re-embedded
+                previous_entry = st.session_state['pdf_indices'].get(safe_pdf_name)
+                previous_doc = None
+                if cached_doc is None and previous_entry and previous_entry['doc_key'] != doc_key:
+                    previous_doc = get_document(previous_entry['doc_key'])
+                
+                if cached_doc is not None:
+                    st.sidebar.text("Loaded from cache...")
+                    annotate(source="cache")
+                    metadata = cached_doc["metadata"]
+                elif previous_doc is not None:
+                    st.sidebar.text("Updating changed pages...")
+                    annotate(source="incremental")
+                    updated_doc, update_stats = update_document(previous_doc, pdf_path)
+                    metadata = updated_doc["metadata"]
+                    put_document(doc_key, updated_doc)
+                    with span("ingest.save"):
+                        save_document(doc_key, updated_doc["chunks"], None, updated_doc["index"], metadata, bm25=updated_doc["bm25"])
+                    st.sidebar.text(
+                        f"Re-embedded {update_stats['embedded_chunks']} chunks from "
+                        f"{update_stats['changed_pages']}/{update_stats['total_pages']} changed pages, "
+                        f"reused {update_stats['reused_chunks']} ({update_stats['seconds']:.1f}s)"
+                    )
+                else:
+                    # The document is only published to the shared manager once it is complete:
+                    # FAISS can't search an index another thread is still adding to, and an
+                    # interrupted run must not leave a truncated index behind for other sessions
+                    annotate(source="full")
+                
+                    progress_bar = st.sidebar.progress(0.0, text="Extracting, chunking and embedding...")
+                
+                    def show_progress(progress):
+                        total_pages = max(progress["total_pages"], 1)
+                        progress_bar.progress(
+                            min(progress["pages_done"] / total_pages, 1.0),
+                            text=f"Page {progress['pages_done']}/{progress['total_pages']} | {progress['chunks']} chunks indexed"
+                        )
+                
+                    with span("ingest.stream"):
+                        ingestion = ingest_pdf_streaming(pdf_path, CHUNK_SIZE, OVERLAP, progress_callback=show_progress)
+                        index, chunks, metadata = ingestion["index"], ingestion["chunks"], ingestion["metadata"]
+                        annotate(pages=metadata["pages"], chunks=len(chunks))
+                    dedup_stats = ingestion["dedup"]
+                    if dedup_stats.get("chunks_seen"):
+                        skipped = dedup_stats["exact_duplicates"] + dedup_stats["near_duplicates"]
+                        st.sidebar.text(
+                            f"Deduplicated {skipped}/{dedup_stats['chunks_seen']} chunks "
+                            f"({skipped / dedup_stats['chunks_seen']:.0%} less embedding), "
+                            f"stripped {dedup_stats['stripped_lines']} header/footer lines"
+                        )
+                
+                    st.sidebar.text("Building keyword index...")
+                    with span("ingest.build_bm25", chunks=len(chunks)):
+                        bm25 = build_bm25_index(chunks)
+                
+                    st.sidebar.text("Saving to cache...")
+                    with span("ingest.save"):
+                        save_document(doc_key, chunks, None, index, metadata, bm25=bm25)
+                    put_document(doc_key, {"index": index, "chunks": chunks, "metadata": metadata, "bm25": bm25})
+                
+                st.session_state['pdf_indices'][safe_pdf_name] = {
+                    "doc_key": doc_key,
+                    "metadata": metadata
+                }
+                st.session_state['session_pdf_mapping'][current_session_name] = safe_pdf_name
+                st.sidebar.success(f"PDF processed: {pdf_name}")
+        except BaseException as e:
+            ingest_error = type(e).__name__
+            raise
+        finally:
+            finish_span(ingest_span, error=ingest_error)
     
     # Clean up temp file
     try:
@@ -113,19 +198,67 @@ if st.session_state['pdf_indices']:
     st.session_state['session_pdf_mapping'][current_session_name] = selected_pdf
 else:
     selected_pdf = None
+search_all_pdfs = len(st.session_state['pdf_indices']) > 1 and st.sidebar.checkbox(
+    "Search across all processed PDFs", value=False
+)
 
 use_rag = st.sidebar.checkbox("Use PDF context for responses", value=True)
+use_answer_cache = st.sidebar.checkbox("Cache answers for repeated questions", value=False)
+retrieval_mode = st.sidebar.selectbox("Retrieval mode", options=RETRIEVAL_MODES, index=0)
 use_query_rewriting = st.sidebar.checkbox("Enable query rewriting", value=True)
+use_speculative_retrieval = st.sidebar.checkbox("Retrieve while rewriting (speculative)", value=True)
 show_debug_info = st.sidebar.checkbox("Show debug information", value=True)  # Changed to False by default for production
+st.sidebar.checkbox("Trace pipeline stages", value=TRACING_ENABLED, key="trace_pipeline")
 top_k = st.sidebar.slider("Number of chunks to retrieve", min_value=1, max_value=10, value=5)
+
+# Optional metadata filters for the selected PDF; None searches the whole document
+search_filters = None
+if selected_pdf and selected_pdf in st.session_state['pdf_indices'] and not search_all_pdfs:
+    filter_metadata = st.session_state['pdf_indices'][selected_pdf]['metadata']
+    with st.sidebar.expander("Filter search"):
+        search_filters = {}
+        page_count = filter_metadata.get("pages", 0)
+        if page_count > 1:
+            page_range = st.slider("Pages", min_value=1, max_value=page_count, value=(1, page_count))
+            if page_range != (1, page_count):
+                search_filters["page_range"] = page_range
+        toc_entries = toc_page_ranges(filter_metadata.get("toc") or [], page_count)
+        if toc_entries:
+            toc_choice = st.selectbox(
+                "Outline section",
+                options=[None] + toc_entries,
+                format_func=lambda entry: "Entire document" if entry is None else
+                    f"{'  ' * (entry['level'] - 1)}{entry['title']} (p. {entry['start']}-{entry['end']})"
+            )
+            if toc_choice is not None:
+                search_filters["toc_entry"] = toc_choice
+        section_prefix = st.text_input("Section starts with", value="", help="e.g. '2.1' or 'Chapter 3'")
+        if section_prefix.strip():
+            search_filters["section_prefix"] = section_prefix
+        search_filters = search_filters or None
 temperature = st.sidebar.slider("Temperature", min_value=0.0, max_value=2.0, value=0.7, step=0.1)
 max_tokens = st.sidebar.slider('Max Tokens', min_value=1, max_value=32768, value=8192)
 
+if show_debug_info:
+    index_stats = get_index_manager_stats()
+    st.sidebar.caption(
+        f"Shared indexes: {index_stats['documents']} loaded, "
+        f"{index_stats['resident_bytes'] / (1024 * 1024):.1f}/{INDEX_MEMORY_BUDGET_MB} MB | "
+        f"hits: {index_stats['hits']}, reloads: {index_stats['reloads']}, evictions: {index_stats['evictions']}"
+    )
+    query_cache_stats = get_query_cache_stats()
+    st.sidebar.caption(
+        f"Query embedding cache: {query_cache_stats['size']} entries | "
+        f"hits: {query_cache_stats['hits']}, misses: {query_cache_stats['misses']}"
+    )
+
 st.subheader(f"Current Session: {current_session_name}")
 
 # Display current PDF info if available
 current_session_pdf = st.session_state['session_pdf_mapping'].get(current_session_name)
-if current_session_pdf and current_session_pdf in st.session_state['pdf_indices']:
+if search_all_pdfs:
+    st.info(f"📚 Searching all {len(st.session_state['pdf_indices'])} processed PDFs")
+elif current_session_pdf and current_session_pdf in st.session_state['pdf_indices']:
     pdf_info = st.session_state['pdf_indices'][current_session_pdf]['metadata']
     st.info(f"📄 PDF: {current_session_pdf} | Pages: {pdf_info['pages']} | Author: {pdf_info['author']}")
 elif selected_pdf and selected_pdf in st.session_state['pdf_indices']:
@@ -144,56 +277,144 @@ for message in current_messages:
 
 # Chat input
 if prompt := st.chat_input("Ask a question about the PDF or chat..."):
-    current_messages.append({"role": "user", "content": prompt})
-    with st.chat_message("user"):
-        st.markdown(prompt)
-    
-    with st.chat_message("assistant"):
-        with st.spinner("Thinking..."):
-            client = st.session_state['groq_client']
-            conversation_messages = []
-            
-            # Get active PDF
-            active_pdf = st.session_state['session_pdf_mapping'].get(current_session_name)
-            if not active_pdf and selected_pdf:
-                active_pdf = selected_pdf
-            
-            enhanced_system_prompt = SYSTEM_PROMPT
-            updated_query = prompt
-            
-            # Query rewriting (if enabled)
-            if use_query_rewriting and len(current_messages) > 1:
-                try:
-                    with st.status("Rewriting query..."):
-                        updated_query = rewrite_query(prompt, current_messages, client)
-                    
-                    if show_debug_info and updated_query != prompt:
-                        st.info(f"Original query: '{prompt}'\nRewritten query: '{updated_query}'")
-                except Exception as e:
-                    st.warning(f"Query rewriting failed: {e}")
-                    updated_query = prompt  # Fallback to original prompt
-            
-            # Context retrieval (if enabled)
-            new_context = None
-            if use_rag and active_pdf and active_pdf in st.session_state['pdf_indices']:
-                pdf_data = st.session_state['pdf_indices'][active_pdf]
-                try:
-                    with st.status("Retrieving context..."):
-                        results = query_index(updated_query, pdf_data['index'], pdf_data['chunks'], top_k=top_k)
-                    
-                    if results:
-                        new_context = format_context_from_results(results)
-                    else:
-                        new_context = "No relevant information was found in the PDF for this query."
-                    
+    request_start = time.perf_counter()
+    request_span = start_trace("chat.request", model=selected_model, mode=retrieval_mode, rag=use_rag)
+    request_error = None
+    # Finished on every exit path so a failed turn is recorded and stops being the current span
+    try:
+        current_messages.append({"role": "user", "content": prompt})
+        with st.chat_message("user"):
+            st.markdown(prompt)
+        
+        assistant_message = st.chat_message("assistant")
+        with assistant_message:
+            with st.spinner("Thinking..."):
+                client = st.session_state['groq_client']
+                conversation_messages = []
                 
-                    context_to_use = new_context
-                    
-                    if show_debug_info and context_to_use:
-                        with st.expander("📄 View Retrieved Context"):
-                            st.markdown(f"```markdown\n{context_to_use}\n```")
+                # Get active PDF
+                active_pdf = st.session_state['session_pdf_mapping'].get(current_session_name)
+                if not active_pdf and selected_pdf:
+                    active_pdf = selected_pdf
+                
+                enhanced_system_prompt = SYSTEM_PROMPT
+                updated_query = prompt
+                
+                # Resolve the document up front so retrieval can start alongside rewriting
+                pdf_data = None
+                retrieval_doc_key = None
+                if use_rag and active_pdf and active_pdf in st.session_state['pdf_indices']:
+                    with span("chat.load_document", corpus=search_all_pdfs):
+                        if search_all_pdfs:
+                            from corpus import get_corpus
+                            # Built once per set of documents, then served from the cache like a single PDF
+                            with st.status("Preparing corpus index..."):
+                                retrieval_doc_key, pdf_data = get_corpus([
+                                    (name, info['doc_key']) for name, info in st.session_state['pdf_indices'].items()
+                                ])
+                        else:
+                            retrieval_doc_key = st.session_state['pdf_indices'][active_pdf]['doc_key']
+                            pdf_data = get_document(retrieval_doc_key)
+                        annotate(chunks=len(pdf_data["chunks"]) if pdf_data is not None else 0)
+                retrieval_timings = {}
+                results = None
+                # TTFT is only compared on turns that made an LLM rewrite call: "speculative" when
+                # retrieval overlapped it, "sequential" when it ran first; other turns stay None
+                ttft_mode = None
+                
+                # Query rewriting (if enabled)
+                if use_query_rewriting and len(current_messages) > 1:
+                    try:
+                        rewrite_cache = current_session_data.setdefault("rewrite_cache", {})
+                        rewrite_stats = st.session_state['rewrite_stats']
+                        llm_calls_before = rewrite_stats["llm_calls"]
+                        speculated = False
+                        
+                        def run_rewrite(query):
+                            return rewrite_query(query, current_messages, client, cache=rewrite_cache, stats=rewrite_stats)
+                        
+                        if use_speculative_retrieval and pdf_data is not None:
+                            try:
+                                with st.status("Rewriting query and retrieving context..."), span("chat.rewrite_and_retrieve"):
+                                    updated_query, results, speculation = retrieve_with_speculation(
+                                        prompt,
+                                        run_rewrite,
+                                        lambda query: retrieve(query, pdf_data, retrieval_mode, top_k, retrieval_timings, search_filters)
+                                    )
+                                speculated = True
+                                if show_debug_info and speculation["rewritten"]:
+                                    st.caption(
+                                        f"Speculative retrieval — similarity {speculation['similarity']:.2f}, "
+                                        + ("reused raw-prompt results" if speculation["reused"] else "re-retrieved for rewritten query")
+                                    )
+                            except Exception as e:
+                                # Retrieval failed in the worker; rewrite and retrieve sequentially instead
+                                print(f"Speculative retrieval failed: {e}")
+                                results = None
+                                updated_query = run_rewrite(prompt)
+                        else:
+                            with st.status("Rewriting query..."), span("chat.rewrite"):
+                                updated_query = run_rewrite(prompt)
+                        if rewrite_stats["llm_calls"] > llm_calls_before:
+                            ttft_mode = "speculative" if speculated else "sequential"
+                        
+                        if show_debug_info and updated_query != prompt:
+                            st.info(f"Original query: '{prompt}'\nRewritten query: '{updated_query}'")
+                        if show_debug_info:
+                            avoided = rewrite_stats["skipped_by_gate"] + rewrite_stats["cache_hits"]
+                            st.caption(
+                                f"Query rewriting — LLM calls: {rewrite_stats['llm_calls']} | "
+                                f"avoided: {avoided} (gate: {rewrite_stats['skipped_by_gate']}, cache: {rewrite_stats['cache_hits']})"
+                            )
+                    except Exception as e:
+                        st.warning(f"Query rewriting failed: {e}")
+                        updated_query = prompt  # Fallback to original prompt
+                
+                # Context retrieval (if enabled)
+                new_context = None
+                if use_rag and active_pdf and active_pdf in st.session_state['pdf_indices']:
+                    try:
+                        if pdf_data is None:
+                            raise RuntimeError("the document is no longer cached; please process the PDF again")
+                        # Speculative mode may already have retrieved for the final query
+                        if results is None:
+                            with st.status("Retrieving context..."), span("chat.retrieve"):
+                                results = retrieve(updated_query, pdf_data, retrieval_mode, top_k, retrieval_timings, search_filters)
+                        
+                        if show_debug_info and retrieval_timings:
+                            st.caption("Retrieval latency — " + " | ".join(
+                                f"{stage.replace('_', ' ')}: {seconds * 1000:.1f} ms" for stage, seconds in retrieval_timings.items()
+                            ))
+                        
+                        if results:
+                            # Leave room in the model's window for the system prompt, recent history and the answer
+                            reserved_tokens = estimate_tokens(SYSTEM_PROMPT) + sum(
+                                estimate_tokens(message["content"]) for message in current_messages[-5:]
+                            )
+                            packing_stats = {}
+                            new_context = format_context_from_results(
+                                results,
+                                token_budget=context_token_budget(selected_model, max_tokens, reserved_tokens),
+                                stats=packing_stats
+                            )
+                            if show_debug_info:
+                                st.caption(
+                                    f"Context packing — ~{packing_stats['tokens_before']} → ~{packing_stats['tokens_after']} prompt tokens | "
+                                    f"{packing_stats['chunks']} chunks → {packing_stats['excerpts']} excerpts "
+                                    f"(merged: {packing_stats['merged']}, dropped: {packing_stats['dropped']}"
+                                    + (", last truncated" if packing_stats['truncated'] else "") + ")"
+                                )
+                        else:
+                            new_context = "No relevant information was found in the PDF for this query."
+                        
                     
-                    enhanced_system_prompt = f"""
+                        context_to_use = new_context
+                        
+                        if show_debug_info and context_to_use:
+                            with st.expander("📄 View Retrieved Context"):
+                                st.markdown(f"```markdown\n{context_to_use}\n```")
+                        
+                        enhanced_system_prompt = f"""
                         {SYSTEM_PROMPT}
 
                         ---
@@ -208,74 +429,172 @@ if prompt := st.chat_input("Ask a question about the PDF or chat..."):
                         --Integrate External Knowledge: Feel free to incorporate your broader knowledge when the PDF lacks sufficient detail or is ambiguous. Provide rich explanations and examples.
                         --Organized and Detailed Responses: Write concise, well-structured responses that break down complex ideas into easy-to-understand steps. Ensure that explanations are thorough, tailored to the user's needs, and balance technical depth with readability.
                     """
-                except Exception as e:
-                    st.error(f"Error retrieving context: {e}")
-                    enhanced_system_prompt = f"""
+                    except Exception as e:
+                        st.error(f"Error retrieving context: {e}")
+                        enhanced_system_prompt = f"""
                         {SYSTEM_PROMPT}
 
                         ---
                         An error occurred while retrieving information from the PDF. 
                         Please respond using your general knowledge where appropriate, and indicate that the response is not sourced from the document.
                     """
-            else:
-                enhanced_system_prompt = f"""
+                else:
+                    enhanced_system_prompt = f"""
                     {SYSTEM_PROMPT}
 
                     ---
                     No PDF context is being used for this query.
                     Please respond using your general knowledge where appropriate.
                 """
-            
-            # Build conversation history
-            conversation_messages.append({
-                "role": "system",
-                "content": enhanced_system_prompt
-            })
-            
-            history_messages = []
-            for message in current_messages:
-                if message['role'].lower() != 'system':
-                    history_messages.append({
-                        "role": message["role"],
-                        "content": message["content"]
-                    })
-                    
-            # Limit history to last 5 messages to prevent token overflow
-            history_messages = history_messages[-5:] if len(history_messages) > 5 else history_messages
-            conversation_messages.extend(history_messages)
-            
-            # Update the latest query if it was rewritten
-            if updated_query != prompt and conversation_messages[-1]["content"] == prompt:
-                conversation_messages[-1]["content"] = updated_query
-                if show_debug_info:
-                    conversation_messages.insert(-1, {
-                        "role": "system",
-                        "content": f"Note: The user's query has been rewritten from '{prompt}' to '{updated_query}' to better capture the context of the conversation."
-                    })
-            
-            # Generate response
-            try:
-                stream = client.chat.completions.create(
-                    model=selected_model,
-                    messages=conversation_messages,
-                    temperature=temperature,
-                    max_tokens=max_tokens,
-                    stream=True
-                )
                 
-                response_placeholder = st.empty()
-                full_response = ""
-                for chunk in stream:
-                    if chunk.choices[0].delta.content is not None:
-                        chunk_content = chunk.choices[0].delta.content
-                        full_response += chunk_content
+                # Build conversation history
+                conversation_messages.append({
+                    "role": "system",
+                    "content": enhanced_system_prompt
+                })
+                
+                history_messages = []
+                for message in current_messages:
+                    if message['role'].lower() != 'system':
+                        history_messages.append({
+                            "role": message["role"],
+                            "content": message["content"]
+                        })
+                        
+                # Limit history to last 5 messages to prevent token overflow
+                history_messages = history_messages[-5:] if len(history_messages) > 5 else history_messages
+                conversation_messages.extend(history_messages)
+                
+                # Update the latest query if it was rewritten
+                if updated_query != prompt and conversation_messages[-1]["content"] == prompt:
+                    conversation_messages[-1]["content"] = updated_query
+                    if show_debug_info:
+                        conversation_messages.insert(-1, {
+                            "role": "system",
+                            "content": f"Note: The user's query has been rewritten from '{prompt}' to '{updated_query}' to better capture the context of the conversation."
+                        })
+                
+                # Replay a cached answer when a semantically equivalent question hit the same chunks
+                cached_answer = None
+                answer_cache_key = None
+                if use_answer_cache and pdf_data is not None and results:
+                    with span("chat.answer_cache"):
+                        try:
+                            answer_cache_key = (
+                                retrieval_doc_key,
+                                [result['chunk_id'] for result in results],
+                                embed_query(updated_query)
+                            )
+                            cached_answer = lookup_answer(answer_cache_key[0], selected_model, answer_cache_key[1], answer_cache_key[2])
+                        except Exception as e:
+                            print(f"Error checking answer cache: {e}")
+                            answer_cache_key = None
+                        annotate(cache_hit=cached_answer is not None)
+                
+                # Generate response
+                if cached_answer is not None:
+                    response_placeholder = st.empty()
+                    full_response = cached_answer
+                    response_placeholder.markdown(full_response)
+                    if show_debug_info:
+                        answer_stats = get_answer_cache_stats()
+                        st.caption(
+                            f"Replayed cached answer | hit rate: {answer_stats['hit_rate']:.0%} "
+                            f"({answer_stats['hits']}/{answer_stats['hits'] + answer_stats['misses']}), "
+                            f"~{answer_stats['saved_tokens']} tokens saved"
+                        )
+                else:
+                    generate_span = start_span("chat.generate", model=selected_model, max_tokens=max_tokens)
+                    try:
+                        stream = client.chat.completions.create(
+                            model=selected_model,
+                            messages=conversation_messages,
+                            temperature=temperature,
+                            max_tokens=max_tokens,
+                            stream=True
+                        )
+                    
+                        response_placeholder = st.empty()
+                        
+                        def render_answer(text, final):
+                            # Partial answers skip KaTeX; LaTeX is rendered once the answer is complete
+                            if final:
+                                response_placeholder.markdown(text)
+                            else:
+                                response_placeholder.markdown(escape_math(text) + CURSOR)
+                        
+                        stream_stats = {}
+                        full_response = render_stream(iter_stream_text(stream, stream_stats), render_answer,
+                                                      start_time=request_start, stats=stream_stats)
+                        time_to_first_token = stream_stats["ttft"]
+                        annotate(ttft=time_to_first_token, tokens=stream_stats["tokens"],
+                                 tokens_per_second=stream_stats["tokens_per_second"], bytes=len(full_response.encode("utf-8")))
+                        finish_span(generate_span)
+                    
+                        if time_to_first_token is not None:
+                            ttft_history = st.session_state['ttft_history']
+                            if ttft_mode is not None:
+                                ttft_history[ttft_mode].append(time_to_first_token)
+                            st.session_state['throughput_history'].append(stream_stats["tokens_per_second"])
+                            if show_debug_info:
+                                st.caption(f"Time to first token: {time_to_first_token * 1000:.0f} ms ({ttft_mode or 'no rewrite'}) | " + " | ".join(
+                                    f"{mode} avg: {sum(values) / len(values) * 1000:.0f} ms over {len(values)}"
+                                    for mode, values in ttft_history.items() if values
+                                ))
+                                throughput_history = st.session_state['throughput_history']
+                                st.caption(
+                                    f"Generation: {stream_stats['tokens']} tokens at {stream_stats['tokens_per_second']:.0f} tokens/s "
+                                    f"(avg {sum(throughput_history) / len(throughput_history):.0f} over {len(throughput_history)}) | "
+                                    f"{stream_stats['flushes']} redraws"
+                                )
+                    
+                        if answer_cache_key is not None and full_response:
+                            doc_key, chunk_ids, query_embedding = answer_cache_key
+                            prompt_tokens = sum(estimate_tokens(message["content"]) for message in conversation_messages)
+                            store_answer(doc_key, selected_model, chunk_ids, updated_query, query_embedding, full_response,
+                                         tokens=prompt_tokens + estimate_tokens(full_response))
+                    except Exception as e:
+                        finish_span(generate_span, error=type(e).__name__)
+                        error_msg = f"Error generating response: {str(e)}"
+                        st.error(error_msg)
+                        full_response = f"I'm sorry, but I encountered an error while generating a response. Please try again or adjust your query. Technical details: {str(e)}"
                         response_placeholder.markdown(full_response)
-            except Exception as e:
-                error_msg = f"Error generating response: {str(e)}"
-                st.error(error_msg)
-                full_response = f"I'm sorry, but I encountered an error while generating a response. Please try again or adjust your query. Technical details: {str(e)}"
-                response_placeholder.markdown(full_response)
+            
+            annotate(cached_answer=cached_answer is not None)
+    except BaseException as e:
+        request_error = type(e).__name__
+        raise
+    finally:
+        request_record = finish_span(request_span, error=request_error)
+    if show_debug_info and request_record is not None:
+        with assistant_message:
+            with st.expander("⏱️ Pipeline trace"):
+                st.dataframe(trace_rows(get_spans(request_record["trace_id"])), use_container_width=True, hide_index=True)
     
     # Save message to history
     current_messages.append({"role": "assistant", "content": full_response})
     st.session_state['sessions'][current_session_name]["messages"] = current_messages
+
+if show_debug_info and is_tracing_enabled():
+    trace_stats = get_trace_stats()
+    if trace_stats:
+        with st.sidebar.expander("Pipeline metrics"):
+            st.dataframe([
+                {
+                    "stage": name,
+                    "calls": stats["count"],
+                    "mean ms": round(stats["seconds_mean"] * 1000, 2),
+                    "max ms": round(stats["seconds_max"] * 1000, 2),
+                    "totals": ", ".join(f"{key}={value:g}" for key, value in stats["attributes"].items())
+                }
+                for name, stats in trace_stats.items()
+            ], use_container_width=True, hide_index=True)
+            st.download_button("Download Prometheus metrics", export_prometheus(), file_name="pdf_assistant_metrics.prom",
+                               mime="text/plain")
+            st.download_button("Download spans (JSON lines)", export_json_lines(), file_name="pdf_assistant_spans.jsonl",
+                               mime="application/x-ndjson")
+
+# Load torch, FAISS and the embedding model in the background once the page has
+# rendered, so the first upload or query doesn't pay for them
+if EMBEDDING_WARMUP_ON_STARTUP:
+    start_background_warm_up()
@@ -0,0 +1,69 @@
+"""Embedding throughput (chunks/second) for fixed batching vs. length-bucketed batching, fp32 vs. int8.
+
+Usage: python -m benchmarks.bench_embedding [--pdf path.pdf] [--num-chunks 512]
+With --pdf the chunks come from the document; otherwise synthetic chunks of
+widely varying length are used.
+"""
+import argparse
+import time
+import numpy as np
+from config import CHUNK_SIZE, OVERLAP
+from embedding import embed_texts
+from model_registry import get_embedding_model
+
+def synthetic_texts(num_chunks, seed=0):
+    """Chunks from a few words up to CHUNK_SIZE words, like real page-bounded chunks."""
+    rng = np.random.default_rng(seed)
+    vocabulary = "the pump pressure valve flow rate error signal torque model system value".split()
+    lengths = rng.integers(3, CHUNK_SIZE, size=num_chunks)
+    return [" ".join(rng.choice(vocabulary, size=length)) for length in lengths]
+
+def pdf_texts(pdf_path):
+    from pdf_processing import parse_pdf, chunk_text
+    return [chunk["content"] for chunk in chunk_text(parse_pdf(pdf_path)["text_content"], CHUNK_SIZE, OVERLAP)]
+
+def encode_fixed(model, texts, batch_size=16):
+    """The previous strategy: fixed batches of 16 in document order."""
+    return np.vstack([model.encode(texts[i:i + batch_size], show_progress_bar=False) for i in range(0, len(texts), batch_size)])
+
+def cosine_rows(a, b):
+    """Row-wise cosine similarity between two embedding matrices."""
+    return np.sum(a * b, axis=1) / (np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1) + 1e-12)
+
+def run(texts):
+    """Return (rows, similarity) where rows are (strategy, seconds, chunks/s)."""
+    reference_model = get_embedding_model(quantized=False)
+    quantized_model = get_embedding_model(quantized=True)
+    rows = []
+    outputs = {}
+    
+    for name, encode in [
+        ("fixed-16 fp32", lambda: encode_fixed(reference_model, texts)),
+        ("bucketed fp32", lambda: embed_texts(texts, model=reference_model)),
+        ("bucketed int8", lambda: embed_texts(texts, model=quantized_model)),
+    ]:
+        start = time.perf_counter()
+        outputs[name] = encode()
+        seconds = time.perf_counter() - start
+        rows.append((name, seconds, len(texts) / seconds))
+    
+    similarity = cosine_rows(outputs["bucketed int8"], outputs["fixed-16 fp32"])
+    return rows, similarity
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pdf")
+    parser.add_argument("--num-chunks", type=int, default=512)
+    args = parser.parse_args()
+    
+    texts = pdf_texts(args.pdf) if args.pdf else synthetic_texts(args.num_chunks)
+    rows, similarity = run(texts)
+    
+    print(f"{len(texts)} chunks")
+    print(f"{'strategy':>15} {'seconds':>10} {'chunks/s':>10}")
+    for name, seconds, rate in rows:
+        print(f"{name:>15} {seconds:>10.2f} {rate:>10.1f}")
+    print(f"int8 vs fp32 cosine similarity: mean {similarity.mean():.4f}, min {similarity.min():.4f}")
+
+if __name__ == "__main__":
+    main()
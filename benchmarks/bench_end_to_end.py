@@ -0,0 +1,237 @@
+"""Offline end-to-end pipeline benchmark with per-stage timing and memory, written as JSON.
+
+Usage: python -m benchmarks.bench_end_to_end [--pages 50] [--queries 20] [--chat-turns 5]
+                                             [--trace] [--output results.json] [--compare baseline.json]
+
+Generates a deterministic synthetic PDF, then times parse_pdf, chunk_text,
+generate_embeddings, build_index, query_index and format_context_from_results,
+and drives the chat path (query rewriting plus a streamed answer) against the
+local fake Groq server. Each stage records wall time, the process's peak RSS
+after it and how much that peak grew; --trace-memory adds tracemalloc's
+Python-heap peak per stage (slower) and --trace records tracing.py spans
+and adds their per-stage totals. --compare prints each stage's time
+against an earlier results file so regressions show up between commits.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timezone
+import config
+from benchmarks.synthetic_pdf import generate_pdf, sample_queries
+from benchmarks.fake_groq_server import start_server
+
+# Stage time growth beyond this ratio is flagged by --compare
+REGRESSION_RATIO = 1.10
+
+def _peak_rss_mb():
+    # ru_maxrss is kilobytes on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def _git_revision():
+    try:
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, cwd=root).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"],
+                                    capture_output=True, text=True, cwd=root).stdout.strip())
+        return commit or None, dirty
+    except OSError:
+        return None, False
+
+def _percentiles(values):
+    ordered = sorted(values)
+    return {
+        "mean": statistics.fmean(ordered),
+        "p50": ordered[len(ordered) // 2],
+        "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+    }
+
+@contextmanager
+def stage(results, name, trace_memory=False):
+    """Time the enclosed block and record memory figures under results[name]."""
+    record = {}
+    rss_before = _peak_rss_mb()
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record["seconds"] = time.perf_counter() - start
+        if trace_memory:
+            record["python_peak_mb"] = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+            tracemalloc.stop()
+        record["rss_peak_mb"] = _peak_rss_mb()
+        record["rss_growth_mb"] = record["rss_peak_mb"] - rss_before
+        results[name] = record
+
+def run(pages=50, num_queries=20, chat_turns=5, top_k=5, ttft=0.2, tokens_per_second=250.0, trace_memory=False,
+        trace=False):
+    """Run every stage once and return the results dict."""
+    # Imported here so import time isn't charged to the first stage
+    from groq import Groq
+    from pdf_processing import parse_pdf, chunk_text
+    from embedding import generate_embeddings, build_index
+    from model_registry import warm_up_embedding_model
+    from retrieval import query_index, format_context_from_results, context_token_budget
+    from chat_utils import rewrite_query
+    from streaming import iter_stream_text, render_stream
+    from tracing import set_tracing_enabled, reset_tracing, get_trace_stats
+    
+    set_tracing_enabled(trace)
+    reset_tracing()
+
+    stages = {}
+    queries = sample_queries(num_queries)
+    model = config.MODELS[0]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        pdf_path = os.path.join(tmp_dir, "synthetic.pdf")
+        with stage(stages, "generate_pdf", trace_memory):
+            generate_pdf(pdf_path, pages)
+
+        with stage(stages, "model_load", trace_memory):
+            warm_up_embedding_model()
+
+        with stage(stages, "parse_pdf", trace_memory):
+            text_content = parse_pdf(pdf_path)["text_content"]
+
+    with stage(stages, "chunk_text", trace_memory) as record:
+        chunks = chunk_text(text_content)
+    record["chunks"] = len(chunks)
+
+    with stage(stages, "generate_embeddings", trace_memory):
+        embeddings = generate_embeddings(chunks)
+
+    with stage(stages, "build_index", trace_memory):
+        index = build_index(embeddings)
+
+    latencies = []
+    all_results = []
+    with stage(stages, "query_index", trace_memory) as record:
+        for query in queries:
+            start = time.perf_counter()
+            all_results.append(query_index(query, index, chunks, top_k=top_k))
+            latencies.append(time.perf_counter() - start)
+    record.update({"queries": len(queries), "latency": _percentiles(latencies)})
+
+    packing = []
+    with stage(stages, "format_context", trace_memory) as record:
+        budget = context_token_budget(model, 1024)
+        for results in all_results:
+            stats = {}
+            format_context_from_results(results, token_budget=budget, stats=stats)
+            packing.append(stats)
+    record.update({
+        "token_budget": budget,
+        "tokens_before": statistics.fmean(s.get("tokens_before", 0) for s in packing),
+        "tokens_after": statistics.fmean(s.get("tokens_after", 0) for s in packing),
+    })
+
+    server, base_url = start_server(ttft=ttft, tokens_per_second=tokens_per_second)
+    try:
+        client = Groq(api_key="fake", base_url=base_url)
+        rewrite_seconds, ttfts, throughputs, totals = [], [], [], []
+        history = [{"role": "user", "content": queries[0]}, {"role": "assistant", "content": "It is described in chapter 1."}]
+        with stage(stages, "chat", trace_memory) as record:
+            for query in queries[:chat_turns]:
+                start = time.perf_counter()
+                follow_up = f"What about its {query.split()[3]}?"
+                rewritten = rewrite_query(follow_up, history, client)
+                rewrite_seconds.append(time.perf_counter() - start)
+                stream = client.chat.completions.create(
+                    model=model, messages=[{"role": "user", "content": rewritten}], max_tokens=1024, stream=True
+                )
+                stream_stats = {}
+                render_stream(iter_stream_text(stream, stream_stats), lambda text, final: None,
+                              start_time=start, stats=stream_stats)
+                totals.append(time.perf_counter() - start)
+                ttfts.append(stream_stats["ttft"])
+                throughputs.append(stream_stats["tokens_per_second"])
+        record.update({
+            "turns": len(totals),
+            "rewrite": _percentiles(rewrite_seconds),
+            "ttft": _percentiles(ttfts),
+            "tokens_per_second": statistics.fmean(throughputs),
+            "turn_latency": _percentiles(totals),
+            "fake_server": {"ttft": ttft, "tokens_per_second": tokens_per_second},
+        })
+    finally:
+        server.shutdown()
+
+    stages["parse_pdf"]["pages_per_second"] = pages / stages["parse_pdf"]["seconds"]
+    commit, dirty = _git_revision()
+    results = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "commit": commit,
+        "dirty": dirty,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {
+            "embedding_model": config.EMBEDDING_MODEL,
+            "embedding_quantize": config.EMBEDDING_QUANTIZE,
+            "chunk_size": config.CHUNK_SIZE,
+            "overlap": config.OVERLAP,
+            "index_type": config.INDEX_TYPE,
+            "vector_precision": config.VECTOR_PRECISION,
+        },
+        "params": {"pages": pages, "queries": num_queries, "chat_turns": chat_turns, "top_k": top_k},
+        "stages": stages,
+    }
+    if trace:
+        results["trace"] = get_trace_stats()
+    return results
+
+def compare(current, baseline):
+    """Print each stage's time against a baseline results dict."""
+    print(f"\nvs. {baseline.get('commit') or 'baseline'}:")
+    print(f"{'stage':>20} {'baseline s':>11} {'current s':>10} {'ratio':>7}")
+    for name, record in current["stages"].items():
+        old = baseline.get("stages", {}).get(name)
+        if not old or not old.get("seconds"):
+            continue
+        ratio = record["seconds"] / old["seconds"]
+        flag = "  REGRESSION" if ratio > REGRESSION_RATIO else ""
+        print(f"{name:>20} {old['seconds']:>11.3f} {record['seconds']:>10.3f} {ratio:>7.2f}{flag}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, default=50)
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("--chat-turns", type=int, default=5)
+    parser.add_argument("--ttft", type=float, default=0.2, help="fake server delay before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=250.0)
+    parser.add_argument("--trace-memory", action="store_true")
+    parser.add_argument("--trace", action="store_true", help="record pipeline spans and include their totals")
+    parser.add_argument("--output", default="bench_end_to_end.json")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    args = parser.parse_args()
+
+    results = run(args.pages, args.queries, args.chat_turns, ttft=args.ttft,
+                  tokens_per_second=args.tokens_per_second, trace_memory=args.trace_memory, trace=args.trace)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+
+    print(f"{'stage':>20} {'seconds':>10} {'peak RSS MB':>12} {'RSS growth MB':>14}")
+    for name, record in results["stages"].items():
+        print(f"{name:>20} {record['seconds']:>10.3f} {record['rss_peak_mb']:>12.1f} {record['rss_growth_mb']:>14.1f}")
+    query_latency = results["stages"]["query_index"]["latency"]
+    chat = results["stages"]["chat"]
+    print(f"\nquery latency p50/p95: {query_latency['p50'] * 1000:.1f}/{query_latency['p95'] * 1000:.1f} ms | "
+          f"chat TTFT p50: {chat['ttft']['p50'] * 1000:.0f} ms | {chat['tokens_per_second']:.0f} tokens/s")
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            compare(results, json.load(f))
+
+if __name__ == "__main__":
+    main()
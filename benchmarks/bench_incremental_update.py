@@ -0,0 +1,40 @@
+"""Compare incremental re-indexing of a revised PDF with full re-ingestion.
+
+Usage: python -m benchmarks.bench_incremental_update old.pdf new.pdf
+"""
+import argparse
+import time
+from ingestion import ingest_pdf_streaming
+from incremental import update_document
+
+def run(old_pdf, new_pdf):
+    """Return (full re-ingestion seconds, incremental update stats).
+
+    Both sides use the same header stripping and deduplication settings,
+    so they produce the same chunk set.
+    """
+    old_doc = ingest_pdf_streaming(old_pdf)
+    
+    start = time.perf_counter()
+    ingest_pdf_streaming(new_pdf)
+    full_seconds = time.perf_counter() - start
+    
+    _, stats = update_document(old_doc, new_pdf)
+    return full_seconds, stats
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("old_pdf")
+    parser.add_argument("new_pdf")
+    args = parser.parse_args()
+    
+    full_seconds, stats = run(args.old_pdf, args.new_pdf)
+    print(f"changed pages:       {stats['changed_pages']}/{stats['total_pages']}")
+    print(f"chunks reused:       {stats['reused_chunks']}")
+    print(f"chunks removed:      {stats['removed_chunks']}")
+    print(f"chunks embedded:     {stats['embedded_chunks']}")
+    print(f"full re-ingestion:   {full_seconds:.2f} s")
+    print(f"incremental update:  {stats['seconds']:.2f} s ({full_seconds / max(stats['seconds'], 1e-9):.1f}x faster)")
+
+if __name__ == "__main__":
+    main()
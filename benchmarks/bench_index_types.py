@@ -0,0 +1,72 @@
+"""Compare FAISS index types against the exact flat baseline: recall@k and query latency.
+
+Usage: python -m benchmarks.bench_index_types [--embeddings cache/documents/<key>/embeddings.npy]
+                                              [--num-vectors 50000] [--queries 200] [--k 5]
+Without --embeddings, random vectors are used, which is a pessimistic case for ANN recall.
+"""
+import argparse
+import time
+import numpy as np
+from config import VECTOR_DIM
+from embedding import build_index, set_search_params
+
+INDEX_TYPES = ["flat", "hnsw", "ivf_flat", "ivf_sq8", "ivf_pq"]
+
+def recall_at_k(truth_ids, found_ids):
+    """Mean fraction of the exact top-k neighbours that the ANN search also returned."""
+    hits = [len(set(t) & set(f)) / len(t) for t, f in zip(truth_ids, found_ids)]
+    return float(np.mean(hits))
+
+def run(embeddings, queries, k=5, nprobe=None, ef_search=None):
+    """Return one dict per index type with build time, mean query latency and recall@k."""
+    baseline = build_index(embeddings, index_type="flat")
+    _, truth_ids = baseline.search(queries, k)
+    
+    rows = []
+    for index_type in INDEX_TYPES:
+        start = time.perf_counter()
+        index = build_index(embeddings, index_type=index_type)
+        build_seconds = time.perf_counter() - start
+        if nprobe or ef_search:
+            set_search_params(index, nprobe=nprobe, ef_search=ef_search)
+        
+        start = time.perf_counter()
+        for query in queries:
+            index.search(query.reshape(1, -1), k)
+        latency_ms = (time.perf_counter() - start) * 1000 / len(queries)
+        
+        _, found_ids = index.search(queries, k)
+        rows.append({
+            "index_type": index_type,
+            "build_s": build_seconds,
+            "latency_ms": latency_ms,
+            "recall": recall_at_k(truth_ids, found_ids)
+        })
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--embeddings")
+    parser.add_argument("--num-vectors", type=int, default=50000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--nprobe", type=int)
+    parser.add_argument("--ef-search", type=int)
+    args = parser.parse_args()
+    
+    rng = np.random.default_rng(0)
+    if args.embeddings:
+        embeddings = np.load(args.embeddings).astype('float32')
+    else:
+        embeddings = rng.standard_normal((args.num_vectors, VECTOR_DIM)).astype('float32')
+    # Queries are perturbed database vectors so they resemble real lookups
+    picks = rng.choice(len(embeddings), size=min(args.queries, len(embeddings)), replace=False)
+    queries = embeddings[picks] + 0.01 * rng.standard_normal((len(picks), embeddings.shape[1])).astype('float32')
+    
+    print(f"{len(embeddings)} vectors, {len(queries)} queries, k={args.k}")
+    print(f"{'index':>10} {'build s':>10} {'ms/query':>10} {'recall@k':>10}")
+    for row in run(embeddings, queries, args.k, args.nprobe, args.ef_search):
+        print(f"{row['index_type']:>10} {row['build_s']:>10.2f} {row['latency_ms']:>10.3f} {row['recall']:>10.3f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+"""Measure parse_pdf throughput (pages/second) at different worker counts.
+
+Usage: python -m benchmarks.bench_parse_pdf path/to/file.pdf [--repeat 3]
+"""
+import argparse
+import os
+import time
+from pdf_processing import parse_pdf
+
+def run(pdf_path, worker_counts, repeat=3):
+    """Return a list of (workers, best seconds, pages/second) for each worker count."""
+    rows = []
+    for workers in worker_counts:
+        best = None
+        pages = 0
+        for _ in range(repeat):
+            start = time.perf_counter()
+            parsed = parse_pdf(pdf_path, workers=workers)
+            elapsed = time.perf_counter() - start
+            pages = parsed["metadata"]["pages"]
+            best = elapsed if best is None else min(best, elapsed)
+        rows.append((workers, best, pages / best if best else 0.0))
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("pdf_path")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    
+    cores = os.cpu_count() or 1
+    worker_counts = sorted({1, 2, 4, cores})
+    print(f"{'workers':>8} {'seconds':>10} {'pages/s':>10}")
+    for workers, seconds, pages_per_second in run(args.pdf_path, worker_counts, args.repeat):
+        print(f"{workers:>8} {seconds:>10.3f} {pages_per_second:>10.1f}")
+
+if __name__ == "__main__":
+    main()
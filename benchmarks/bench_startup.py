@@ -0,0 +1,111 @@
+"""App cold start: import time and time to first paint with eager vs. deferred heavy imports.
+
+Usage: python -m benchmarks.bench_startup [--repeat 3]
+
+Every measurement runs in a fresh interpreter. "eager" imports the modules
+app.py used to load at startup (torch, sentence_transformers, FAISS and
+PyMuPDF behind them) and warms the model synchronously, as the app did
+before; "lazy" imports only what app.py imports now and leaves warm-up to
+the background thread. Time to first paint is one full script run under
+streamlit.testing's AppTest, and is skipped if that isn't available.
+"""
+import argparse
+import ast
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+
+# Modules app.py imported at load time before heavy imports were deferred
+EAGER_MODULES = ["pdf_processing", "embedding", "ingestion", "incremental", "model_registry", "document_store",
+                 "index_manager", "corpus", "retrieval"]
+HEAVY_MODULES = ["torch", "sentence_transformers", "faiss", "pymupdf"]
+
+def app_startup_modules():
+    """Modules app.py imports at the top level."""
+    with open(APP_PATH, "r", encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    modules = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            modules.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module:
+            modules.append(node.module)
+    return modules
+
+IMPORT_SCRIPT = """
+import importlib, json, sys, time
+start = time.perf_counter()
+for name in {modules!r}:
+    importlib.import_module(name)
+imported = time.perf_counter() - start
+warm_up = 0.0
+if {warm_up!r}:
+    start = time.perf_counter()
+    importlib.import_module("model_registry").warm_up_embedding_model()
+    warm_up = time.perf_counter() - start
+print(json.dumps({{"import": imported, "warm_up": warm_up,
+                  "heavy_loaded": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+PAINT_SCRIPT = """
+import importlib, json, time
+start = time.perf_counter()
+for name in {preload!r}:
+    importlib.import_module(name)
+if {warm_up!r}:
+    importlib.import_module("model_registry").warm_up_embedding_model()
+from streamlit.testing.v1 import AppTest
+app = AppTest.from_file({app_path!r}, default_timeout=600)
+app.run()
+print(json.dumps({{"paint": time.perf_counter() - start}}))
+"""
+
+def _run(script, env=None):
+    output = subprocess.run(
+        [sys.executable, "-c", script], capture_output=True, text=True, check=True,
+        cwd=os.path.dirname(APP_PATH), env=dict(os.environ, **(env or {}))
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def measure_imports(modules, warm_up, repeat):
+    runs = [_run(IMPORT_SCRIPT.format(modules=modules, warm_up=warm_up, heavy=HEAVY_MODULES)) for _ in range(repeat)]
+    return {
+        "import": statistics.median(run["import"] for run in runs),
+        "warm_up": statistics.median(run["warm_up"] for run in runs),
+        "heavy_loaded": runs[-1]["heavy_loaded"]
+    }
+
+def measure_first_paint(preload, warm_up, repeat):
+    try:
+        import streamlit.testing.v1  # noqa: F401
+    except ImportError:
+        return None
+    # Keep the lazy run from warming up in the background while it is being timed
+    env = {"EMBEDDING_WARMUP_ON_STARTUP": "1" if warm_up else "0"}
+    script = PAINT_SCRIPT.format(preload=preload, warm_up=warm_up, app_path=APP_PATH)
+    return statistics.median(_run(script, env)["paint"] for _ in range(repeat))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    startup = [name for name in app_startup_modules() if name not in ("streamlit", "groq")]
+    scenarios = [
+        ("eager", startup + [m for m in EAGER_MODULES if m not in startup], True),
+        ("lazy", startup, False),
+    ]
+    print(f"{'startup':>8} {'imports s':>10} {'warm-up s':>10} {'first paint s':>14}  heavy modules loaded")
+    for name, modules, warm_up in scenarios:
+        imports = measure_imports(modules, warm_up, args.repeat)
+        paint = measure_first_paint(modules if warm_up else [], warm_up, args.repeat)
+        paint_text = f"{paint:>14.2f}" if paint is not None else f"{'n/a':>14}"
+        print(f"{name:>8} {imports['import']:>10.2f} {imports['warm_up']:>10.2f} {paint_text}  "
+              f"{', '.join(imports['heavy_loaded']) or 'none'}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Compare vector storage precisions: bytes per 10k chunks, query latency and recall@k vs. float32.
+
+Usage: python -m benchmarks.bench_vector_precision [--embeddings path.npy] [--num-vectors 20000]
+                                                   [--queries 200] [--k 5]
+"""
+import argparse
+import time
+import numpy as np
+import faiss
+from config import VECTOR_DIM
+from embedding import create_index, train_if_needed, build_index
+from benchmarks.bench_index_types import recall_at_k
+
+def _build_variants(embeddings):
+    """Yield (name, index) for each storage precision under test."""
+    for precision in ("float32", "float16", "int8"):
+        index = create_index(precision)
+        train_if_needed(index, embeddings)
+        index.add(embeddings)
+        yield precision, index
+    yield "ivf_pq", build_index(embeddings, index_type="ivf_pq")
+
+def run(embeddings, queries, k=5):
+    """Return one dict per precision with bytes per 10k vectors, latency and recall@k."""
+    baseline = create_index("float32")
+    baseline.add(embeddings)
+    _, truth_ids = baseline.search(queries, k)
+    
+    rows = []
+    for name, index in _build_variants(embeddings):
+        index_bytes = faiss.serialize_index(index).nbytes
+        
+        start = time.perf_counter()
+        for query in queries:
+            index.search(query.reshape(1, -1), k)
+        latency_ms = (time.perf_counter() - start) * 1000 / len(queries)
+        
+        _, found_ids = index.search(queries, k)
+        rows.append({
+            "precision": name,
+            "mb_per_10k": index_bytes / len(embeddings) * 10000 / (1024 * 1024),
+            "latency_ms": latency_ms,
+            "recall": recall_at_k(truth_ids, found_ids)
+        })
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--embeddings")
+    parser.add_argument("--num-vectors", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    args = parser.parse_args()
+    
+    rng = np.random.default_rng(0)
+    if args.embeddings:
+        embeddings = np.load(args.embeddings).astype('float32')
+    else:
+        # Unit-norm vectors, like all-mpnet-base-v2 output
+        embeddings = rng.standard_normal((args.num_vectors, VECTOR_DIM)).astype('float32')
+        embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    picks = rng.choice(len(embeddings), size=min(args.queries, len(embeddings)), replace=False)
+    queries = embeddings[picks] + 0.01 * rng.standard_normal((len(picks), embeddings.shape[1])).astype('float32')
+    
+    print(f"{len(embeddings)} vectors, {len(queries)} queries, k={args.k}")
+    print(f"{'precision':>10} {'MB/10k':>10} {'ms/query':>10} {'recall@k':>10}")
+    for row in run(embeddings, queries, args.k):
+        print(f"{row['precision']:>10} {row['mb_per_10k']:>10.1f} {row['latency_ms']:>10.3f} {row['recall']:>10.3f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""A local stand-in for Groq's OpenAI-compatible chat completions endpoint.
+
+Usage: python -m benchmarks.fake_groq_server [--port 8765] [--ttft 0.2] [--tokens-per-second 250]
+
+Point a client at it with Groq(api_key="fake", base_url="http://127.0.0.1:8765").
+Streamed requests get Server-Sent Events chunks, with a fixed delay before the
+first token and a steady token rate after it; non-streamed requests (query
+rewriting) get the current query back. Responses are deterministic, so the chat
+path can be benchmarked offline without rate limits or network noise.
+"""
+import argparse
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ANSWER_WORDS = ("The pump pressure is regulated by the controller according to the calibration procedure "
+                "described on the referenced pages, with the alarm threshold given in $P_{max}$ units.").split()
+
+def _answer_tokens(max_tokens, answer_tokens):
+    count = min(max_tokens or answer_tokens, answer_tokens)
+    return [ANSWER_WORDS[i % len(ANSWER_WORDS)] + " " for i in range(count)]
+
+def _make_handler(ttft, tokens_per_second, answer_tokens):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass  # Keep benchmark output clean
+
+        def do_POST(self):
+            if not self.path.endswith("/chat/completions"):
+                self.send_error(404)
+                return
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            base = {"id": "chatcmpl-fake", "created": int(time.time()), "model": request.get("model", "fake")}
+            if request.get("stream"):
+                self._stream(request, base)
+            else:
+                self._complete(request, base)
+
+        def _complete(self, request, base):
+            # Echo the current query so rewriting leaves it unchanged
+            prompt = request["messages"][-1]["content"]
+            match = re.search(r'Current Query: "(.*)"', prompt)
+            content = match.group(1) if match else "OK"
+            body = json.dumps(dict(base, object="chat.completion", choices=[{
+                "index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"
+            }], usage={"prompt_tokens": len(prompt) // 4, "completion_tokens": len(content) // 4 + 1,
+                       "total_tokens": len(prompt) // 4 + len(content) // 4 + 1})).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _send_event(self, payload):
+            data = f"data: {payload}\n\n".encode("utf-8")
+            self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+
+        def _stream(self, request, base):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+
+            tokens = _answer_tokens(request.get("max_tokens"), answer_tokens)
+            time.sleep(ttft)
+            interval = 1.0 / tokens_per_second if tokens_per_second else 0.0
+            next_send = time.perf_counter()
+            for i, token in enumerate(tokens):
+                delta = {"content": token}
+                if i == 0:
+                    delta["role"] = "assistant"
+                self._send_event(json.dumps(dict(base, object="chat.completion.chunk", choices=[
+                    {"index": 0, "delta": delta, "finish_reason": None}
+                ])))
+                next_send += interval
+                delay = next_send - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            prompt_tokens = sum(len(m.get("content", "")) for m in request.get("messages", [])) // 4
+            self._send_event(json.dumps(dict(base, object="chat.completion.chunk", choices=[
+                {"index": 0, "delta": {}, "finish_reason": "stop"}
+            ], x_groq={"id": "req-fake", "usage": {
+                "prompt_tokens": prompt_tokens, "completion_tokens": len(tokens),
+                "total_tokens": prompt_tokens + len(tokens)
+            }})))
+            self._send_event("[DONE]")
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+
+    return Handler
+
+def start_server(port=0, ttft=0.2, tokens_per_second=250.0, answer_tokens=400):
+    """Start the fake server on a daemon thread; returns (server, base_url). Call server.shutdown() to stop."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), _make_handler(ttft, tokens_per_second, answer_tokens))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--ttft", type=float, default=0.2, help="seconds before the first streamed token")
+    parser.add_argument("--tokens-per-second", type=float, default=250.0)
+    parser.add_argument("--answer-tokens", type=int, default=400)
+    args = parser.parse_args()
+    server, base_url = start_server(args.port, args.ttft, args.tokens_per_second, args.answer_tokens)
+    print(f"Fake Groq endpoint at {base_url} (Ctrl+C to stop)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Deterministic synthetic PDFs for benchmarks.
+
+Usage: python -m benchmarks.synthetic_pdf out.pdf [--pages 50] [--seed 0]
+
+Pages carry a running header and footer (for the header/footer stripper),
+chapter and numbered-section headings matching extract_section_info, an
+outline, and technical-sounding body text with identifiers, so every stage
+of the pipeline has realistic work to do.
+"""
+import argparse
+import random
+import pymupdf
+
+WORDS = ("pump pressure valve flow rate error signal torque model system value sensor controller "
+         "calibration housing seal bearing motor voltage current threshold limit cycle alarm reset "
+         "maintenance inspection interval procedure operator manual").split()
+HEADER = "ACME Industrial Systems - Technical Reference Manual"
+
+def _sentence(rng):
+    words = [rng.choice(WORDS) for _ in range(rng.randint(6, 24))]
+    if rng.random() < 0.3:
+        words.insert(rng.randint(0, len(words)), f"{rng.choice('EPV')}-{rng.randint(100, 999)}")
+    return " ".join(words).capitalize() + "."
+
+def sample_queries(num_queries, seed=0):
+    """Deterministic questions over the synthetic vocabulary."""
+    rng = random.Random(seed + 1)
+    return [f"What is the {rng.choice(WORDS)} {rng.choice(WORDS)} for {rng.choice('EPV')}-{rng.randint(100, 999)}?"
+            for _ in range(num_queries)]
+
+def generate_pdf(path, pages=50, sentences_per_page=45, seed=0):
+    """Write a synthetic PDF to path and return its number of pages."""
+    rng = random.Random(seed)
+    doc = pymupdf.open()
+    toc = []
+    chapter = 0
+    section = 0
+    for page_number in range(1, pages + 1):
+        page = doc.new_page()
+        heading = ""
+        if page_number == 1 or rng.random() < 0.1:
+            chapter += 1
+            section = 0
+            heading = f"Chapter {chapter}: {rng.choice(WORDS).title()} {rng.choice(WORDS).title()}"
+            toc.append([1, heading, page_number])
+        elif rng.random() < 0.3:
+            section += 1
+            heading = f"{chapter}.{section} {rng.choice(WORDS).title()} {rng.choice(WORDS).title()}"
+            toc.append([2, heading, page_number])
+
+        # Headings must open the page text for extract_section_info to see them
+        body = " ".join(_sentence(rng) for _ in range(sentences_per_page))
+        page.insert_textbox(pymupdf.Rect(50, 40, 560, 60), heading or HEADER, fontsize=9)
+        page.insert_textbox(pymupdf.Rect(50, 62, 560, 80), HEADER if heading else "", fontsize=9)
+        page.insert_textbox(pymupdf.Rect(50, 90, 560, 760), body, fontsize=8)
+        page.insert_textbox(pymupdf.Rect(50, 770, 560, 790), f"Page {page_number} of {pages}", fontsize=8)
+    doc.set_toc(toc)
+    doc.save(path)
+    doc.close()
+    return pages
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("path")
+    parser.add_argument("--pages", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    generate_pdf(args.path, args.pages, seed=args.seed)
+    print(f"Wrote {args.pages} pages to {args.path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""Ingest a folder (or glob) of PDFs into the document cache without the web app.
+
+Usage: python bulk_ingest.py docs/ "reports/**/*.pdf" [--workers 4]
+
+Each PDF is keyed by its content hash exactly as the app keys uploads, so
+files already cached are skipped and users who later upload the same file
+get it instantly. Entries are written atomically, so an interrupted run
+resumes by simply running the same command again.
+"""
+import argparse
+import glob
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from config import MAX_CACHE_SIZE_MB
+from utils import get_cache_size_mb
+from ingestion import ingest_pdf_streaming
+from lexical_index import build_bm25_index
+from document_store import compute_document_key, has_document, save_document, remove_stale_tmp_dirs
+
+def find_pdfs(patterns):
+    """Expand directories (searched recursively) and glob patterns into a sorted list of PDF paths."""
+    paths = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, "**", "*.pdf")
+        for path in glob.glob(pattern, recursive=True):
+            if os.path.isfile(path) and path.lower().endswith(".pdf"):
+                paths.add(os.path.abspath(path))
+    return sorted(paths)
+
+def _init_worker(num_threads):
+    # Split the cores between worker processes instead of letting each take all of them
+    import torch
+    torch.set_num_threads(num_threads)
+
+def ingest_one(path, doc_key):
+    """Ingest and save a single PDF; runs inside a worker process."""
+    start = time.perf_counter()
+    result = ingest_pdf_streaming(path)
+    bm25 = build_bm25_index(result["chunks"])
+    saved = save_document(doc_key, result["chunks"], None, result["index"], result["metadata"], bm25=bm25)
+    return {
+        "path": path,
+        "pages": result["metadata"]["pages"],
+        "chunks": len(result["chunks"]),
+        "seconds": time.perf_counter() - start,
+        "saved": saved
+    }
+
+def run(paths, workers=1):
+    """Ingest every uncached PDF in paths and return a summary dict."""
+    start = time.perf_counter()
+    stale = remove_stale_tmp_dirs()
+    if stale:
+        print(f"Removed {stale} half-written cache entries from an interrupted run")
+
+    pending = []
+    skipped = 0
+    for path in paths:
+        with open(path, "rb") as f:
+            doc_key = compute_document_key(f.read())
+        if has_document(doc_key):
+            skipped += 1
+        else:
+            pending.append((path, doc_key))
+    print(f"{len(paths)} PDFs found, {skipped} already cached, {len(pending)} to ingest")
+
+    summary = {"found": len(paths), "skipped": skipped, "ingested": 0, "failed": 0, "pages": 0, "chunks": 0}
+
+    def record(i, path, outcome):
+        if isinstance(outcome, Exception) or not outcome["saved"]:
+            summary["failed"] += 1
+            reason = outcome if isinstance(outcome, Exception) else "could not be saved"
+            print(f"[{i}/{len(pending)}] {os.path.basename(path)}: failed ({reason})")
+            return
+        summary["ingested"] += 1
+        summary["pages"] += outcome["pages"]
+        summary["chunks"] += outcome["chunks"]
+        print(f"[{i}/{len(pending)}] {os.path.basename(path)}: "
+              f"{outcome['pages']} pages, {outcome['chunks']} chunks in {outcome['seconds']:.1f}s")
+
+    ingest_start = time.perf_counter()
+    if workers <= 1 or len(pending) <= 1:
+        for i, (path, doc_key) in enumerate(pending, 1):
+            try:
+                outcome = ingest_one(path, doc_key)
+            except Exception as e:
+                outcome = e
+            record(i, path, outcome)
+    else:
+        workers = min(workers, len(pending))
+        threads = max(1, (os.cpu_count() or 1) // workers)
+        # Spawn rather than fork: torch and FAISS thread pools don't survive a fork
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                 initializer=_init_worker, initargs=(threads,)) as executor:
+            futures = {executor.submit(ingest_one, path, doc_key): path for path, doc_key in pending}
+            for i, future in enumerate(as_completed(futures), 1):
+                try:
+                    outcome = future.result()
+                except Exception as e:
+                    outcome = e
+                record(i, futures[future], outcome)
+
+    summary["ingest_seconds"] = time.perf_counter() - ingest_start
+    summary["total_seconds"] = time.perf_counter() - start
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("inputs", nargs="+", help="PDF files, directories or glob patterns")
+    parser.add_argument("--workers", type=int, default=max(1, min(4, (os.cpu_count() or 1) // 2)),
+                        help="documents ingested in parallel (each worker loads its own model)")
+    args = parser.parse_args()
+
+    paths = find_pdfs(args.inputs)
+    if not paths:
+        print("No PDFs found")
+        return
+
+    summary = run(paths, args.workers)
+    seconds = summary["ingest_seconds"] or 1e-9
+    print()
+    print(f"Ingested {summary['ingested']}, skipped {summary['skipped']} (cached), "
+          f"failed {summary['failed']} in {summary['total_seconds']:.1f}s")
+    if summary["ingested"]:
+        print(f"Throughput: {summary['ingested'] / seconds * 60:.1f} docs/min, "
+              f"{summary['pages'] / seconds:.1f} pages/s, {summary['chunks'] / seconds:.1f} chunks/s")
+    cache_mb = get_cache_size_mb()
+    print(f"Cache size: {cache_mb:.0f} MB of {MAX_CACHE_SIZE_MB} MB")
+    if cache_mb > MAX_CACHE_SIZE_MB * 0.8:
+        print("Warning: the cache is near its limit; older entries are evicted as new ones are written. "
+              "Raise MAX_CACHE_SIZE_MB to keep the whole collection cached.")
+
+if __name__ == "__main__":
+    main()
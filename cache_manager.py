@@ -0,0 +1,317 @@
+import heapq
+import json
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from config import CACHE_DIR, MAX_CACHE_SIZE_MB, CACHE_EVICTION_POLICY, CACHE_ACCESS_RECORD_INTERVAL
+from utils import ensure_dir_exists
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to unlocked updates
+    fcntl = None
+
+# The manifest tracks each cached document directory so size checks and
+# eviction never need to walk the cache:
+# {doc_key: {"size": bytes, "last_access": epoch seconds, "hits": int}}
+# On disk it is a snapshot (MANIFEST_FILE) plus an append-only log of changes
+# since (LOG_FILE, one JSON record per line). Each process keeps the manifest,
+# its total size and an eviction heap in memory and, under the lock, only
+# replays the log lines other processes appended since its last look, so an
+# update costs O(log n) rather than a rewrite of every entry. The log is
+# folded back into the snapshot once it outgrows the manifest.
+MANIFEST_FILE = "manifest.json"
+LOG_FILE = "manifest.log"
+LOCK_FILE = ".manifest.lock"
+LOG_COMPACT_MIN_RECORDS = 1000
+
+# In-memory manifest per cache directory; only touched while holding the file lock
+_states = {}
+
+# Accesses waiting to be appended by the background writer: {(cache_dir, doc_key): [hits, last_access]}
+_pending_accesses = {}
+_pending_lock = threading.Lock()
+_flush_scheduled = False
+_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cache-manifest")
+
+# Last time this process recorded an access per key, to throttle log records
+_last_recorded = {}
+
+def _documents_dir(cache_dir):
+    return os.path.join(cache_dir, "documents")
+
+@contextmanager
+def file_lock(cache_dir, name):
+    """Hold an exclusive lock on cache_dir/name across processes (no-op without fcntl)."""
+    ensure_dir_exists(cache_dir)
+    with open(os.path.join(cache_dir, name), "a") as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def _manifest_lock(cache_dir):
+    """Hold an exclusive lock on the manifest across processes."""
+    return file_lock(cache_dir, LOCK_FILE)
+
+def _dir_size(path):
+    """Total bytes of the files directly under a document directory."""
+    total = 0
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_file():
+                total += entry.stat().st_size
+    return total
+
+def _rebuild_manifest(cache_dir):
+    """Seed a manifest from existing document directories; only runs when none exists."""
+    manifest = {}
+    documents_dir = _documents_dir(cache_dir)
+    if os.path.exists(documents_dir):
+        with os.scandir(documents_dir) as entries:
+            for entry in entries:
+                if entry.is_dir() and ".tmp-" not in entry.name:
+                    manifest[entry.name] = {
+                        "size": _dir_size(entry.path),
+                        "last_access": entry.stat().st_mtime,
+                        "hits": 0
+                    }
+    return manifest
+
+def _read_snapshot(cache_dir):
+    path = os.path.join(cache_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return _rebuild_manifest(cache_dir)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"Error reading cache manifest, rebuilding: {e}")
+        return _rebuild_manifest(cache_dir)
+
+def _log_id(path):
+    """Identify the current log file; compaction replaces it with a new inode."""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_dev, st.st_ino)
+
+def _eviction_key(entry, policy):
+    if policy == "lfu":
+        return (entry["hits"], entry["last_access"])
+    return entry["last_access"]
+
+def _apply(state, record):
+    """Apply one log record to the in-memory manifest and push the changed entry onto the heaps."""
+    manifest = state["manifest"]
+    doc_key = record["key"]
+    if record["op"] == "remove":
+        entry = manifest.pop(doc_key, None)
+        if entry is not None:
+            state["total"] -= entry["size"]
+        return
+    
+    if record["op"] == "write":
+        old = manifest.get(doc_key)
+        if old is not None:
+            state["total"] -= old["size"]
+        entry = manifest[doc_key] = {"size": record["size"], "last_access": record["time"], "hits": 0}
+        state["total"] += entry["size"]
+    else:
+        entry = manifest.get(doc_key)
+        if entry is None:
+            return
+        entry["last_access"] = max(entry["last_access"], record["time"])
+        entry["hits"] += record["hits"]
+    # Older heap items for this key become stale and are skipped when popped
+    for policy, heap in state["heaps"].items():
+        heapq.heappush(heap, (_eviction_key(entry, policy), doc_key))
+
+def _sync(cache_dir):
+    """Bring this process's manifest up to date with the log. Caller holds the manifest lock."""
+    log_path = os.path.join(cache_dir, LOG_FILE)
+    log_id = _log_id(log_path)
+    state = _states.get(cache_dir)
+    if state is None or state["log_id"] != log_id:
+        # First use in this process, or another process compacted the log
+        manifest = _read_snapshot(cache_dir)
+        state = _states[cache_dir] = {
+            "manifest": manifest,
+            "total": sum(entry["size"] for entry in manifest.values()),
+            "heaps": {},
+            "log_id": log_id,
+            "offset": 0,
+            "records": 0
+        }
+    if log_id is None:
+        return state
+    
+    with open(log_path, "rb") as f:
+        f.seek(state["offset"])
+        data = f.read()
+    # A trailing partial line is an append cut short by a crash; later appends start on a new line
+    end = data.rfind(b"\n") + 1
+    for line in data[:end].splitlines():
+        try:
+            _apply(state, json.loads(line))
+        except (ValueError, KeyError):
+            continue
+        state["records"] += 1
+    state["offset"] += end
+    return state
+
+def _append(cache_dir, state, records):
+    """Apply records and append them to the log; compacts it once it outgrows the manifest."""
+    if not records:
+        return
+    for record in records:
+        _apply(state, record)
+    
+    log_path = os.path.join(cache_dir, LOG_FILE)
+    lines = "".join(json.dumps(record, separators=(",", ":")) + "\n" for record in records)
+    with open(log_path, "ab") as f:
+        if f.tell() > state["offset"]:
+            f.write(b"\n")  # Terminate a partial line left by a crashed writer
+        f.write(lines.encode("utf-8"))
+        state["offset"] = f.tell()
+        st = os.fstat(f.fileno())
+    state["log_id"] = (st.st_dev, st.st_ino)
+    state["records"] += len(records)
+    
+    if state["records"] > max(LOG_COMPACT_MIN_RECORDS, 2 * len(state["manifest"])):
+        _compact(cache_dir, state)
+
+def _compact(cache_dir, state):
+    """Write the manifest as the new snapshot and start an empty log."""
+    path = os.path.join(cache_dir, MANIFEST_FILE)
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state["manifest"], f, separators=(",", ":"))
+    os.replace(tmp_path, path)
+    
+    log_path = os.path.join(cache_dir, LOG_FILE)
+    tmp_path = f"{log_path}.tmp-{os.getpid()}"
+    open(tmp_path, "wb").close()
+    os.replace(tmp_path, log_path)
+    state["log_id"] = _log_id(log_path)
+    state["offset"] = 0
+    state["records"] = 0
+
+def _heap(state, policy):
+    """Return the eviction heap for policy, rebuilding it when stale items dominate."""
+    heap = state["heaps"].get(policy)
+    if heap is None or len(heap) > 2 * len(state["manifest"]) + 64:
+        heap = [(_eviction_key(entry, policy), doc_key) for doc_key, entry in state["manifest"].items()]
+        heapq.heapify(heap)
+        state["heaps"][policy] = heap
+    return heap
+
+def _evict(cache_dir, state, max_size_mb, policy, keep=None):
+    """Remove entries in eviction order until the cache is at 80% of max_size_mb.
+
+    Each eviction pops the incrementally maintained heap, O(log n); items
+    whose entry changed or was removed since they were pushed are skipped.
+    """
+    max_bytes = max_size_mb * 1024 * 1024
+    if state["total"] <= max_bytes:
+        return []
+    
+    manifest = state["manifest"]
+    heap = _heap(state, policy)
+    evicted = []
+    kept = []
+    # Keep deleting until we're at 80% of max
+    while heap and state["total"] > max_bytes * 0.8:
+        key, doc_key = heapq.heappop(heap)
+        entry = manifest.get(doc_key)
+        if entry is None or _eviction_key(entry, policy) != key:
+            continue
+        if doc_key == keep:
+            kept.append((key, doc_key))
+            continue
+        shutil.rmtree(os.path.join(_documents_dir(cache_dir), doc_key), ignore_errors=True)
+        state["total"] -= manifest.pop(doc_key)["size"]
+        evicted.append(doc_key)
+    for item in kept:
+        heapq.heappush(heap, item)
+    # Entries are already gone from the manifest; the records only tell other processes
+    _append(cache_dir, state, [{"op": "remove", "key": doc_key} for doc_key in evicted])
+    return evicted
+
+def _flush_accesses():
+    """Append every pending access to the log, one locked append per cache directory."""
+    global _flush_scheduled
+    with _pending_lock:
+        pending = dict(_pending_accesses)
+        _pending_accesses.clear()
+        _flush_scheduled = False
+    
+    by_dir = {}
+    for (cache_dir, doc_key), (hits, last_access) in pending.items():
+        by_dir.setdefault(cache_dir, []).append({"op": "access", "key": doc_key, "time": last_access, "hits": hits})
+    for cache_dir, records in by_dir.items():
+        try:
+            with _manifest_lock(cache_dir):
+                state = _sync(cache_dir)
+                _append(cache_dir, state, [record for record in records if record["key"] in state["manifest"]])
+        except Exception as e:
+            print(f"Error updating cache manifest: {e}")
+
+def record_write(doc_key, cache_dir=CACHE_DIR, max_size_mb=MAX_CACHE_SIZE_MB, policy=CACHE_EVICTION_POLICY):
+    """Record a newly written document entry and evict others if the cache is over its limit."""
+    doc_dir = os.path.join(_documents_dir(cache_dir), doc_key)
+    size = _dir_size(doc_dir)
+    # Pending accesses go first so recently read entries aren't evicted as cold
+    _flush_accesses()
+    with _manifest_lock(cache_dir):
+        state = _sync(cache_dir)
+        _append(cache_dir, state, [{"op": "write", "key": doc_key, "size": size, "time": time.time()}])
+        evicted = _evict(cache_dir, state, max_size_mb, policy, keep=doc_key)
+    for doc_key in evicted:
+        print(f"Evicted cached document: {doc_key}")
+    return evicted
+
+def record_access(doc_key, cache_dir=CACHE_DIR, min_interval=CACHE_ACCESS_RECORD_INTERVAL):
+    """Queue a last-access/hit update for a document, at most once per min_interval seconds.
+
+    Returns immediately; queued accesses are appended to the log in one
+    batch by a background thread.
+    """
+    global _flush_scheduled
+    now = time.time()
+    if now - _last_recorded.get(doc_key, 0) < min_interval:
+        return
+    _last_recorded[doc_key] = now
+    with _pending_lock:
+        pending = _pending_accesses.setdefault((cache_dir, doc_key), [0, now])
+        pending[0] += 1
+        pending[1] = now
+        if _flush_scheduled:
+            return
+        _flush_scheduled = True
+    _writer.submit(_flush_accesses)
+
+def remove_entry(doc_key, cache_dir=CACHE_DIR):
+    """Forget a document entry, e.g. after its files turned out to be unreadable."""
+    with _manifest_lock(cache_dir):
+        state = _sync(cache_dir)
+        if doc_key in state["manifest"]:
+            _append(cache_dir, state, [{"op": "remove", "key": doc_key}])
+
+def get_cache_size_bytes(cache_dir=CACHE_DIR):
+    """Total size of tracked cache entries, kept as a running sum of the manifest."""
+    with _manifest_lock(cache_dir):
+        return _sync(cache_dir)["total"]
+
+def enforce_cache_limit(cache_dir=CACHE_DIR, max_size_mb=MAX_CACHE_SIZE_MB, policy=CACHE_EVICTION_POLICY):
+    """Evict entries until the cache fits max_size_mb; returns the evicted keys."""
+    with _manifest_lock(cache_dir):
+        state = _sync(cache_dir)
+        return _evict(cache_dir, state, max_size_mb, policy)
@@ -1,11 +1,68 @@
-def rewrite_query(query, conversation_history, client):
+import re
+from tracing import traced, annotate
+
+# Words that usually point back at something said earlier in the conversation
+ANAPHORA_PATTERN = re.compile(
+    r"\b(it|its|it's|this|that|these|those|they|them|their|theirs|he|him|his|she|her|hers|"
+    r"former|latter|above|aforementioned|same|previous|earlier|one|ones)\b",
+    re.IGNORECASE
+)
+
+# Follow-up openers that only make sense with the previous turn in mind
+FOLLOW_UP_PATTERN = re.compile(
+    r"^\s*(what about|how about|and|also|but|so|why|why not|then|more|elaborate|explain (more|further)|"
+    r"tell me more|go on|continue|example|examples|another|same for|what else)\b",
+    re.IGNORECASE
+)
+
+# Capitalized mid-sentence words, quoted phrases, identifiers with digits: a named subject
+NAMED_SUBJECT_PATTERN = re.compile(r"(?<=\s)[A-Z][\w-]+|\"[^\"]+\"|'[^']+'|\b\w*\d\w*\b")
+
+def needs_rewrite(query):
+    """Cheap local check for whether a follow-up query depends on earlier context.
+
+    Returns False for queries that read as self-contained so the LLM rewrite
+    round-trip can be skipped; errs on the side of True when unsure.
+    """
+    words = query.split()
+    if not words:
+        return False
+    if FOLLOW_UP_PATTERN.search(query):
+        return True
+    if ANAPHORA_PATTERN.search(query):
+        return True
+    # Very short queries ("why?", "which one", "formula?") rarely stand alone
+    if len(words) <= 3 and not NAMED_SUBJECT_PATTERN.search(query):
+        return True
+    return False
+
+def _normalize_query(query):
+    return " ".join(query.lower().split())
+
+@traced("chat.rewrite_query")
+def rewrite_query(query, conversation_history, client, cache=None, stats=None):
     """
     Rewrite ambiguous follow-up queries based on conversation history.
     Optimized for cloud deployment with better error handling.
+
+    Self-contained queries are filtered out locally by needs_rewrite. If a
+    cache dict is given, rewrites are memoized per (query, previous
+    question); a stats dict gets llm_calls, skipped_by_gate and cache_hits
+    counters.
     """
+    if stats is not None:
+        for counter in ("llm_calls", "skipped_by_gate", "cache_hits"):
+            stats.setdefault(counter, 0)
+    
     # Return original query if conversation history is too short
     if len(conversation_history) < 2:
         return query
+    
+    if not needs_rewrite(query):
+        annotate(skipped_by_gate=True)
+        if stats is not None:
+            stats["skipped_by_gate"] += 1
+        return query
         
     try:
         # Get the last few exchanges (up to 3 for context)
@@ -26,6 +83,13 @@ def rewrite_query(query, conversation_history, client):
         # If we couldn't find a valid exchange, return original query
         if not user_message or not system_response:
             return query
+        
+        cache_key = (_normalize_query(query), _normalize_query(user_message))
+        if cache is not None and cache_key in cache:
+            annotate(cache_hit=True)
+            if stats is not None:
+                stats["cache_hits"] += 1
+            return cache[cache_key]
             
         # Prepare a simplified context for the rewriting model
         # Truncate long messages to avoid token limits
@@ -55,12 +119,19 @@ Output ONLY the rewritten or original query with NO explanation."""
             max_tokens=100
         )
         
+        annotate(llm_call=True, cache_hit=False)
+        if stats is not None:
+            stats["llm_calls"] += 1
+        
         rewritten_query = response.choices[0].message.content.strip()
+        annotate(rewritten=rewritten_query != query)
         
         # If rewritten query is empty, too short, or too different, fall back to original
         if not rewritten_query or len(rewritten_query) < 5 or len(rewritten_query) > len(query) * 3:
-            return query
-            
+            rewritten_query = query
+        
+        if cache is not None:
+            cache[cache_key] = rewritten_query
         return rewritten_query
         
     except Exception as e:
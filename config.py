@@ -7,13 +7,119 @@ load_dotenv()
 # Vector embedding dimension for sentence-transformers/all-mpnet-base-v2
 VECTOR_DIM = 768
 
-# Text chunking parameters
-CHUNK_SIZE = 900
-OVERLAP = 40
+# Text chunking parameters, counted in embedding-model tokens. all-mpnet-base-v2 truncates
+# input at 384 word-pieces including [CLS]/[SEP]; anything past that is never embedded.
+EMBEDDING_MAX_TOKENS = 384
+CHUNK_SIZE = EMBEDDING_MAX_TOKENS - 2
+OVERLAP = 64  # tokens of trailing whole sentences repeated at the start of the next chunk
+# Sentence -> token counts kept so repeated sentences are tokenized once, bounded by memory
+TOKEN_COUNT_CACHE_MB = 16
+# Longer texts (whole chunks, prompts) rarely repeat verbatim; they are counted but not cached
+TOKEN_COUNT_CACHE_MAX_CHARS = 1000
+
+# PDF parsing: worker processes for page extraction (1 = serial, 0 = all cores)
+PARSE_WORKERS = int(os.getenv('PARSE_WORKERS', '1'))
+# Don't spin up a worker for fewer pages than this; process startup isn't free
+PARSE_MIN_PAGES_PER_WORKER = 25
+
+# How vectors are held inside exhaustive indexes: "float32", "float16" or "int8" (SQ8)
+VECTOR_PRECISION = os.getenv('VECTOR_PRECISION', 'float32')
+SQ8_RANGE_MARGIN = 0.2  # fraction by which trained SQ8 ranges are widened
+# dtype of embeddings.npy in the on-disk cache
+EMBEDDING_STORAGE_DTYPE = os.getenv('EMBEDDING_STORAGE_DTYPE', 'float16')
+
+# FAISS index type: "flat", "sq_fp16", "sq8", "hnsw", "ivf_flat", "ivf_pq", "ivf_sq8" or "auto" (by chunk count)
+INDEX_TYPE = os.getenv('INDEX_TYPE', 'auto')
+INDEX_AUTO_FLAT_MAX = 20000   # exact search up to this many chunks
+INDEX_AUTO_HNSW_MAX = 200000  # HNSW up to this many, IVF-SQ8 beyond
+HNSW_M = 32
+HNSW_EF_SEARCH = 64
+IVF_NPROBE = 16
+IVF_PQ_M = 64  # sub-quantizers for IVF-PQ; must divide VECTOR_DIM
+
+# BM25 keyword search parameters, and how deep each path goes before rank fusion
+BM25_K1 = 1.5
+BM25_B = 0.75
+HYBRID_CANDIDATES = 20
+RRF_K = 60
+RETRIEVAL_MODES = ["Vector", "Keyword (BM25)", "Hybrid (RRF)"]
+
+# Normalized query text -> embedding entries kept in memory
+QUERY_EMBEDDING_CACHE_SIZE = 1024
+
+# Semantic answer cache (opt-in from the sidebar): replay an answer when a question with
+# the same retrieved chunks is at least this similar to one already answered
+ANSWER_CACHE_SIMILARITY = 0.95
+ANSWER_CACHE_TTL_SECONDS = 7 * 24 * 3600
+ANSWER_CACHE_MAX_ENTRIES = 500
+
+# Context packing: retrieved excerpts are merged, MMR-ordered and cut to a token budget
+# that is the smaller of this cap and what the model's window leaves after max_tokens
+CONTEXT_TOKEN_BUDGET = 6000
+CONTEXT_MIN_TOKEN_BUDGET = 512
+CONTEXT_MMR_LAMBDA = 0.7  # 1.0 = pure relevance, 0.0 = pure diversity
+CONTEXT_MIN_EXCERPT_TOKENS = 100  # don't bother truncating an excerpt to less than this
+MODEL_CONTEXT_WINDOWS = {
+    "llama-3.3-70b-versatile": 131072,
+    "llama3-70b-8192": 8192,
+    "deepseek-r1-distill-llama-70b": 131072,
+    "gemma2-9b-it": 8192,
+    "meta-llama/llama-4-scout-17b-16e-instruct": 131072,
+    "qwen-qwq-32b": 131072,
+}
+DEFAULT_CONTEXT_WINDOW = 8192
+
+# Streaming answers: redraw the partial answer at most this often (seconds) or every N deltas
+STREAM_FLUSH_INTERVAL = 0.05
+STREAM_FLUSH_TOKENS = 32
+
+# Speculative retrieval: keep results fetched for the raw prompt if the rewritten
+# query's embedding is at least this similar to it
+SPECULATIVE_MIN_SIMILARITY = 0.9
+
+# Memory budget for loaded indexes + chunks shared across all sessions (LRU-evicted beyond it)
+INDEX_MEMORY_BUDGET_MB = int(os.getenv('INDEX_MEMORY_BUDGET_MB', '1024'))
+
+# Streaming ingestion: ceiling for chunk text + vectors buffered before they reach the index
+INGEST_MEMORY_LIMIT_MB = 32
+
+# Boilerplate removal: a line among the first/last HEADER_FOOTER_EDGE_LINES lines of
+# HEADER_FOOTER_MIN_REPEATS pages is treated as a running header/footer
+DEDUP_ENABLED = True
+HEADER_FOOTER_EDGE_LINES = 2
+HEADER_FOOTER_MIN_REPEATS = 3
+HEADER_FOOTER_WINDOW = 8  # pages held back while headers/footers are detected
+# Near-duplicate chunks: MinHash signature size, LSH bands and Jaccard cut-off
+MINHASH_PERMUTATIONS = 64
+MINHASH_BANDS = 16
+NEAR_DUPLICATE_THRESHOLD = 0.9
 
 # Embedding model - using a smaller model that's efficient on CPU
 EMBEDDING_MODEL = "sentence-transformers/all-mpnet-base-v2"
 
+# Chunks handed to the embedder at a time by the streaming pipeline
+EMBEDDING_BATCH_SIZE = 64
+# Padded tokens per forward pass; batches are length-sorted and sized to fit this
+EMBEDDING_TOKEN_BUDGET = 8192
+EMBEDDING_MAX_BATCH_SIZE = 128
+# Use an int8 dynamically-quantized copy of the embedding model (faster on CPU)
+EMBEDDING_QUANTIZE = os.getenv('EMBEDDING_QUANTIZE', '0') == '1'
+
+# Torch intra-op threads used for embedding inference (0 keeps torch's default)
+EMBEDDING_NUM_THREADS = int(os.getenv('EMBEDDING_NUM_THREADS', '0'))
+
+# Load FAISS and the embedding model on a background thread once the first page has rendered
+EMBEDDING_WARMUP_ON_STARTUP = os.getenv('EMBEDDING_WARMUP_ON_STARTUP', '1') == '1'
+
+# Per-stage pipeline tracing (see tracing.py); can also be switched on from the debug sidebar
+TRACING_ENABLED = os.getenv('TRACING_ENABLED', '0') == '1'
+# Finished spans kept in memory for the debug panel and the JSON lines export
+TRACE_BUFFER_SIZE = 5000
+# If set, every finished span is also appended to this file as one JSON line
+TRACE_EXPORT_PATH = os.getenv('TRACE_EXPORT_PATH', '')
+# Upper bounds in seconds of the Prometheus latency histogram buckets
+TRACE_LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
 # Cache directory - using a cloud-friendly path
 # For cloud deployment, we use a relative path that will be created in the app directory
 CACHE_DIR = "./cache"
@@ -82,3 +188,5 @@ if not GROQ_API_KEY:
 
 # Cloud-specific configs - memory limits
 MAX_CACHE_SIZE_MB = 500  # Adjust based on your cloud provider's limitations
+CACHE_EVICTION_POLICY = "lru"  # "lru" or "lfu"
+CACHE_ACCESS_RECORD_INTERVAL = 60  # seconds between manifest updates for repeated reads of one entry
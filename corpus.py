@@ -0,0 +1,81 @@
+import hashlib
+import numpy as np
+from config import INDEX_TYPE
+from embedding import build_index
+from lexical_index import build_bm25_index
+from document_store import STORE_VERSION, load_document_parts
+from index_manager import get_document, put_document
+
+# A corpus is a document whose chunks come from several PDFs: one merged
+# FAISS index (HNSW/IVF once it is large enough) and one BM25 index, so a
+# query costs one search however many documents it covers. Corpora live only
+# in the in-memory index manager. They are never written to the document
+# store, so they can't push their own member documents out of the on-disk
+# cache, and a superseded corpus simply ages out of memory.
+
+def compute_corpus_key(documents):
+    """Hash the (name, doc_key) pairs of a corpus; the same set of documents always maps to the same entry."""
+    hasher = hashlib.sha256(f"corpus|v{STORE_VERSION}".encode("utf-8"))
+    for name, doc_key in sorted(documents):
+        hasher.update(f"|{name}={doc_key}".encode("utf-8"))
+    return hasher.hexdigest()
+
+def build_corpus(documents, index_type=INDEX_TYPE):
+    """Merge cached documents into one searchable corpus document.
+
+    documents is a list of (name, doc_key) pairs. Chunks and vectors are
+    read from each document's cache entry; removed chunks are dropped, and
+    every kept chunk is tagged with doc_id (the document name) and doc_key
+    so results can cite their source. Documents missing from the cache are
+    skipped. Returns None if no document could be read.
+    """
+    chunks = []
+    vector_blocks = []
+    included = []
+    for name, doc_key in documents:
+        parts = load_document_parts(doc_key)
+        if parts is None:
+            print(f"Skipping {name}: not in the document cache")
+            continue
+        doc_chunks, embeddings = parts
+        keep = [i for i, chunk in enumerate(doc_chunks) if chunk is not None]
+        if not keep:
+            continue
+        chunks.extend(dict(doc_chunks[i], doc_id=name, doc_key=doc_key) for i in keep)
+        vector_blocks.append(np.asarray(embeddings[keep], dtype='float32'))
+        included.append({"name": name, "doc_key": doc_key, "chunks": len(keep)})
+
+    if not included:
+        return None
+
+    # The index keeps its own copy of the vectors
+    return {
+        "index": build_index(np.concatenate(vector_blocks), index_type=index_type),
+        "chunks": chunks,
+        "metadata": {
+            "title": f"Corpus of {len(included)} documents",
+            "author": "Various",
+            "pages": 0,
+            "toc": [],
+            "documents": included
+        },
+        "bm25": build_bm25_index(chunks)
+    }
+
+def get_corpus(documents):
+    """Return (corpus_key, corpus_doc) for documents, reusing a resident corpus when possible.
+
+    A new corpus is built from the members' cache entries the first time a
+    set of documents is searched together and shared through the index
+    manager until it is evicted from memory.
+    """
+    corpus_key = compute_corpus_key(documents)
+    corpus = get_document(corpus_key)
+    if corpus is not None:
+        return corpus_key, corpus
+
+    corpus = build_corpus(documents)
+    if corpus is None:
+        return corpus_key, None
+    put_document(corpus_key, corpus, persisted=False)
+    return corpus_key, corpus
@@ -0,0 +1,156 @@
+import hashlib
+import re
+import zlib
+from collections import Counter, deque
+import numpy as np
+from config import (HEADER_FOOTER_EDGE_LINES, HEADER_FOOTER_MIN_REPEATS, HEADER_FOOTER_WINDOW,
+                    MINHASH_PERMUTATIONS, MINHASH_BANDS, NEAR_DUPLICATE_THRESHOLD)
+
+SHINGLE_SIZE = 5
+_MERSENNE_PRIME = (1 << 31) - 1
+_rng = np.random.default_rng(1)
+_PERM_A = _rng.integers(1, _MERSENNE_PRIME, size=MINHASH_PERMUTATIONS, dtype=np.int64)
+_PERM_B = _rng.integers(0, _MERSENNE_PRIME, size=MINHASH_PERMUTATIONS, dtype=np.int64)
+
+# Chapter/section headings and dotted section numbers ("2.1 Background")
+HEADING_PATTERN = re.compile(r'^(?:chapter|section|part|appendix)\s+(?:\d+|[ivxlc]+)\b|^\d+(?:\.\d+)+\s+\w')
+
+def _normalize_line(line):
+    """Collapse whitespace and digits so 'Page 12 of 300' and 'Page 13 of 300' compare equal.
+
+    Heading-like lines keep their numbers, so page-top headings such as
+    'Chapter 3' and 'Chapter 4' don't merge into one repeated line.
+    """
+    line = ' '.join(line.split()).lower()
+    if HEADING_PATTERN.match(line):
+        return line
+    return re.sub(r'\d+', '#', line)
+
+def _edge_positions(lines, edge_lines):
+    """Positions of the first and last non-empty lines of a page, where headers and footers live.
+
+    Pages too short to have a body between their edges contribute none, so
+    a page of a few repeated lines is never mistaken for boilerplate.
+    """
+    non_empty = [i for i, line in enumerate(lines) if line.strip()]
+    if len(non_empty) <= edge_lines * 2:
+        return []
+    return non_empty[:edge_lines] + non_empty[-edge_lines:]
+
+def strip_repeated_edge_lines(pages, min_repeats=HEADER_FOOTER_MIN_REPEATS, edge_lines=HEADER_FOOTER_EDGE_LINES,
+                              window=HEADER_FOOTER_WINDOW, stats=None):
+    """Drop running headers/footers from a stream of (page_number, page_data) pairs.
+
+    An edge line counts as boilerplate once it appears among the edge lines
+    of min_repeats pages; only edge lines are ever removed. Pages are held back in a window of `window` pages so
+    boilerplate on the first pages is detected before they are released;
+    memory stays bounded by the window. stats, if given, gets a
+    stripped_lines counter.
+    """
+    counts = Counter()
+    buffer = deque()
+    if stats is not None:
+        stats.setdefault("stripped_lines", 0)
+    
+    def release(page_num, page_data):
+        lines = page_data["text"].splitlines()
+        drop = {
+            i for i in _edge_positions(lines, edge_lines)
+            if counts[_normalize_line(lines[i])] >= min_repeats
+        }
+        if not drop:
+            return page_num, page_data
+        if stats is not None:
+            stats["stripped_lines"] += len(drop)
+        kept = [line for i, line in enumerate(lines) if i not in drop]
+        return page_num, dict(page_data, text="\n".join(kept))
+    
+    for page_num, page_data in pages:
+        lines = page_data["text"].splitlines()
+        counts.update({_normalize_line(lines[i]) for i in _edge_positions(lines, edge_lines)})
+        buffer.append((page_num, page_data))
+        if len(buffer) > window:
+            yield release(*buffer.popleft())
+    
+    while buffer:
+        yield release(*buffer.popleft())
+
+def _content_key(text):
+    return hashlib.sha1(' '.join(text.lower().split()).encode("utf-8")).hexdigest()
+
+def minhash_signature(text):
+    """MinHash signature over word 5-shingles."""
+    words = text.lower().split()
+    if len(words) < SHINGLE_SIZE:
+        shingles = {' '.join(words)}
+    else:
+        shingles = {' '.join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+    hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) & _MERSENNE_PRIME for s in shingles), dtype=np.int64)
+    return ((_PERM_A[:, None] * hashes[None, :] + _PERM_B[:, None]) % _MERSENNE_PRIME).min(axis=1)
+
+def dedupe_chunks(chunks, near_threshold=NEAR_DUPLICATE_THRESHOLD, bands=MINHASH_BANDS, stats=None, seen=()):
+    """Yield only the first occurrence of each exact or near-duplicate chunk.
+
+    Exact duplicates are matched on normalized text; near duplicates by
+    MinHash with LSH banding, confirmed when the estimated Jaccard
+    similarity reaches near_threshold. Every yielded chunk gets a "pages"
+    list, and later duplicates append their page to the kept chunk (the
+    same dict the caller stores), so references survive without storing or
+    embedding the text twice. seen holds chunks kept from earlier (e.g. the
+    unchanged pages of an updated document): duplicates of them extend
+    their "pages" lists, but they are not yielded again. stats, if given,
+    gets chunks_seen, exact_duplicates and near_duplicates counters.
+    """
+    if stats is not None:
+        for counter in ("chunks_seen", "exact_duplicates", "near_duplicates"):
+            stats.setdefault(counter, 0)
+    exact = {}
+    buckets = {}
+    rows = MINHASH_PERMUTATIONS // bands
+    
+    def band_keys_of(signature):
+        return [(band, signature[band * rows:(band + 1) * rows].tobytes()) for band in range(bands)]
+    
+    for chunk in seen:
+        chunk.setdefault("pages", [chunk["page"]])
+        signature = minhash_signature(chunk["content"])
+        exact[_content_key(chunk["content"])] = chunk
+        for band_key in band_keys_of(signature):
+            buckets.setdefault(band_key, []).append((chunk, signature))
+    
+    for chunk in chunks:
+        if stats is not None:
+            stats["chunks_seen"] += 1
+        
+        key = _content_key(chunk["content"])
+        original = exact.get(key)
+        if original is not None:
+            if chunk["page"] not in original["pages"]:
+                original["pages"].append(chunk["page"])
+            if stats is not None:
+                stats["exact_duplicates"] += 1
+            continue
+        
+        signature = minhash_signature(chunk["content"])
+        band_keys = band_keys_of(signature)
+        original = None
+        for band_key in band_keys:
+            for candidate, candidate_signature in buckets.get(band_key, ()):
+                if np.mean(candidate_signature == signature) >= near_threshold:
+                    original = candidate
+                    break
+            if original is not None:
+                break
+        if original is not None:
+            if chunk["page"] not in original["pages"]:
+                original["pages"].append(chunk["page"])
+            exact[key] = original
+            if stats is not None:
+                stats["near_duplicates"] += 1
+            continue
+        
+        chunk["pages"] = [chunk["page"]]
+        exact[key] = chunk
+        for band_key in band_keys:
+            buckets.setdefault(band_key, []).append((chunk, signature))
+        yield chunk
@@ -0,0 +1,190 @@
+import hashlib
+import json
+import os
+import shutil
+import uuid
+import numpy as np
+import faiss
+from config import (CACHE_DIR, CHUNK_SIZE, OVERLAP, EMBEDDING_MODEL, EMBEDDING_STORAGE_DTYPE, VECTOR_PRECISION,
+                    EMBEDDING_QUANTIZE, DEDUP_ENABLED, HEADER_FOOTER_EDGE_LINES, HEADER_FOOTER_MIN_REPEATS,
+                    HEADER_FOOTER_WINDOW, MINHASH_PERMUTATIONS, MINHASH_BANDS, NEAR_DUPLICATE_THRESHOLD)
+from utils import ensure_dir_exists
+from embedding import set_search_params, reconstruct_vectors
+from lexical_index import build_bm25_index, save_bm25_index, load_bm25_index
+from cache_manager import record_write, record_access, remove_entry
+
+# Bump when the on-disk layout or chunk format changes so old entries are ignored
+STORE_VERSION = 3
+
+EMBEDDINGS_FILE = "embeddings.npy"
+CHUNKS_FILE = "chunks.json"
+INDEX_FILE = "index.faiss"
+METADATA_FILE = "metadata.json"
+BM25_FILE = "bm25.npz"
+
+def compute_document_key(pdf_bytes, chunk_size=CHUNK_SIZE, overlap=OVERLAP, model_name=EMBEDDING_MODEL):
+    """Hash the PDF bytes together with every parameter that affects chunks or vectors."""
+    hasher = hashlib.sha256()
+    hasher.update(pdf_bytes)
+    params = f"v{STORE_VERSION}|{chunk_size}|{overlap}|{model_name}|{VECTOR_PRECISION}|{EMBEDDING_QUANTIZE}"
+    if DEDUP_ENABLED:
+        params += (f"|dedup:{HEADER_FOOTER_EDGE_LINES},{HEADER_FOOTER_MIN_REPEATS},{HEADER_FOOTER_WINDOW},"
+                   f"{MINHASH_PERMUTATIONS},{MINHASH_BANDS},{NEAR_DUPLICATE_THRESHOLD}")
+    hasher.update(params.encode("utf-8"))
+    return hasher.hexdigest()
+
+def get_document_dir(doc_key, cache_dir=CACHE_DIR):
+    """Return the directory holding the cached artifacts for a document key."""
+    return os.path.join(cache_dir, "documents", doc_key)
+
+def has_document(doc_key, cache_dir=CACHE_DIR):
+    """Check whether a complete cache entry exists for the document key."""
+    doc_dir = get_document_dir(doc_key, cache_dir)
+    return all(
+        os.path.exists(os.path.join(doc_dir, name))
+        for name in (EMBEDDINGS_FILE, CHUNKS_FILE, INDEX_FILE, METADATA_FILE)
+    )
+
+def _write_embeddings(path, embeddings, index, num_rows, block_size=4096):
+    """Write embeddings as .npy; when embeddings is None, stream them back out of the index block by block.
+
+    Rows are chunk positions; for ID-mapped and IVF indexes, positions
+    without a vector (removed chunks) are left as zeros. Vectors are stored as
+    EMBEDDING_STORAGE_DTYPE (float16 by default, half the size of float32).
+    """
+    if embeddings is not None:
+        np.save(path, np.ascontiguousarray(embeddings, dtype=EMBEDDING_STORAGE_DTYPE))
+        return
+    
+    out = np.lib.format.open_memmap(path, mode='w+', dtype=EMBEDDING_STORAGE_DTYPE, shape=(num_rows, index.d))
+    if isinstance(index, faiss.IndexIDMap2):
+        ids = faiss.vector_to_array(index.id_map).astype('int64')
+        for start in range(0, len(ids), block_size):
+            block = ids[start:start + block_size]
+            out[block] = index.reconstruct_batch(block)
+    else:
+        for start in range(0, num_rows, block_size):
+            count = min(block_size, num_rows - start)
+            out[start:start + count] = reconstruct_vectors(index, start, count)
+    out.flush()
+    del out
+
+def save_document(doc_key, chunks, embeddings, index, metadata, cache_dir=CACHE_DIR, bm25=None):
+    """Persist chunks, raw embeddings, the serialized FAISS index and the BM25 index for a document.
+
+    Files are written to a temporary directory and moved into place in one
+    rename, so readers never observe a half-written entry. Pass
+    embeddings=None to recover the vectors from the index itself.
+    """
+    doc_dir = get_document_dir(doc_key, cache_dir)
+    # Sessions are threads of one process, so the pid alone doesn't keep concurrent saves apart
+    tmp_dir = f"{doc_dir}.tmp-{os.getpid()}-{uuid.uuid4().hex}"
+    try:
+        ensure_dir_exists(tmp_dir)
+        _write_embeddings(os.path.join(tmp_dir, EMBEDDINGS_FILE), embeddings, index, len(chunks))
+        with open(os.path.join(tmp_dir, CHUNKS_FILE), "w", encoding="utf-8") as f:
+            json.dump(chunks, f, ensure_ascii=False, separators=(",", ":"))
+        with open(os.path.join(tmp_dir, METADATA_FILE), "w", encoding="utf-8") as f:
+            json.dump(metadata, f, ensure_ascii=False)
+        faiss.write_index(index, os.path.join(tmp_dir, INDEX_FILE))
+        save_bm25_index(bm25 if bm25 is not None else build_bm25_index(chunks), os.path.join(tmp_dir, BM25_FILE))
+        
+        if os.path.exists(doc_dir):
+            shutil.rmtree(doc_dir, ignore_errors=True)
+        try:
+            os.replace(tmp_dir, doc_dir)
+        except OSError:
+            # A concurrent save of the same key won the rename; its content is identical
+            if not has_document(doc_key, cache_dir):
+                raise
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+    except Exception as e:
+        print(f"Error saving document cache: {e}")
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        return False
+    
+    # Track the entry and keep the cache under MAX_CACHE_SIZE_MB
+    try:
+        record_write(doc_key, cache_dir)
+    except Exception as e:
+        print(f"Error updating cache manifest: {e}")
+    return True
+
+def remove_stale_tmp_dirs(cache_dir=CACHE_DIR):
+    """Delete half-written entries left behind by a save that crashed; returns how many were removed.
+
+    A temporary directory is stale when the process named in its suffix
+    is no longer running.
+    """
+    documents_dir = os.path.join(cache_dir, "documents")
+    if not os.path.isdir(documents_dir):
+        return 0
+    removed = 0
+    for name in os.listdir(documents_dir):
+        if ".tmp-" not in name:
+            continue
+        try:
+            os.kill(int(name.rsplit(".tmp-", 1)[1].split("-", 1)[0]), 0)
+            continue  # Writer is still alive
+        except (ValueError, ProcessLookupError):
+            pass
+        except PermissionError:
+            continue  # Alive, owned by another user
+        shutil.rmtree(os.path.join(documents_dir, name), ignore_errors=True)
+        removed += 1
+    return removed
+
+def load_document_parts(doc_key, cache_dir=CACHE_DIR):
+    """Load only the chunks and memory-mapped embeddings of a cached document, or None if it isn't cached.
+
+    Cheaper than load_document when the index and keyword index aren't
+    needed, e.g. when merging documents into a corpus.
+    """
+    if not has_document(doc_key, cache_dir):
+        return None
+    doc_dir = get_document_dir(doc_key, cache_dir)
+    try:
+        embeddings = np.load(os.path.join(doc_dir, EMBEDDINGS_FILE), mmap_mode='r')
+        with open(os.path.join(doc_dir, CHUNKS_FILE), "r", encoding="utf-8") as f:
+            chunks = json.load(f)
+    except Exception as e:
+        print(f"Error loading document cache: {e}")
+        return None
+    record_access(doc_key, cache_dir)
+    return chunks, embeddings
+
+def load_document(doc_key, cache_dir=CACHE_DIR):
+    """Load a cached document, or return None if it isn't cached.
+
+    Embeddings are memory-mapped rather than copied into RAM.
+    """
+    if not has_document(doc_key, cache_dir):
+        return None
+    
+    doc_dir = get_document_dir(doc_key, cache_dir)
+    try:
+        embeddings = np.load(os.path.join(doc_dir, EMBEDDINGS_FILE), mmap_mode='r')
+        with open(os.path.join(doc_dir, CHUNKS_FILE), "r", encoding="utf-8") as f:
+            chunks = json.load(f)
+        with open(os.path.join(doc_dir, METADATA_FILE), "r", encoding="utf-8") as f:
+            metadata = json.load(f)
+        index = set_search_params(faiss.read_index(os.path.join(doc_dir, INDEX_FILE)))
+        bm25_path = os.path.join(doc_dir, BM25_FILE)
+        bm25 = load_bm25_index(bm25_path) if os.path.exists(bm25_path) else build_bm25_index(chunks)
+    except Exception as e:
+        print(f"Error loading document cache: {e}")
+        try:
+            remove_entry(doc_key, cache_dir)
+        except Exception as e:
+            print(f"Error updating cache manifest: {e}")
+        shutil.rmtree(doc_dir, ignore_errors=True)
+        return None
+    
+    record_access(doc_key, cache_dir)
+    return {
+        "index": index,
+        "chunks": chunks,
+        "embeddings": embeddings,
+        "metadata": metadata,
+        "bm25": bm25
+    }
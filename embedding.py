@@ -1,64 +1,253 @@
-import pickle
 import numpy as np
-import torch
-from sentence_transformers import SentenceTransformer
 import faiss.contrib.torch_utils  # Import to disable GPU usage
 import faiss
-from config import EMBEDDING_MODEL, VECTOR_DIM, CACHE_DIR
+from config import (EMBEDDING_MODEL, VECTOR_DIM, CACHE_DIR, EMBEDDING_TOKEN_BUDGET, EMBEDDING_MAX_BATCH_SIZE, INDEX_TYPE,
+                    INDEX_AUTO_FLAT_MAX, INDEX_AUTO_HNSW_MAX, HNSW_M, HNSW_EF_SEARCH, IVF_NPROBE, IVF_PQ_M,
+                    VECTOR_PRECISION, SQ8_RANGE_MARGIN, EMBEDDING_STORAGE_DTYPE)
 from utils import ensure_dir_exists
+from model_registry import get_embedding_model
+from token_counter import count_tokens
+from tracing import span, traced, annotate
 import os
 
+def plan_batches(texts, token_budget=EMBEDDING_TOKEN_BUDGET, max_tokens=512, max_batch_size=EMBEDDING_MAX_BATCH_SIZE):
+    """Group text positions into length-sorted batches whose padded size fits the token budget.
+
+    Each batch is padded to its longest text, so sorting by length keeps
+    padding low and lets batches of short texts grow larger than batches of
+    long ones. Returns a list of lists of positions into texts.
+    """
+    # Word pieces plus [CLS]/[SEP], capped at the model's sequence limit
+    lengths = [min(count + 2, max_tokens) for count in count_tokens(texts)]
+    order = sorted(range(len(texts)), key=lambda i: lengths[i], reverse=True)
+    
+    batches = []
+    batch = []
+    for position in order:
+        # Longest-first, so the first text in a batch sets its padded length
+        padded_length = lengths[batch[0]] if batch else lengths[position]
+        if batch and (padded_length * (len(batch) + 1) > token_budget or len(batch) >= max_batch_size):
+            batches.append(batch)
+            batch = []
+        batch.append(position)
+    if batch:
+        batches.append(batch)
+    return batches
+
+@traced("embedding.embed_texts")
+def embed_texts(texts, model=None):
+    """Encode a list of texts with the shared CPU model as a float32 array, in input order.
+
+    Texts are bucketed by length and batched against EMBEDDING_TOKEN_BUDGET
+    rather than a fixed batch size.
+    """
+    # Shared CPU model, loaded once per process
+    if model is None:
+        model = get_embedding_model(EMBEDDING_MODEL)
+    embeddings = np.empty((len(texts), VECTOR_DIM), dtype='float32')
+    max_tokens = getattr(model, "max_seq_length", None) or 512
+    
+    batches = plan_batches(texts, max_tokens=max_tokens)
+    for batch in batches:
+        batch_embeddings = model.encode([texts[i] for i in batch], batch_size=len(batch), show_progress_bar=False)
+        embeddings[batch] = batch_embeddings
+    annotate(texts=len(texts), batches=len(batches), bytes=embeddings.nbytes)
+    return embeddings
+
+@traced("embedding.generate_embeddings")
 def generate_embeddings(chunks, cache_file=None):
-    """Generate embeddings for text chunks with caching support."""
+    """Generate embeddings for text chunks with caching support.
+
+    The cache file is a raw .npy array in EMBEDDING_STORAGE_DTYPE,
+    memory-mapped when loaded.
+    """
     if cache_file and os.path.exists(cache_file):
         try:
-            with open(cache_file, "rb") as f:
-                return pickle.load(f)
+            embeddings = np.load(cache_file, mmap_mode='r')
+            annotate(cache_hit=True, chunks=len(embeddings))
+            return embeddings
         except Exception as e:
             print(f"Error loading cached embeddings: {e}")
             # Continue with generating new embeddings
     
-    # Force CPU usage
-    model = SentenceTransformer(EMBEDDING_MODEL)
-    model.to('cpu')  # Force CPU
-    
     texts = [chunk["content"] for chunk in chunks]
+    annotate(cache_hit=False, chunks=len(texts))
     
-    # Generate embeddings in batches to conserve memory
-    batch_size = 16
-    embeddings = []
-    
-    for i in range(0, len(texts), batch_size):
-        batch_texts = texts[i:i+batch_size]
-        batch_embeddings = model.encode(batch_texts, show_progress_bar=False)
-        embeddings.append(batch_embeddings)
-    
-    embeddings = np.vstack(embeddings)
+    # Batches are planned by length and token budget inside embed_texts
+    embeddings = embed_texts(texts)
     
     # Cache the embeddings if a cache file is specified
     if cache_file:
         cache_dir = os.path.dirname(cache_file)
         ensure_dir_exists(cache_dir)
         try:
-            with open(cache_file, "wb") as f:
-                pickle.dump(embeddings, f)
+            np.save(cache_file, embeddings.astype(EMBEDDING_STORAGE_DTYPE))
         except Exception as e:
             print(f"Error saving embeddings cache: {e}")
     
     return embeddings
 
-def build_index(embeddings: np.ndarray):
-    """Build a FAISS index with CPU support only."""
+def create_index(precision=VECTOR_PRECISION):
+    """Create an empty exhaustive-search FAISS index that vectors can be appended to incrementally.
+
+    precision picks how vectors are held inside the index: "float32"
+    (IndexFlatL2), "float16" (2 bytes per dimension) or "int8" (SQ8,
+    1 byte per dimension). An int8 index must be trained before the first
+    add; see train_if_needed.
+    """
     # Ensure we're using CPU-only FAISS
     faiss.get_num_gpus = lambda: 0
     
+    if precision == "float16":
+        return faiss.IndexScalarQuantizer(VECTOR_DIM, faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_L2)
+    if precision == "int8":
+        index = faiss.IndexScalarQuantizer(VECTOR_DIM, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_L2)
+        # Widen the trained per-dimension ranges so later batches rarely clip
+        index.sq.rangestat = faiss.ScalarQuantizer.RS_minmax
+        index.sq.rangestat_arg = SQ8_RANGE_MARGIN
+        return index
+    
     # Create a flat L2 index (CPU-only)
-    index = faiss.IndexFlatL2(VECTOR_DIM)
+    return faiss.IndexFlatL2(VECTOR_DIM)
+
+def train_if_needed(index, embeddings):
+    """Train quantizer ranges or centroids on embeddings if the index isn't trained yet."""
+    if not index.is_trained:
+        index.train(np.ascontiguousarray(embeddings, dtype='float32'))
+
+def reconstruct_vectors(index, start=0, count=None):
+    """Read vectors [start, start + count) back out of an index as a numpy array.
+
+    faiss.contrib.torch_utils makes reconstruct_n return torch tensors by
+    default; passing a numpy output buffer keeps it on the numpy path.
+    Ids an IVF index doesn't hold (removed chunks) come back as zeros.
+    """
+    if count is None:
+        count = index.ntotal - start
+    vectors = np.zeros((count, index.d), dtype='float32')
+    if count:
+        index.reconstruct_n(start, count, vectors)
+    return vectors
+
+def choose_index_type(num_vectors):
+    """Pick an index type for a corpus size: exact search while it's cheap, ANN beyond that."""
+    if num_vectors <= INDEX_AUTO_FLAT_MAX:
+        return "flat"
+    if num_vectors <= INDEX_AUTO_HNSW_MAX:
+        return "hnsw"
+    return "ivf_sq8"
+
+def _index_factory_string(index_type, num_vectors):
+    """Translate an index type name into a faiss.index_factory description."""
+    if index_type == "flat":
+        return "Flat"
+    if index_type == "sq8":
+        return "SQ8"
+    if index_type == "sq_fp16":
+        return "SQfp16"
+    if index_type == "hnsw":
+        return f"HNSW{HNSW_M}"
+    
+    # Roughly 4 * sqrt(n) lists, but keep ~39 training points per centroid as FAISS recommends
+    nlist = max(1, min(int(4 * np.sqrt(num_vectors)), num_vectors // 39))
+    if index_type == "ivf_flat":
+        return f"IVF{nlist},Flat"
+    if index_type == "ivf_pq":
+        return f"IVF{nlist},PQ{IVF_PQ_M}"
+    if index_type == "ivf_sq8":
+        return f"IVF{nlist},SQ8"
+    raise ValueError(f"Unknown index type: {index_type}")
+
+def _unwrap_id_map(index):
+    """Return the index inside an IndexIDMap/IndexIDMap2, or index itself."""
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        return faiss.downcast_index(index.index)
+    return index
+
+def set_search_params(index, nprobe=IVF_NPROBE, ef_search=HNSW_EF_SEARCH):
+    """Apply query-time parameters to whichever ANN structure the index uses."""
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None and nprobe:
+        ivf.nprobe = min(nprobe, ivf.nlist)
+    inner = _unwrap_id_map(index)
+    if hasattr(inner, "hnsw") and ef_search:
+        inner.hnsw.efSearch = ef_search
+    return index
+
+def _id_selector(ids):
+    """Range selector for a contiguous id block, hashed batch selector otherwise."""
+    if len(ids) and ids[-1] - ids[0] + 1 == len(ids):
+        return faiss.IDSelectorRange(int(ids[0]), int(ids[-1]) + 1)
+    return faiss.IDSelectorBatch(ids)
+
+@traced("embedding.search_index")
+def search_index(index, queries, top_k, ids=None):
+    """Search the index, considering only the vectors whose ids are in the sorted array ids.
+
+    The selector is passed down as FAISS search parameters, so exhaustive
+    indexes skip distance computations for excluded vectors and IVF/HNSW
+    indexes skip them while scanning lists or the graph. The index's
+    nprobe and efSearch are carried over, since explicit parameters
+    replace them.
+    """
+    annotate(queries=len(queries))
+    if ids is None:
+        return index.search(queries, top_k)
     
+    ids = np.ascontiguousarray(ids, dtype='int64')
+    annotate(filtered_ids=len(ids))
+    if len(ids) == 0:
+        return np.empty((len(queries), 0), dtype='float32'), np.empty((len(queries), 0), dtype='int64')
+    selector = _id_selector(ids)
+    ivf = faiss.try_extract_index_ivf(index)
+    inner = _unwrap_id_map(index)
+    if ivf is not None:
+        params = faiss.SearchParametersIVF(sel=selector, nprobe=ivf.nprobe)
+    elif hasattr(inner, "hnsw"):
+        params = faiss.SearchParametersHNSW(sel=selector, efSearch=inner.hnsw.efSearch)
+    else:
+        params = faiss.SearchParameters(sel=selector)
+    # torch_utils replaces index.search with a version that drops params
+    search = getattr(index, "search_numpy", index.search)
+    return search(np.ascontiguousarray(queries, dtype='float32'), min(top_k, len(ids)), params=params)
+
+@traced("embedding.build_index")
+def build_index(embeddings: np.ndarray, index_type=INDEX_TYPE):
+    """Build a FAISS index with CPU support only.
+
+    index_type is one of "flat", "sq_fp16", "sq8", "hnsw", "ivf_flat",
+    "ivf_pq", "ivf_sq8", or "auto" to choose from the number of vectors.
+    "flat" stores vectors at VECTOR_PRECISION. Quantized and IVF variants
+    are trained on the embeddings before they are added. The index keeps
+    its own copy of the vectors, so callers can drop theirs afterwards.
+    """
     # Ensure embeddings are in the right format for FAISS
-    embeddings = embeddings.astype('float32')
+    embeddings = np.ascontiguousarray(embeddings, dtype='float32')
+    num_vectors = embeddings.shape[0]
+    
+    if index_type == "auto":
+        index_type = choose_index_type(num_vectors)
+    
+    # PQ needs at least 256 training points per sub-quantizer codebook
+    if index_type == "ivf_pq" and num_vectors < 256 * 39:
+        index_type = "ivf_sq8"
+    if index_type.startswith("ivf") and num_vectors < 39:
+        index_type = "flat"
+    
+    if index_type == "flat":
+        index = create_index()
+    else:
+        # Ensure we're using CPU-only FAISS
+        faiss.get_num_gpus = lambda: 0
+        index = faiss.index_factory(VECTOR_DIM, _index_factory_string(index_type, num_vectors))
+    
+    annotate(vectors=num_vectors, index_type=index_type, bytes=embeddings.nbytes)
+    with span("embedding.train_index"):
+        train_if_needed(index, embeddings)
     
     # Add vectors to the index
-    index.add(embeddings)
+    with span("embedding.add_vectors"):
+        index.add(embeddings)
+    set_search_params(index)
     
     return index
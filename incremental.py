@@ -0,0 +1,190 @@
+import time
+import numpy as np
+import faiss
+from config import CHUNK_SIZE, OVERLAP, EMBEDDING_BATCH_SIZE, INGEST_MEMORY_LIMIT_MB, DEDUP_ENABLED
+from pdf_processing import parse_pdf, iter_chunks, EMPTY_DOCUMENT_CHUNK
+from dedup import strip_repeated_edge_lines, dedupe_chunks
+from embedding import embed_texts, reconstruct_vectors, train_if_needed, set_search_params
+from ingestion import iter_chunk_batches
+from lexical_index import build_bm25_index
+
+# A chunk's position in the chunk list is its vector id. Pages are matched to
+# the old revision by text hash: chunks of unchanged pages keep their vectors,
+# chunks of edited or removed pages are dropped with remove_ids, and the
+# chunks of new or edited pages are embedded and appended after the last id,
+# so each page's chunks stay consecutive. Flat and SQ indexes renumber on
+# removal, so their chunk lists are compacted the same way; IVF indexes keep
+# ids, so removed chunks leave a None slot.
+
+def _reconstruct_all(index):
+    """Return (ids, vectors, empty_index) for an index, leaving the index itself untouched.
+
+    The index may be shared with other sessions, so the vectors are read
+    from a clone (IVF needs a direct map for that). The clone is then
+    emptied and returned ready for add_with_ids: it keeps the original type
+    and training (IVF centroids). IVF, which has ids of its own, is returned
+    bare; other types are ID-mapped.
+    """
+    working = faiss.clone_index(index)
+    ivf = faiss.try_extract_index_ivf(working)
+    if ivf is not None:
+        ivf.make_direct_map()
+    if isinstance(working, faiss.IndexIDMap2):
+        ids = faiss.vector_to_array(working.id_map).astype('int64')
+        vectors = working.reconstruct_batch(ids) if len(ids) else np.empty((0, working.d), dtype='float32')
+    else:
+        ids = np.arange(working.ntotal, dtype='int64')
+        vectors = reconstruct_vectors(working)
+    working.reset()
+    if ivf is not None:
+        ivf.make_direct_map(False)
+        if isinstance(working, faiss.IndexIDMap2):
+            # Unwrap IVF indexes wrapped by earlier versions into an index that owns its data
+            working = faiss.clone_index(ivf)
+    elif not isinstance(working, faiss.IndexIDMap2):
+        working = faiss.IndexIDMap2(working)
+    return ids, vectors, set_search_params(working)
+
+def _rebuild_index(index, keep_ids, new_ids):
+    """Return a new index of index's type holding the vectors of keep_ids, renumbered to new_ids."""
+    ids, vectors, rebuilt = _reconstruct_all(index)
+    keep_ids = np.asarray(keep_ids, dtype='int64')
+    order = np.argsort(ids)
+    rows = order[np.searchsorted(ids, keep_ids, sorter=order)]
+    if len(rows):
+        train_if_needed(rebuilt, vectors[rows])
+        rebuilt.add_with_ids(vectors[rows], np.asarray(new_ids, dtype='int64'))
+    return rebuilt
+
+def _old_pages_by_hash(chunks):
+    """Group old chunk ids per page, keyed by page hash: {hash: [(old_page, [chunk ids]), ...]}."""
+    groups = {}
+    current_page = None
+    for chunk_id, chunk in enumerate(chunks):
+        if chunk is None or not chunk.get("page_hash"):
+            continue
+        page_key = (chunk["page"], chunk["page_hash"])
+        if page_key != current_page:
+            groups.setdefault(chunk["page_hash"], []).append((chunk["page"], []))
+            current_page = page_key
+        groups[chunk["page_hash"]][-1][1].append(chunk_id)
+    return groups
+
+def update_document(old_doc, file_path, chunk_size=CHUNK_SIZE, overlap=OVERLAP, batch_size=EMBEDDING_BATCH_SIZE,
+                    memory_limit_mb=INGEST_MEMORY_LIMIT_MB, dedupe=DEDUP_ENABLED):
+    """Build the document for a new revision of a PDF, re-embedding only changed pages.
+
+    Pages are matched to the old revision by text hash, so unchanged pages
+    keep their chunks and vectors even if they moved. An unchanged page
+    whose text was only stored as a duplicate inside a dropped chunk is
+    re-chunked as well. Changed pages go through the same header/footer
+    stripping and deduplication as ingest_pdf_streaming, deduplicated
+    against the kept chunks too. Only HNSW indexes are rebuilt, since they
+    can't remove vectors. old_doc and its index are not modified.
+    Returns (doc, stats).
+    """
+    start = time.perf_counter()
+    parsed = parse_pdf(file_path)
+    pages = sorted(parsed["text_content"].items())
+    dedup_stats = {}
+    if dedupe:
+        # Boilerplate is detected across the whole revision, not just the changed pages
+        pages = list(strip_repeated_edge_lines(iter(pages), stats=dedup_stats))
+    
+    old_chunks = old_doc["chunks"]
+    old_pages = _old_pages_by_hash(old_chunks)
+    kept_pages = {}
+    changed_pages = set()
+    for page_num, page_data in pages:
+        occurrences = old_pages.get(page_data.get("hash"))
+        if occurrences:
+            kept_pages[page_num] = occurrences.pop(0)
+        else:
+            changed_pages.add(page_num)
+    new_page_of = {old_page: page_num for page_num, (old_page, _) in kept_pages.items()}
+    
+    kept_ids = {chunk_id for _, chunk_ids in kept_pages.values() for chunk_id in chunk_ids}
+    removed_ids = [chunk_id for chunk_id, chunk in enumerate(old_chunks) if chunk is not None and chunk_id not in kept_ids]
+    pending = list(removed_ids)
+    while pending:
+        for old_page in old_chunks[pending.pop()].get("pages", ()):
+            page_num = new_page_of.pop(old_page, None)
+            if page_num is None:
+                continue
+            # This page's text was deduplicated into the dropped chunk, so it has to be chunked again
+            _, chunk_ids = kept_pages.pop(page_num)
+            changed_pages.add(page_num)
+            removed_ids.extend(chunk_ids)
+            pending.extend(chunk_ids)
+    
+    chunks = list(old_chunks)
+    for chunk_id in removed_ids:
+        chunks[chunk_id] = None
+    sections = {page_num: page_data.get("section", "") for page_num, page_data in pages}
+    kept_chunks = []
+    for page_num, (old_page, chunk_ids) in kept_pages.items():
+        for chunk_id in chunk_ids:
+            chunk = chunks[chunk_id] = dict(chunks[chunk_id], page=page_num, section=sections[page_num])
+            if "pages" in chunk:
+                chunk["pages"] = [new_page_of[page] for page in chunk["pages"] if page in new_page_of]
+            kept_chunks.append(chunk)
+    
+    changed = [(page_num, page_data) for page_num, page_data in pages if page_num in changed_pages]
+    if dedupe:
+        new_chunks = list(dedupe_chunks(iter_chunks(changed, chunk_size, overlap), stats=dedup_stats, seen=kept_chunks))
+    else:
+        new_chunks = list(iter_chunks(changed, chunk_size, overlap))
+    if not kept_chunks and not new_chunks:
+        new_chunks = [EMPTY_DOCUMENT_CHUNK.copy()]
+    
+    old_index = old_doc["index"]
+    wrapped = isinstance(old_index, faiss.IndexIDMap2)
+    inner = faiss.downcast_index(old_index.index) if wrapped else old_index
+    is_ivf = faiss.try_extract_index_ivf(inner) is not None
+    if hasattr(inner, "hnsw") or (wrapped and is_ivf):
+        # HNSW graphs can't remove vectors, and IndexIDMap2 loses track of removals inside
+        # the IVF lists of indexes that earlier versions wrapped: rebuild from the stored vectors
+        live_ids = [chunk_id for chunk_id, chunk in enumerate(chunks) if chunk is not None]
+        index = _rebuild_index(old_index, live_ids, np.arange(len(live_ids)))
+        chunks = [chunks[chunk_id] for chunk_id in live_ids]
+        rebuilt = True
+    else:
+        # The old index is shared with other sessions
+        index = set_search_params(faiss.clone_index(old_index))
+        if is_ivf:
+            # remove_ids isn't supported with an array direct map
+            faiss.try_extract_index_ivf(index).make_direct_map(False)
+        if removed_ids:
+            index.remove_ids(np.asarray(sorted(removed_ids), dtype='int64'))
+        if not wrapped and not is_ivf:
+            chunks = [chunk for chunk in chunks if chunk is not None]
+        rebuilt = False
+    
+    for batch in iter_chunk_batches(iter(new_chunks), batch_size, memory_limit_mb):
+        embeddings = embed_texts([chunk["content"] for chunk in batch])
+        train_if_needed(index, embeddings)
+        ids = np.arange(len(chunks), len(chunks) + len(batch), dtype='int64')
+        chunks.extend(batch)
+        if isinstance(index, faiss.IndexIDMap2) or is_ivf:
+            index.add_with_ids(embeddings, ids)
+        else:
+            index.add(embeddings)
+    
+    doc = {
+        "index": index,
+        "chunks": chunks,
+        "metadata": parsed["metadata"],
+        "bm25": build_bm25_index(chunks)
+    }
+    
+    stats = {
+        "changed_pages": len(changed_pages),
+        "total_pages": len(pages),
+        "reused_chunks": len(kept_chunks),
+        "removed_chunks": len(removed_ids),
+        "embedded_chunks": len(new_chunks),
+        "rebuilt_index": rebuilt,
+        "dedup": dedup_stats,
+        "seconds": time.perf_counter() - start
+    }
+    return doc, stats
@@ -0,0 +1,120 @@
+import threading
+from collections import OrderedDict
+from config import INDEX_MEMORY_BUDGET_MB, HNSW_M
+from cache_manager import record_access
+
+# Process-wide LRU of loaded documents keyed by document hash, shared by every
+# Streamlit session. Values hold the index, chunks and metadata; evicted
+# entries are reloaded from the on-disk document store on the next access.
+_documents = OrderedDict()
+_sizes = {}
+# Keys that also have an on-disk cache entry, whose accesses feed the disk LRU
+_persisted = set()
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "reloads": 0, "evictions": 0}
+
+# Rough per-chunk overhead of the Python dict and strings around the content
+CHUNK_OVERHEAD_BYTES = 200
+
+def estimate_index_bytes(index):
+    """Approximate the resident size of a FAISS index from its code size and graph links."""
+    try:
+        code_size = index.sa_code_size()
+    except Exception:
+        code_size = index.d * 4
+    size = code_size * index.ntotal
+    if hasattr(index, "hnsw"):
+        # Level-0 neighbour lists dominate: 2*M int32 links per vector
+        size += index.ntotal * HNSW_M * 2 * 4
+    return size
+
+def estimate_bm25_bytes(bm25):
+    """Approximate resident bytes for a BM25 inverted index (arrays plus vocabulary dict)."""
+    array_bytes = sum(bm25[name].nbytes for name in ("offsets", "doc_ids", "tfs", "doc_lengths", "idf"))
+    return array_bytes + len(bm25["vocab"]) * CHUNK_OVERHEAD_BYTES // 2
+
+def estimate_document_bytes(doc):
+    """Approximate resident bytes for a document's index, chunk texts and keyword index."""
+    chunk_bytes = sum(
+        len(chunk["content"].encode("utf-8")) + CHUNK_OVERHEAD_BYTES for chunk in doc["chunks"] if chunk is not None
+    )
+    bm25_bytes = estimate_bm25_bytes(doc["bm25"]) if doc.get("bm25") else 0
+    return estimate_index_bytes(doc["index"]) + chunk_bytes + bm25_bytes
+
+def _evict_over_budget(budget_bytes, keep=None):
+    """Drop least-recently-used documents until the budget is met. Caller holds the lock.
+
+    keep is never evicted, so a document larger than the whole budget
+    stays resident instead of being reloaded from disk on every access.
+    """
+    total = sum(_sizes.values())
+    for doc_key in list(_documents.keys()):
+        if total <= budget_bytes:
+            break
+        if doc_key == keep:
+            continue
+        total -= _sizes.pop(doc_key)
+        del _documents[doc_key]
+        _persisted.discard(doc_key)
+        _stats["evictions"] += 1
+
+def put_document(doc_key, doc, budget_mb=INDEX_MEMORY_BUDGET_MB, persisted=True):
+    """Add or refresh a document, mark it most recently used and enforce the memory budget.
+
+    Pass persisted=False for documents that only live in memory (corpora),
+    so their hits aren't recorded against the on-disk cache.
+    """
+    with _lock:
+        _documents[doc_key] = doc
+        _documents.move_to_end(doc_key)
+        if persisted:
+            _persisted.add(doc_key)
+        else:
+            _persisted.discard(doc_key)
+        _sizes[doc_key] = estimate_document_bytes(doc)
+        _evict_over_budget(budget_mb * 1024 * 1024, keep=doc_key)
+
+def get_document(doc_key, budget_mb=INDEX_MEMORY_BUDGET_MB):
+    """Return the shared document for doc_key, reloading it from disk if it was evicted.
+
+    Returns None if the document is neither resident nor in the on-disk cache.
+    """
+    with _lock:
+        doc = _documents.get(doc_key)
+        if doc is not None:
+            _documents.move_to_end(doc_key)
+            _stats["hits"] += 1
+            persisted = doc_key in _persisted
+        else:
+            _stats["misses"] += 1
+    
+    if doc is not None:
+        if persisted:
+            # Keep the on-disk LRU aware that this document is hot; queued, written in the background
+            record_access(doc_key)
+        return doc
+    
+    # Disk reads happen outside the lock so other sessions aren't blocked.
+    # Imported here: the document store pulls in FAISS, which the UI shouldn't
+    # pay for just to show stats
+    from document_store import load_document
+    doc = load_document(doc_key)
+    if doc is None:
+        return None
+    # Embeddings are memory-mapped and only needed when re-saving
+    doc.pop("embeddings", None)
+    
+    with _lock:
+        existing = _documents.get(doc_key)
+        if existing is not None:
+            # Another session loaded it meanwhile; share that copy
+            _documents.move_to_end(doc_key)
+            return existing
+        _stats["reloads"] += 1
+    put_document(doc_key, doc, budget_mb)
+    return doc
+
+def get_index_manager_stats():
+    """Return resident document count, resident bytes and hit/miss/eviction counters."""
+    with _lock:
+        return dict(_stats, documents=len(_documents), resident_bytes=sum(_sizes.values()))
@@ -0,0 +1,92 @@
+import time
+from config import CHUNK_SIZE, OVERLAP, EMBEDDING_BATCH_SIZE, INGEST_MEMORY_LIMIT_MB, VECTOR_DIM, DEDUP_ENABLED
+from pdf_processing import get_pdf_metadata, iter_pdf_pages, iter_chunks, EMPTY_DOCUMENT_CHUNK
+from dedup import strip_repeated_edge_lines, dedupe_chunks
+from embedding import embed_texts, create_index, train_if_needed
+
+def iter_chunk_batches(chunks, batch_size=EMBEDDING_BATCH_SIZE, memory_limit_mb=INGEST_MEMORY_LIMIT_MB):
+    """Group a chunk stream into batches bounded by count and by estimated buffered bytes."""
+    limit_bytes = memory_limit_mb * 1024 * 1024
+    # Each buffered chunk costs its text plus the float32 vector it will become
+    vector_bytes = VECTOR_DIM * 4
+    batch = []
+    batch_bytes = 0
+    
+    for chunk in chunks:
+        batch.append(chunk)
+        batch_bytes += len(chunk["content"].encode("utf-8")) + vector_bytes
+        if len(batch) >= batch_size or batch_bytes >= limit_bytes:
+            yield batch
+            batch = []
+            batch_bytes = 0
+    
+    if batch:
+        yield batch
+
+def ingest_pdf_streaming(file_path, chunk_size=CHUNK_SIZE, overlap=OVERLAP, batch_size=EMBEDDING_BATCH_SIZE,
+                         memory_limit_mb=INGEST_MEMORY_LIMIT_MB, progress_callback=None, index=None, chunks=None,
+                         dedupe=DEDUP_ENABLED):
+    """Parse, chunk, embed and index a PDF as one streaming pipeline.
+
+    Pages flow into the chunker and chunks into batched embedding; each batch
+    is appended to the FAISS index straight away, so page text and raw
+    vectors never accumulate. Callers may pass their own (empty) index and
+    chunks list to fill; neither is safe to search until this returns. The
+    progress_callback, if given, receives a dict with pages_done,
+    total_pages, chunks and elapsed seconds after every batch.
+    
+    With dedupe, running headers/footers are stripped and exact or
+    near-duplicate chunks are embedded once; the returned "dedup" stats
+    say how much embedding work that saved.
+    """
+    metadata = get_pdf_metadata(file_path)
+    if index is None:
+        index = create_index()
+    if chunks is None:
+        chunks = []
+    
+    start = time.perf_counter()
+    progress = {"pages_done": 0, "total_pages": metadata["pages"], "chunks": 0, "elapsed": 0.0}
+    
+    def pages():
+        # Count pages as the chunker pulls them
+        for page in iter_pdf_pages(file_path):
+            progress["pages_done"] = page[0]
+            yield page
+    
+    dedup_stats = {}
+    if dedupe:
+        chunk_stream = dedupe_chunks(
+            iter_chunks(strip_repeated_edge_lines(pages(), stats=dedup_stats), chunk_size, overlap),
+            stats=dedup_stats
+        )
+    else:
+        chunk_stream = iter_chunks(pages(), chunk_size, overlap)
+    
+    for batch in iter_chunk_batches(chunk_stream, batch_size, memory_limit_mb):
+        embeddings = embed_texts([chunk["content"] for chunk in batch])
+        # Extend chunks before adding vectors so every vector id has a chunk behind it
+        # Quantized indexes learn their ranges from the first batch
+        train_if_needed(index, embeddings)
+        chunks.extend(batch)
+        index.add(embeddings)
+        
+        progress["chunks"] = len(chunks)
+        progress["elapsed"] = time.perf_counter() - start
+        if progress_callback:
+            progress_callback(dict(progress))
+    
+    # Make sure we have at least one chunk
+    if not chunks:
+        chunks.append(EMPTY_DOCUMENT_CHUNK.copy())
+        embeddings = embed_texts([chunks[0]["content"]])
+        train_if_needed(index, embeddings)
+        index.add(embeddings)
+    
+    progress["pages_done"] = metadata["pages"]
+    progress["chunks"] = len(chunks)
+    progress["elapsed"] = time.perf_counter() - start
+    if progress_callback:
+        progress_callback(dict(progress))
+    
+    return {"index": index, "chunks": chunks, "metadata": metadata, "dedup": dedup_stats}
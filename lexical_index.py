@@ -0,0 +1,110 @@
+import re
+from collections import Counter
+import numpy as np
+from config import BM25_K1, BM25_B
+
+# Keep identifiers intact: part numbers, error codes and dotted versions
+# like "E-1023", "ISO_9001" or "v2.1" stay a single token.
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+(?:[._\-/][a-z0-9]+)*')
+
+def tokenize(text):
+    """Lowercase and split text into lexical tokens."""
+    return TOKEN_PATTERN.findall(text.lower())
+
+def build_bm25_index(chunks):
+    """Build an array-backed inverted index over chunk contents.
+
+    Postings for term id t are doc_ids[offsets[t]:offsets[t + 1]] with
+    matching term frequencies in tfs, so the whole index is a handful of
+    flat numpy arrays plus the vocabulary.
+    """
+    postings = {}
+    doc_lengths = np.zeros(len(chunks), dtype='int32')
+    
+    for doc_id, chunk in enumerate(chunks):
+        # Chunks removed by an incremental update are None and match nothing
+        tokens = tokenize(chunk["content"]) if chunk is not None else []
+        doc_lengths[doc_id] = len(tokens)
+        for term, tf in Counter(tokens).items():
+            postings.setdefault(term, []).append((doc_id, tf))
+    
+    terms = sorted(postings)
+    offsets = np.zeros(len(terms) + 1, dtype='int64')
+    for term_id, term in enumerate(terms):
+        offsets[term_id + 1] = offsets[term_id] + len(postings[term])
+    
+    doc_ids = np.empty(offsets[-1], dtype='int32')
+    tfs = np.empty(offsets[-1], dtype='int32')
+    for term_id, term in enumerate(terms):
+        start, end = offsets[term_id], offsets[term_id + 1]
+        term_postings = np.asarray(postings[term], dtype='int32')
+        doc_ids[start:end] = term_postings[:, 0]
+        tfs[start:end] = term_postings[:, 1]
+    
+    return _with_lookup({
+        "terms": np.asarray(terms, dtype=object),
+        "offsets": offsets,
+        "doc_ids": doc_ids,
+        "tfs": tfs,
+        "doc_lengths": doc_lengths
+    })
+
+def _with_lookup(bm25):
+    """Attach the derived term -> id dict and IDF/length statistics."""
+    num_docs = len(bm25["doc_lengths"])
+    doc_freqs = np.diff(bm25["offsets"])
+    bm25["vocab"] = {term: term_id for term_id, term in enumerate(bm25["terms"])}
+    bm25["idf"] = np.log(1 + (num_docs - doc_freqs + 0.5) / (doc_freqs + 0.5)).astype('float32')
+    bm25["avg_doc_length"] = float(bm25["doc_lengths"].mean()) if num_docs else 0.0
+    return bm25
+
+def search_bm25(bm25, query_text, top_k=5, k1=BM25_K1, b=BM25_B, ids=None):
+    """Score chunks against the query with BM25 and return (doc_ids, scores), best first.
+
+    If ids (a sorted array of chunk ids) is given, only those chunks can be returned.
+    """
+    num_docs = len(bm25["doc_lengths"])
+    if num_docs == 0:
+        return np.empty(0, dtype='int64'), np.empty(0, dtype='float32')
+    
+    scores = np.zeros(num_docs, dtype='float32')
+    length_norm = k1 * (1 - b + b * bm25["doc_lengths"] / max(bm25["avg_doc_length"], 1e-9))
+    
+    for term in set(tokenize(query_text)):
+        term_id = bm25["vocab"].get(term)
+        if term_id is None:
+            continue
+        start, end = bm25["offsets"][term_id], bm25["offsets"][term_id + 1]
+        postings = bm25["doc_ids"][start:end]
+        tf = bm25["tfs"][start:end].astype('float32')
+        scores[postings] += bm25["idf"][term_id] * tf * (k1 + 1) / (tf + length_norm[postings])
+    
+    matched = np.flatnonzero(scores)
+    if ids is not None:
+        matched = np.intersect1d(matched, ids, assume_unique=True)
+    if len(matched) > top_k:
+        matched = matched[np.argpartition(-scores[matched], top_k - 1)[:top_k]]
+    order = matched[np.argsort(-scores[matched])]
+    return order, scores[order]
+
+def save_bm25_index(bm25, path):
+    """Persist the array part of the index as a single .npz file."""
+    np.savez(
+        path,
+        terms=np.asarray(bm25["terms"], dtype=str),
+        offsets=bm25["offsets"],
+        doc_ids=bm25["doc_ids"],
+        tfs=bm25["tfs"],
+        doc_lengths=bm25["doc_lengths"]
+    )
+
+def load_bm25_index(path):
+    """Load an index written by save_bm25_index."""
+    with np.load(path) as data:
+        return _with_lookup({
+            "terms": data["terms"].tolist(),
+            "offsets": data["offsets"],
+            "doc_ids": data["doc_ids"],
+            "tfs": data["tfs"],
+            "doc_lengths": data["doc_lengths"]
+        })
@@ -0,0 +1,63 @@
+import numpy as np
+
+def build_chunk_filters(chunks):
+    """Precompute chunk id arrays per page and per section for filtered search.
+
+    Deduplicated chunks are listed under every page their text appeared on;
+    removed (None) chunks are left out.
+    """
+    page_ids = {}
+    section_ids = {}
+    for chunk_id, chunk in enumerate(chunks):
+        if chunk is None:
+            continue
+        for page in chunk.get("pages") or [chunk["page"]]:
+            page_ids.setdefault(page, []).append(chunk_id)
+        section = (chunk.get("section") or "").strip()
+        if section:
+            section_ids.setdefault(section, []).append(chunk_id)
+    return {
+        "pages": {page: np.asarray(ids, dtype='int64') for page, ids in page_ids.items()},
+        "sections": {section: np.asarray(ids, dtype='int64') for section, ids in section_ids.items()},
+    }
+
+def toc_page_ranges(toc, page_count):
+    """Turn a PDF outline ([level, title, page] entries) into entries with inclusive page ranges.
+
+    An entry runs until the page before the next entry at the same or a
+    higher level, or to the end of the document.
+    """
+    entries = []
+    for i, (level, title, start) in enumerate(toc):
+        end = page_count
+        for next_level, _, next_start in toc[i + 1:]:
+            if next_level <= level:
+                end = max(start, next_start - 1)
+                break
+        entries.append({"level": level, "title": title, "start": max(1, start), "end": end})
+    return entries
+
+def resolve_filter_ids(filters, chunk_filters):
+    """Return the sorted chunk ids matching every given filter, or None when nothing is filtered.
+
+    filters may hold "page_range" (inclusive (first, last) pages),
+    "section_prefix" (case-insensitive prefix of the detected section) and
+    "toc_entry" (an entry from toc_page_ranges); each narrows the result.
+    """
+    if not filters:
+        return None
+
+    selected = None
+    ranges = [filters[name] for name in ("page_range", "toc_entry") if filters.get(name)]
+    for page_range in ranges:
+        first, last = (page_range["start"], page_range["end"]) if isinstance(page_range, dict) else page_range
+        ids = [ids for page, ids in chunk_filters["pages"].items() if first <= page <= last]
+        ids = np.unique(np.concatenate(ids)) if ids else np.empty(0, dtype='int64')
+        selected = ids if selected is None else np.intersect1d(selected, ids, assume_unique=True)
+
+    prefix = (filters.get("section_prefix") or "").strip().lower()
+    if prefix:
+        ids = [ids for section, ids in chunk_filters["sections"].items() if section.lower().startswith(prefix)]
+        ids = np.unique(np.concatenate(ids)) if ids else np.empty(0, dtype='int64')
+        selected = ids if selected is None else np.intersect1d(selected, ids, assume_unique=True)
+    return selected
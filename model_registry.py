@@ -0,0 +1,81 @@
+import threading
+import time
+from config import EMBEDDING_MODEL, EMBEDDING_NUM_THREADS, EMBEDDING_QUANTIZE
+
+# Process-wide registry of loaded embedding models. Module globals survive
+# Streamlit reruns and are shared by every browser session in the process.
+# torch and sentence_transformers are imported on the first load, so importing
+# this module (e.g. to check whether a model is loaded) stays cheap.
+_models = {}
+_load_times = {}
+_lock = threading.Lock()
+_warm_up_thread = None
+
+def _registry_key(model_name, quantized):
+    return f"{model_name}#int8" if quantized else model_name
+
+def get_embedding_model(model_name=EMBEDDING_MODEL, quantized=EMBEDDING_QUANTIZE):
+    """Return the shared SentenceTransformer for model_name, loading it once per process.
+
+    With quantized=True the model's Linear layers are converted to int8 with
+    torch dynamic quantization, which is typically 1.5-2x faster on CPU at
+    a small cost in embedding fidelity.
+    """
+    key = _registry_key(model_name, quantized)
+    model = _models.get(key)
+    if model is not None:
+        return model
+    
+    with _lock:
+        # Another thread may have finished loading while we waited for the lock
+        model = _models.get(key)
+        if model is None:
+            start = time.perf_counter()
+            import torch
+            from sentence_transformers import SentenceTransformer
+            if EMBEDDING_NUM_THREADS:
+                torch.set_num_threads(EMBEDDING_NUM_THREADS)
+            model = SentenceTransformer(model_name, device='cpu')  # Force CPU
+            model.eval()
+            if quantized:
+                model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+            _load_times[key] = time.perf_counter() - start
+            _models[key] = model
+    return model
+
+def warm_up_embedding_model(model_name=EMBEDDING_MODEL, quantized=EMBEDDING_QUANTIZE):
+    """Load the model and run one dummy encode so the first real query pays no setup cost."""
+    model = get_embedding_model(model_name, quantized)
+    model.encode(["warm-up"], show_progress_bar=False)
+    return model
+
+def start_background_warm_up(model_name=EMBEDDING_MODEL, quantized=EMBEDDING_QUANTIZE):
+    """Import FAISS and warm up the model on a daemon thread, once per process.
+
+    Meant to be called after the UI has rendered, so the heavy imports and
+    model load overlap with the user reading the page rather than delaying
+    it. Returns True if this call started the thread.
+    """
+    global _warm_up_thread
+    with _lock:
+        if _warm_up_thread is not None:
+            return False
+        
+        def warm_up():
+            try:
+                import embedding  # noqa: F401  (pulls in faiss)
+                warm_up_embedding_model(model_name, quantized)
+            except Exception as e:
+                print(f"Error warming up embedding model: {e}")
+        
+        _warm_up_thread = threading.Thread(target=warm_up, name="embedding-warm-up", daemon=True)
+        _warm_up_thread.start()
+    return True
+
+def is_model_loaded(model_name=EMBEDDING_MODEL, quantized=EMBEDDING_QUANTIZE):
+    """Check whether the model is already resident in this process."""
+    return _registry_key(model_name, quantized) in _models
+
+def get_model_load_time(model_name=EMBEDDING_MODEL, quantized=EMBEDDING_QUANTIZE):
+    """Return the seconds spent loading model_name, or None if it hasn't been loaded."""
+    return _load_times.get(_registry_key(model_name, quantized))
@@ -1,8 +1,25 @@
 import pymupdf
+import hashlib
 import re
 import os
-from typing import Dict, List
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, Iterator, List
+from config import PARSE_WORKERS, PARSE_MIN_PAGES_PER_WORKER, CHUNK_SIZE, OVERLAP, EMBEDDING_MAX_TOKENS
 from utils import safe_filename
+from token_counter import count_tokens
+from tracing import span, traced, annotate
+
+# Sentence boundary: end punctuation followed by whitespace and a capital or digit
+SENTENCE_PATTERN = re.compile(r'(?<=[.!?])\s+(?=[A-Z0-9])')
+
+# Placeholder chunk used when a document yields no text at all
+EMPTY_DOCUMENT_CHUNK = {
+    "content": "No processable text found in document.",
+    "page": 1,
+    "section": ""
+}
 
 def extract_section_info(text: str) -> str:
     """Extract section information from text."""
@@ -21,34 +38,133 @@ def extract_section_info(text: str) -> str:
                 return match.group(1)
     return ""
 
-def parse_pdf(file_path: str) -> Dict:
-    """Parse PDF content with better error handling for cloud environments."""
+def page_text_hash(text: str) -> str:
+    """Content hash of a page's text, used to detect which pages changed between revisions."""
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+def _extract_page(doc, page_num: int) -> Dict:
+    """Extract text and section info for one zero-based page, with an error placeholder on failure."""
+    try:
+        with span("pdf.extract_page"):
+            page = doc.load_page(page_num)
+            text = page.get_text("text")
+            section = extract_section_info(text)
+            annotate(chars=len(text))
+        return {
+            "text": text,
+            "section": section,
+            "hash": page_text_hash(text)
+        }
+    except Exception as e:
+        print(f"Error processing page {page_num + 1}: {e}")
+        # Add empty placeholder for failed pages
+        return {
+            "text": f"[Error processing page {page_num + 1}]",
+            "section": ""
+        }
+
+def _extract_page_range(file_path: str, start: int, end: int) -> List:
+    """Worker entry point: open the PDF in this process and extract pages [start, end)."""
+    pages = []
+    try:
+        doc = pymupdf.open(file_path)
+    except Exception as e:
+        print(f"Error opening PDF in worker: {e}")
+        return [
+            (page_num + 1, {"text": f"[Error processing page {page_num + 1}]", "section": ""})
+            for page_num in range(start, end)
+        ]
+    try:
+        for page_num in range(start, end):
+            pages.append((page_num + 1, _extract_page(doc, page_num)))
+    finally:
+        doc.close()
+    return pages
+
+def _split_page_ranges(page_count: int, workers: int) -> List:
+    """Split pages into contiguous ranges, a few per worker so uneven pages balance out."""
+    num_ranges = min(page_count, workers * 4)
+    base, extra = divmod(page_count, num_ranges)
+    ranges = []
+    start = 0
+    for i in range(num_ranges):
+        end = start + base + (1 if i < extra else 0)
+        ranges.append((start, end))
+        start = end
+    return ranges
+
+def _metadata_from_doc(doc) -> Dict:
+    """Build the metadata dict shared by parse_pdf and the streaming reader."""
+    return {
+        "title": doc.metadata.get("title", "Untitled"),
+        "author": doc.metadata.get("author", "Unknown"),
+        "pages": len(doc),
+        # The PDF's own outline as [level, title, page] entries, empty if it has none
+        "toc": doc.get_toc(simple=True)
+    }
+
+def get_pdf_metadata(file_path: str) -> Dict:
+    """Read only the document metadata, without extracting any page text."""
+    try:
+        doc = pymupdf.open(file_path)
+        metadata = _metadata_from_doc(doc)
+        doc.close()
+        return metadata
+    except Exception as e:
+        print(f"Error reading PDF metadata: {e}")
+        return {"title": "Error", "author": "Unknown", "pages": 0, "toc": []}
+
+def iter_pdf_pages(file_path: str) -> Iterator:
+    """Yield (page_number, page_data) one page at a time, in the same shape as parse_pdf's text_content."""
+    try:
+        doc = pymupdf.open(file_path)
+    except Exception as e:
+        print(f"Error parsing PDF: {e}")
+        yield 1, {"text": f"Failed to process PDF: {str(e)}", "section": ""}
+        return
+    try:
+        for page_num in range(len(doc)):
+            yield page_num + 1, _extract_page(doc, page_num)
+    finally:
+        doc.close()
+
+@traced("pdf.parse")
+def parse_pdf(file_path: str, workers: int = PARSE_WORKERS) -> Dict:
+    """Parse PDF content with better error handling for cloud environments.
+
+    With workers > 1 the page range is split across a process pool, each
+    worker opening its own document. workers=0 uses every available core.
+    """
     try:
         doc = pymupdf.open(file_path)
         text_content = {}
-        metadata = {
-            "title": doc.metadata.get("title", "Untitled"),
-            "author": doc.metadata.get("author", "Unknown"),
-            "pages": len(doc)
-        }
+        metadata = _metadata_from_doc(doc)
+        page_count = len(doc)
+        
+        if workers == 0:
+            workers = os.cpu_count() or 1
+        annotate(pages=page_count, bytes=os.path.getsize(file_path))
+        
+        if workers > 1 and page_count >= PARSE_MIN_PAGES_PER_WORKER * 2:
+            doc.close()
+            workers = min(workers, page_count // PARSE_MIN_PAGES_PER_WORKER)
+            annotate(workers=workers)
+            # Spawn rather than fork: this also runs inside the threaded app, where
+            # torch and FAISS thread pools are already up and don't survive a fork
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+                futures = [
+                    executor.submit(_extract_page_range, file_path, start, end)
+                    for start, end in _split_page_ranges(page_count, workers)
+                ]
+                # Collect in submission order so text_content stays in page order
+                for future in futures:
+                    for page_number, page_data in future.result():
+                        text_content[page_number] = page_data
+            return {"metadata": metadata, "text_content": text_content}
         
         # Process each page
-        for page_num in range(len(doc)):
-            try:
-                page = doc.load_page(page_num)
-                text = page.get_text("text")
-                section = extract_section_info(text)
-                text_content[page_num + 1] = {
-                    "text": text,
-                    "section": section
-                }
-            except Exception as e:
-                print(f"Error processing page {page_num + 1}: {e}")
-                # Add empty placeholder for failed pages
-                text_content[page_num + 1] = {
-                    "text": f"[Error processing page {page_num + 1}]",
-                    "section": ""
-                }
+        for page_num in range(page_count):
+            text_content[page_num + 1] = _extract_page(doc, page_num)
         
         doc.close()
         return {"metadata": metadata, "text_content": text_content}
@@ -57,69 +173,102 @@ def parse_pdf(file_path: str) -> Dict:
         # Provide a fallback for complete failure
         print(f"Error parsing PDF: {e}")
         return {
-            "metadata": {"title": "Error", "author": "Unknown", "pages": 0},
+            "metadata": {"title": "Error", "author": "Unknown", "pages": 0, "toc": []},
             "text_content": {1: {"text": f"Failed to process PDF: {str(e)}", "section": ""}}
         }
 
-def chunk_text(text_content: Dict, chunk_size=900, overlap=40) -> List[Dict]:
-    """Split text into manageable chunks with optional section information."""
-    chunks = []
+def _split_long_sentence(sentence: str, limit: int) -> List:
+    """Split a sentence longer than limit tokens into (text, tokens) runs of whole words."""
+    words = sentence.split()
+    pieces = []
+    piece = []
+    length = 0
+    for word, count in zip(words, count_tokens(words)):
+        if piece and length + count > limit:
+            pieces.append((' '.join(piece), length))
+            piece = []
+            length = 0
+        piece.append(word)
+        length += count
+    if piece:
+        pieces.append((' '.join(piece), length))
+    return pieces
+
+def _chunk_page(page_num, page_data: Dict, chunk_size=CHUNK_SIZE, overlap=OVERLAP) -> Iterator[Dict]:
+    """Yield the chunks for a single page.
+
+    Sentences are packed into chunks of at most chunk_size model tokens,
+    counted with one batched tokenizer call per page. Each new chunk starts
+    with the previous chunk's trailing sentences, up to overlap tokens.
+    Every sentence is counted once and enters and leaves the window once,
+    so a page is chunked in linear time.
+    """
+    text = page_data["text"]
+    section = page_data.get("section", "")
+    page_hash = page_data.get("hash", "")
     
-    for page_num, page_data in text_content.items():
-        text = page_data["text"]
-        section = page_data.get("section", "")
-        
-        # Handle empty pages
-        if not text.strip():
-            continue
-            
-        # Split into sentences (improved regex for better sentence detection)
-        sentences = re.split(r'(?<=[.!?])\s+(?=[A-Z0-9])', text)
+    # Handle empty pages
+    if not text.strip():
+        return
         
-        current_chunk = []
-        current_length = 0
-        
-        for sentence in sentences:
-            # Skip empty sentences
-            if not sentence.strip():
-                continue
-                
-            # Count words as a proxy for tokens
-            token_count = len(sentence.split())
-            
-            # If adding this sentence would exceed chunk size, save current chunk
-            if current_length + token_count > chunk_size and current_chunk:
-                chunk_text = ' '.join(current_chunk)
-                chunks.append({
-                    "content": chunk_text,
-                    "page": page_num,
-                    "section": section
-                })
-                
-                # Keep some sentences for overlap
-                overlap_count = min(overlap, len(current_chunk))
-                current_chunk = current_chunk[-overlap_count:] if overlap_count > 0 else []
-                current_length = sum(len(s.split()) for s in current_chunk)
+    # Split into sentences (improved regex for better sentence detection)
+    sentences = [sentence for sentence in SENTENCE_PATTERN.split(text) if sentence.strip()]
+    
+    units = []
+    for sentence, token_count in zip(sentences, count_tokens(sentences)):
+        if token_count > chunk_size:
+            # A single sentence over the limit would be truncated by the encoder
+            units.extend(_split_long_sentence(sentence, chunk_size))
+        else:
+            units.append((sentence, token_count))
+    
+    window = deque()
+    current_length = 0
+    for sentence, token_count in units:
+        # If adding this sentence would exceed chunk size, save current chunk
+        if window and current_length + token_count > chunk_size:
+            yield {
+                "content": ' '.join(unit[0] for unit in window),
+                "page": page_num,
+                "section": section,
+                "page_hash": page_hash
+            }
             
-            # Add the current sentence
-            current_chunk.append(sentence)
-            current_length += token_count
+            # Keep trailing sentences for overlap, leaving room for the next one
+            while window and (current_length > overlap or current_length + token_count > chunk_size):
+                current_length -= window.popleft()[1]
         
-        # Don't forget to add the last chunk from the page
-        if current_chunk:
-            chunk_text = ' '.join(current_chunk)
-            chunks.append({
-                "content": chunk_text,
-                "page": page_num,
-                "section": section
-            })
+        window.append((sentence, token_count))
+        current_length += token_count
+    
+    # Don't forget to add the last chunk from the page
+    if window:
+        yield {
+            "content": ' '.join(unit[0] for unit in window),
+            "page": page_num,
+            "section": section,
+            "page_hash": page_hash
+        }
+
+def iter_chunks(pages: Iterable, chunk_size=CHUNK_SIZE, overlap=OVERLAP) -> Iterator[Dict]:
+    """Lazily chunk an iterable of (page_number, page_data) pairs, e.g. from iter_pdf_pages.
+
+    chunk_size and overlap are in embedding-model tokens; chunk_size is
+    capped at what the model can encode.
+    """
+    chunk_size = min(chunk_size, EMBEDDING_MAX_TOKENS - 2)
+    overlap = min(overlap, chunk_size // 2)
+    for page_num, page_data in pages:
+        yield from _chunk_page(page_num, page_data, chunk_size, overlap)
+
+@traced("pdf.chunk_text")
+def chunk_text(text_content: Dict, chunk_size=CHUNK_SIZE, overlap=OVERLAP) -> List[Dict]:
+    """Split text into manageable chunks with optional section information."""
+    chunks = list(iter_chunks(text_content.items(), chunk_size, overlap))
     
     # Make sure we have at least one chunk
     if not chunks:
-        chunks.append({
-            "content": "No processable text found in document.",
-            "page": 1,
-            "section": ""
-        })
+        chunks.append(EMPTY_DOCUMENT_CHUNK.copy())
     
+    annotate(pages=len(text_content), chunks=len(chunks))
     return chunks
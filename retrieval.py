@@ -1,61 +1,453 @@
-from sentence_transformers import SentenceTransformer
-import torch
+import contextvars
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
-from config import EMBEDDING_MODEL
+from config import (EMBEDDING_MODEL, VECTOR_DIM, HYBRID_CANDIDATES, RRF_K, SPECULATIVE_MIN_SIMILARITY,
+                    QUERY_EMBEDDING_CACHE_SIZE, CONTEXT_TOKEN_BUDGET, CONTEXT_MIN_TOKEN_BUDGET, CONTEXT_MMR_LAMBDA,
+                    CONTEXT_MIN_EXCERPT_TOKENS, MODEL_CONTEXT_WINDOWS, DEFAULT_CONTEXT_WINDOW)
+from lexical_index import search_bm25, tokenize
+from metadata_filter import build_chunk_filters, resolve_filter_ids
+from token_counter import count_tokens, estimate_tokens
+from tracing import traced, annotate
 
-def query_index(query_text, index, chunks, top_k=5):
-    """Query the FAISS index to find the most relevant chunks for a given query."""
-    # Initialize model on CPU
-    model = SentenceTransformer(EMBEDDING_MODEL)
-    model.to('cpu')  # Force CPU usage
+# The embedding model and FAISS are imported inside the functions that use
+# them, so the UI can import this module without loading torch.
+
+# Process-wide LRU of normalized query text -> embedding
+_query_cache = OrderedDict()
+_query_cache_lock = threading.Lock()
+_query_cache_stats = {"hits": 0, "misses": 0}
+
+def _make_result(chunks, idx, score):
+    """Build the result dict returned by every retrieval path for chunk idx."""
+    chunk = chunks[idx]
+    section_info = chunk.get("section", "") or "N/A"
+    # Deduplicated chunks list every page the text appeared on
+    pages = chunk.get("pages") or [chunk["page"]]
+    page_info = f"PDF Page {chunk['page']}" + (f" (also pages {', '.join(str(p) for p in pages[1:])})" if len(pages) > 1 else "")
+    result = {
+        "content": chunk["content"],
+        "page": chunk["page"],
+        "pages": pages,
+        "section": section_info,
+        "score": score,
+        "chunk_id": int(idx),
+        "source": page_info + (f", Section: {section_info}" if section_info != "N/A" else "")
+    }
+    # Corpus chunks carry the document they came from
+    if chunk.get("doc_id"):
+        result["doc_id"] = chunk["doc_id"]
+        result["doc_key"] = chunk.get("doc_key")
+        result["source"] = f"{chunk['doc_id']}, {result['source']}"
+    return result
+
+@traced("retrieval.query_index")
+def query_index(query_text, index, chunks, top_k=5, timings=None, ids=None):
+    """Query the FAISS index to find the most relevant chunks for a given query.
+
+    If a timings dict is passed, it is filled with the seconds spent on
+    model loading, query encoding and the index search. ids (a sorted array
+    of chunk ids, see resolve_filter_ids) restricts the search to those chunks.
+    """
+    from embedding import search_index
+    from model_registry import get_embedding_model
+    
+    start = time.perf_counter()
+    # Loading is a no-op once the shared model is warm
+    get_embedding_model(EMBEDDING_MODEL)
+    loaded = time.perf_counter()
     
     # Generate query embedding
-    query_embedding = model.encode([query_text]).astype('float32')
+    query_embedding = embed_query(query_text)
+    encoded = time.perf_counter()
     
     # Search the index
     try:
-        distances, indices = index.search(query_embedding, top_k)
+        distances, indices = search_index(index, query_embedding, top_k, ids)
+        searched = time.perf_counter()
+        if timings is not None:
+            timings.update({
+                "model_load": loaded - start,
+                "encode": encoded - loaded,
+                "search": searched - encoded
+            })
         
         results = []
         for i, idx in enumerate(indices[0]):
-            if idx < len(chunks) and idx >= 0:  # Ensure index is valid
-                chunk = chunks[idx]
-                section_info = chunk.get("section", "") or "N/A"
-                
-                results.append({
-                    "content": chunk["content"],
-                    "page": chunk["page"],
-                    "section": section_info,
-                    "score": float(distances[0][i]),
-                    "source": f"PDF Page {chunk['page']}" + (f", Section: {section_info}" if section_info != "N/A" else "")
-                })
+            # Ensure index is valid and the chunk wasn't removed by an incremental update
+            if idx < len(chunks) and idx >= 0 and chunks[idx] is not None:
+                results.append(_make_result(chunks, idx, float(distances[0][i])))
         
         # Sort by score (lower distance is better)
         results.sort(key=lambda x: x["score"])
         
+        annotate(results=len(results))
         return results
     except Exception as e:
         print(f"Error searching index: {e}")
         return []
 
-def format_context_from_results(results):
-    """Format the retrieved chunks into a context string for the LLM."""
+@traced("retrieval.query_index_batch")
+def query_index_batch(query_texts, index, chunks, top_k=5, timings=None, ids=None):
+    """Query the FAISS index with many queries at once.
+
+    All queries are encoded in one forward pass (cached ones skipped) and
+    searched with a single index.search call. Returns one result list per
+    query, each shaped exactly like query_index's output.
+    """
+    if not query_texts:
+        return []
+    from embedding import search_index
+    
+    start = time.perf_counter()
+    query_embeddings = embed_queries(query_texts)
+    encoded = time.perf_counter()
+    
+    try:
+        distances, indices = search_index(index, query_embeddings, top_k, ids)
+    except Exception as e:
+        print(f"Error searching index: {e}")
+        return [[] for _ in query_texts]
+    if timings is not None:
+        timings.update({"encode": encoded - start, "search": time.perf_counter() - encoded})
+    
+    all_results = []
+    for row_distances, row_indices in zip(distances, indices):
+        results = [
+            _make_result(chunks, idx, float(distance))
+            for distance, idx in zip(row_distances, row_indices)
+            if 0 <= idx < len(chunks) and chunks[idx] is not None
+        ]
+        # Sort by score (lower distance is better)
+        results.sort(key=lambda x: x["score"])
+        all_results.append(results)
+    annotate(queries=len(query_texts), results=sum(len(results) for results in all_results))
+    return all_results
+
+@traced("retrieval.query_bm25")
+def query_bm25(query_text, bm25, chunks, top_k=5, timings=None, ids=None):
+    """Keyword search over the chunk inverted index.
+
+    Results have the same shape as query_index, but score is a BM25 score
+    (higher is better) and a normalized relevance in [0, 1] is included.
+    """
+    start = time.perf_counter()
+    doc_ids, scores = search_bm25(bm25, query_text, top_k, ids=ids)
+    if timings is not None:
+        timings["bm25"] = time.perf_counter() - start
+    
+    best = float(scores[0]) if len(scores) else 1.0
+    results = []
+    for idx, score in zip(doc_ids, scores):
+        if idx < len(chunks) and chunks[idx] is not None:
+            result = _make_result(chunks, idx, float(score))
+            result["relevance"] = float(score) / best
+            results.append(result)
+    annotate(results=len(results))
+    return results
+
+@traced("retrieval.query_hybrid")
+def query_index_hybrid(query_text, index, chunks, bm25, top_k=5, candidates=HYBRID_CANDIDATES, timings=None, ids=None):
+    """Fuse dense FAISS and BM25 rankings with reciprocal rank fusion.
+
+    Each path retrieves max(candidates, top_k) chunks; a chunk's fused score
+    is the sum of 1 / (RRF_K + rank) over the paths that returned it.
+    """
+    depth = max(candidates, top_k)
+    dense = query_index(query_text, index, chunks, top_k=depth, timings=timings, ids=ids)
+    lexical = query_bm25(query_text, bm25, chunks, top_k=depth, timings=timings, ids=ids)
+    
+    fused = {}
+    for ranking in (dense, lexical):
+        for rank, result in enumerate(ranking):
+            entry = fused.setdefault(result["chunk_id"], {"result": result, "rrf": 0.0})
+            entry["rrf"] += 1.0 / (RRF_K + rank + 1)
+    
+    ranked = sorted(fused.values(), key=lambda x: x["rrf"], reverse=True)[:top_k]
+    # A chunk ranked first by both paths gets the maximum possible score
+    max_rrf = 2.0 / (RRF_K + 1)
+    results = []
+    for entry in ranked:
+        result = dict(entry["result"])
+        result["score"] = entry["rrf"]
+        result["relevance"] = entry["rrf"] / max_rrf
+        results.append(result)
+    annotate(dense=len(dense), lexical=len(lexical), results=len(results))
+    return results
+
+def get_filter_ids(doc, filters):
+    """Resolve metadata filters to chunk ids for doc, building its page/section lookup on first use."""
+    if not filters:
+        return None
+    chunk_filters = doc.get("chunk_filters")
+    if chunk_filters is None:
+        chunk_filters = build_chunk_filters(doc["chunks"])
+        doc["chunk_filters"] = chunk_filters
+    return resolve_filter_ids(filters, chunk_filters)
+
+@traced("retrieval.retrieve")
+def retrieve(query_text, doc, mode="Vector", top_k=5, timings=None, filters=None):
+    """Dispatch a query to the retrieval path named by mode (one of RETRIEVAL_MODES).
+
+    filters narrows the search by page range, section prefix or outline
+    entry (see resolve_filter_ids). Falls back to vector search when the
+    document has no keyword index.
+    """
+    ids = get_filter_ids(doc, filters)
+    annotate(mode=mode, top_k=top_k, filtered=ids is not None)
+    if ids is not None and len(ids) == 0:
+        return []
+    if mode == "Keyword (BM25)" and doc.get("bm25"):
+        return query_bm25(query_text, doc["bm25"], doc["chunks"], top_k=top_k, timings=timings, ids=ids)
+    if mode == "Hybrid (RRF)" and doc.get("bm25"):
+        return query_index_hybrid(query_text, doc["index"], doc["chunks"], doc["bm25"], top_k=top_k, timings=timings, ids=ids)
+    return query_index(query_text, doc["index"], doc["chunks"], top_k=top_k, timings=timings, ids=ids)
+
+def _normalize_query(query_text):
+    # The mpnet tokenizer lowercases, so case and spacing don't change the embedding
+    return " ".join(query_text.lower().split())
+
+@traced("retrieval.embed_queries")
+def embed_queries(query_texts):
+    """Encode queries as an (n, dim) float32 array, serving repeats from the LRU cache.
+
+    Queries missing from the cache are encoded together in one forward pass.
+    """
+    keys = [_normalize_query(query_text) for query_text in query_texts]
+    embeddings = np.empty((len(keys), VECTOR_DIM), dtype='float32')
+    missing = {}
+    with _query_cache_lock:
+        for i, key in enumerate(keys):
+            cached = _query_cache.get(key)
+            if cached is not None:
+                _query_cache.move_to_end(key)
+                _query_cache_stats["hits"] += 1
+                embeddings[i] = cached
+            else:
+                _query_cache_stats["misses"] += 1
+                missing.setdefault(key, []).append(i)
+    annotate(queries=len(keys), cache_hits=len(keys) - sum(len(positions) for positions in missing.values()))
+    
+    if missing:
+        from embedding import embed_texts
+        encoded = embed_texts(list(missing.keys()))
+        with _query_cache_lock:
+            for (key, positions), embedding in zip(missing.items(), encoded):
+                embeddings[positions] = embedding
+                _query_cache[key] = embedding
+                _query_cache.move_to_end(key)
+            while len(_query_cache) > QUERY_EMBEDDING_CACHE_SIZE:
+                _query_cache.popitem(last=False)
+    return embeddings
+
+def embed_query(query_text):
+    """Encode a single query with the shared model as a (1, dim) float32 array."""
+    return embed_queries([query_text])
+
+def get_query_cache_stats():
+    """Return hit/miss counts and current size of the query embedding cache."""
+    with _query_cache_lock:
+        return dict(_query_cache_stats, size=len(_query_cache))
+
+def query_similarity(query_a, query_b):
+    """Cosine similarity between two query embeddings."""
+    a = embed_query(query_a)[0]
+    b = embed_query(query_b)[0]
+    return float(np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b) + 1e-12))
+
+def retrieve_with_speculation(query_text, rewrite_fn, retrieve_fn, min_similarity=SPECULATIVE_MIN_SIMILARITY):
+    """Retrieve for the raw query while rewrite_fn runs, re-retrieving only if the rewrite drifts.
+
+    rewrite_fn and retrieve_fn each take a query string. Returns
+    (final_query, results, info) where info records whether the speculative
+    results were kept and the similarity that decided it. A failed rewrite
+    falls back to the raw query; retrieval errors propagate.
+    """
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        # Run each worker in a copy of this context so its trace spans nest under the caller's
+        retrieval_future = executor.submit(contextvars.copy_context().run, retrieve_fn, query_text)
+        rewrite_future = executor.submit(contextvars.copy_context().run, rewrite_fn, query_text)
+        try:
+            rewritten = rewrite_future.result() or query_text
+        except Exception as e:
+            print(f"Error rewriting query: {e}")
+            rewritten = query_text
+        results = retrieval_future.result()
+    
+    info = {"rewritten": rewritten != query_text, "similarity": 1.0, "reused": True}
+    if rewritten != query_text:
+        info["similarity"] = query_similarity(query_text, rewritten)
+        if info["similarity"] < min_similarity:
+            results = retrieve_fn(rewritten)
+            info["reused"] = False
+    return rewritten, results, info
+
+def context_token_budget(model, max_tokens, reserved_tokens=0):
+    """Tokens available for retrieved context with this model and max_tokens setting.
+
+    The model's window must hold the prompt (reserved_tokens for the system
+    prompt and history, plus the context) and the completion; the result is
+    capped at CONTEXT_TOKEN_BUDGET and never drops below CONTEXT_MIN_TOKEN_BUDGET.
+    """
+    window = MODEL_CONTEXT_WINDOWS.get(model, DEFAULT_CONTEXT_WINDOW)
+    available = window - max_tokens - reserved_tokens
+    return max(CONTEXT_MIN_TOKEN_BUDGET, min(CONTEXT_TOKEN_BUDGET, available))
+
+def _result_relevance(result):
+    if 'relevance' in result:
+        return result['relevance']
+    return 1.0 - min(1.0, result['score'] / 100.0)  # Convert distance to similarity
+
+def _append_trimmed(first, second, probe_words=8):
+    """Join two chunk texts, dropping the words of second that repeat first's tail.
+
+    chunk_text overlaps neighbouring chunks by whole sentences, so the repeat
+    is a prefix of second that is also a suffix of first starting at a
+    sentence boundary. Candidate starts are tried earliest first, so the
+    longest overlap wins; overlaps down to a single word are found. Up to
+    probe_words words are compared first to reject candidates cheaply.
+    A sentence too long for one chunk is split mid-sentence, so if no
+    overlap starts at a sentence boundary, any word boundary is tried,
+    requiring at least probe_words matching words.
+    """
+    a = first.split()
+    b = second.split()
+    if not b:
+        return first
+    for sentence_start in (True, False):
+        for start in range(max(0, len(a) - len(b)), len(a)):
+            if sentence_start and start and not a[start - 1].endswith(('.', '!', '?')):
+                continue
+            overlap = min(len(a) - start, len(b))
+            probe = min(probe_words, overlap)
+            if not sentence_start and probe < min(probe_words, len(b)):
+                break  # Later starts only overlap less
+            if a[start:start + probe] != b[:probe]:
+                continue
+            if a[start:start + overlap] == b[:overlap]:
+                return first + (" " + " ".join(b[overlap:]) if overlap < len(b) else "")
+    return first + "\n" + second
+
+def _merge_adjacent(results):
+    """Collapse results for consecutive chunks of the same document page into single excerpts."""
+    excerpts = []
+    by_chunk = sorted(results, key=lambda r: (r.get('doc_id') or "", r['page'], r['chunk_id']))
+    for result in by_chunk:
+        last = excerpts[-1] if excerpts else None
+        if (last is not None and last['doc_id'] == result.get('doc_id') and last['page'] == result['page']
+                and result['chunk_id'] == last['chunk_ids'][-1] + 1):
+            last['content'] = _append_trimmed(last['content'], result['content'])
+            last['chunk_ids'].append(result['chunk_id'])
+            last['relevance'] = max(last['relevance'], _result_relevance(result))
+            continue
+        excerpts.append({
+            "doc_id": result.get('doc_id'),
+            "page": result['page'],
+            "section": result.get('section'),
+            "content": result['content'],
+            "chunk_ids": [result['chunk_id']],
+            "relevance": _result_relevance(result),
+        })
+    return excerpts
+
+def _mmr_order(excerpts, mmr_lambda):
+    """Order excerpts by maximal marginal relevance.
+
+    Relevance is min-max scaled across the excerpts; redundancy is the
+    highest token-set Jaccard similarity to an excerpt already picked.
+    """
+    relevances = [excerpt['relevance'] for excerpt in excerpts]
+    low, high = min(relevances), max(relevances)
+    scaled = [(r - low) / (high - low) if high > low else 1.0 for r in relevances]
+    token_sets = [set(tokenize(excerpt['content'])) for excerpt in excerpts]
+    redundancy = [0.0] * len(excerpts)
+    
+    remaining = list(range(len(excerpts)))
+    order = []
+    while remaining:
+        best = max(remaining, key=lambda i: mmr_lambda * scaled[i] - (1 - mmr_lambda) * redundancy[i])
+        remaining.remove(best)
+        order.append(best)
+        for i in remaining:
+            union = len(token_sets[i] | token_sets[best]) or 1
+            redundancy[i] = max(redundancy[i], len(token_sets[i] & token_sets[best]) / union)
+    return [excerpts[i] for i in order]
+
+def _excerpt_header(number, page, section, relevance, doc_id=None):
+    header = f"[EXCERPT {number} - " + (f"Document: {doc_id}, " if doc_id else "") + f"Page {page}"
+    if section and section != "N/A":
+        header += f", Section: {section}"
+    return header + f", Relevance: {relevance:.2f}]\n"
+
+@traced("retrieval.format_context")
+def format_context_from_results(results, token_budget=None, mmr_lambda=CONTEXT_MMR_LAMBDA, stats=None):
+    """Pack the retrieved chunks into a context string for the LLM.
+
+    Consecutive chunks of the same page are merged with their repeated
+    overlap trimmed, excerpts are ordered by MMR, and excerpts are added
+    until token_budget (estimated tokens, None for no limit) is spent, the
+    last one truncated if enough room is left. Results from a corpus search
+    are cited by document as well as page. If a stats dict is passed it
+    receives estimated prompt tokens before (all chunks verbatim) and after
+    packing, plus how many chunks were merged and excerpts dropped.
+    """
     if not results:
+        if stats is not None:
+            stats.update({"tokens_before": 0, "tokens_after": 0, "chunks": 0, "merged": 0, "excerpts": 0,
+                          "dropped": 0, "truncated": False})
         return "No relevant information found in the document."
     
-    context = "CONTEXT FROM PDF DOCUMENT:\n\n"
+    excerpts = _mmr_order(_merge_adjacent(results), mmr_lambda)
     
-    for i, result in enumerate(results, 1):
-        context += f"[EXCERPT {i} - Page {result['page']}"
-        if result.get('section') and result['section'] != "N/A":
-            context += f", Section: {result['section']}"
-        
-        # Format the similarity score
-        score = 1.0 - min(1.0, result['score'] / 100.0)  # Convert distance to similarity
-        context += f", Relevance: {score:.2f}]\n"
-        
-        # Add the content
-        context += f"{result['content']}\n\n"
+    parts = ["CONTEXT FROM PDF DOCUMENT:\n\n"]
+    footer = "END OF CONTEXT\n\n"
+    # The footer is reserved up front so the finished context stays within the budget
+    used = estimate_tokens(parts[0]) + estimate_tokens(footer)
+    dropped = 0
+    truncated = False
+    for excerpt in excerpts:
+        if truncated:
+            dropped += 1
+            continue
+        header = _excerpt_header(len(parts), excerpt['page'], excerpt['section'], excerpt['relevance'], excerpt['doc_id'])
+        content = excerpt['content']
+        cost = estimate_tokens(header) + estimate_tokens(f"{content}\n\n")
+        if token_budget is not None and used + cost > token_budget:
+            room = token_budget - used - estimate_tokens(header)
+            if room < CONTEXT_MIN_EXCERPT_TOKENS:
+                dropped += 1
+                continue
+            # Cut at a word boundary within the remaining room, leaving tokens for the ellipsis and separator
+            words = content.split()
+            kept = 0
+            length = 0
+            for count in count_tokens(words):
+                if length + count > room - 2:
+                    break
+                length += count
+                kept += 1
+            content = " ".join(words[:kept]) + " ..."
+            cost = estimate_tokens(header) + estimate_tokens(f"{content}\n\n")
+            truncated = True
+        parts.append(f"{header}{content}\n\n")
+        used += cost
+    parts.append(footer)
+    context = "".join(parts)
+    annotate(chunks=len(results), excerpts=len(parts) - 2, dropped=dropped, tokens=estimate_tokens(context))
     
-    context += "END OF CONTEXT\n\n"
+    if stats is not None:
+        stats.update({
+            "tokens_before": sum(
+                estimate_tokens(_excerpt_header(i, r['page'], r.get('section'), _result_relevance(r), r.get('doc_id')) + r['content'])
+                for i, r in enumerate(results, 1)
+            ) + estimate_tokens("CONTEXT FROM PDF DOCUMENT:\n\nEND OF CONTEXT\n\n"),
+            "tokens_after": estimate_tokens(context),
+            "chunks": len(results),
+            "merged": len(results) - len(excerpts),
+            "excerpts": len(parts) - 2,
+            "dropped": dropped,
+            "truncated": truncated,
+        })
     return context
@@ -0,0 +1,70 @@
+import time
+from config import STREAM_FLUSH_INTERVAL, STREAM_FLUSH_TOKENS
+
+# Shown at the end of a partial answer while it is still streaming
+CURSOR = " ▌"
+
+def iter_stream_text(stream, stats=None):
+    """Yield the text deltas of a streamed chat completion.
+
+    If the provider reports usage on the final chunk (Groq's x_groq.usage),
+    its completion token count is stored in stats["completion_tokens"].
+    """
+    for chunk in stream:
+        usage = getattr(getattr(chunk, "x_groq", None), "usage", None)
+        if usage is not None and stats is not None:
+            stats["completion_tokens"] = usage.completion_tokens
+        if chunk.choices and chunk.choices[0].delta.content is not None:
+            yield chunk.choices[0].delta.content
+
+def escape_math(text):
+    """Escape dollar signs so a partial answer renders as plain markdown without KaTeX."""
+    return text.replace("$", "\\$")
+
+def render_stream(deltas, render, start_time=None, flush_interval=STREAM_FLUSH_INTERVAL,
+                  flush_tokens=STREAM_FLUSH_TOKENS, stats=None):
+    """Accumulate streamed text deltas and redraw the answer on a time/size cadence.
+
+    render(text, final) is called at most every flush_interval seconds or
+    flush_tokens deltas with final=False, and once with the complete text and
+    final=True, so expensive formatting can be left to the last call. Returns
+    the full text. If a stats dict is passed it receives ttft (seconds from
+    start_time, or from the call, to the first delta), tokens, tokens_per_second
+    (measured from the first delta) and the number of redraws.
+    """
+    start = time.perf_counter() if start_time is None else start_time
+    parts = []
+    first_delta = None
+    last_flush = time.perf_counter()
+    flushes = 0
+    deltas_seen = 0
+    deltas_at_flush = 0
+
+    for delta in deltas:
+        now = time.perf_counter()
+        if first_delta is None:
+            first_delta = now
+        parts.append(delta)
+        deltas_seen += 1
+        if deltas_seen - deltas_at_flush >= flush_tokens or now - last_flush >= flush_interval:
+            # Each redraw needs the whole answer as one string, so it costs O(length);
+            # the flush cadence is what bounds how often that is paid
+            render("".join(parts), False)
+            deltas_at_flush = deltas_seen
+            last_flush = now
+            flushes += 1
+
+    text = "".join(parts)
+    render(text, True)
+    end = time.perf_counter()
+
+    if stats is not None:
+        tokens = stats.get("completion_tokens") or deltas_seen
+        generation_time = end - first_delta if first_delta is not None else 0.0
+        stats.update({
+            "ttft": first_delta - start if first_delta is not None else None,
+            "tokens": tokens,
+            "tokens_per_second": tokens / generation_time if generation_time > 0 else 0.0,
+            "flushes": flushes + 1
+        })
+    return text
@@ -0,0 +1,105 @@
+import sys
+import threading
+from collections import OrderedDict
+from config import EMBEDDING_MODEL, TOKEN_COUNT_CACHE_MB, TOKEN_COUNT_CACHE_MAX_CHARS
+
+# Process-wide LRU of text -> token count. Boilerplate sentences recur across
+# pages and documents, and re-chunking a revised PDF repeats most sentences.
+# Only texts up to TOKEN_COUNT_CACHE_MAX_CHARS are cached, and the cache is
+# bounded by the approximate bytes its keys and entries hold.
+_counts = OrderedDict()
+_cache_bytes = 0
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0}
+
+# Rough bytes of an OrderedDict entry and its int value, on top of the key string
+CACHE_ENTRY_OVERHEAD_BYTES = 100
+
+# Tokenizers loaded for counting, separate from the ones SentenceTransformer
+# uses while encoding: a HF fast tokenizer can't be called from two threads at
+# once, and encode() switches truncation and padding on its own instance.
+# Each tokenizer has its own lock, so counting with one model never waits on another.
+_tokenizers = {}
+_load_lock = threading.Lock()
+
+def _load_tokenizer(model_name):
+    """Return (tokenizer, lock) for a model, loading the tokenizer on first use."""
+    entry = _tokenizers.get(model_name)
+    if entry is not None:
+        return entry
+    with _load_lock:
+        entry = _tokenizers.get(model_name)
+        if entry is None:
+            # Imported here so page-extraction workers, which import
+            # pdf_processing but never count tokens, don't pay for it
+            from transformers import AutoTokenizer
+            entry = (AutoTokenizer.from_pretrained(model_name), threading.Lock())
+            _tokenizers[model_name] = entry
+    return entry
+
+def get_tokenizer(model_name=EMBEDDING_MODEL):
+    """Return a tokenizer for the embedding model, so counts match what the encoder sees.
+
+    Only the tokenizer files are loaded, not the model weights. It is
+    shared; use count_tokens rather than calling it directly.
+    """
+    return _load_tokenizer(model_name)[0]
+
+def _cache_put(text, count):
+    """Add a count to the LRU and evict down to TOKEN_COUNT_CACHE_MB. Caller holds _lock."""
+    global _cache_bytes
+    if text in _counts:
+        _counts.move_to_end(text)
+        return
+    _counts[text] = count
+    _cache_bytes += sys.getsizeof(text) + CACHE_ENTRY_OVERHEAD_BYTES
+    while _cache_bytes > TOKEN_COUNT_CACHE_MB * 1024 * 1024:
+        evicted, _ = _counts.popitem(last=False)
+        _cache_bytes -= sys.getsizeof(evicted) + CACHE_ENTRY_OVERHEAD_BYTES
+
+def count_tokens(texts):
+    """Return the word-piece count of each text, excluding special tokens.
+
+    Texts seen before are served from the cache; the rest are tokenized
+    together in a single batched tokenizer call.
+    """
+    counts = [0] * len(texts)
+    missing = {}
+    with _lock:
+        for i, text in enumerate(texts):
+            count = _counts.get(text)
+            if count is not None:
+                _counts.move_to_end(text)
+                _stats["hits"] += 1
+                counts[i] = count
+            else:
+                _stats["misses"] += 1
+                missing.setdefault(text, []).append(i)
+
+    if missing:
+        tokenizer, tokenizer_lock = _load_tokenizer(EMBEDDING_MODEL)
+        with tokenizer_lock:
+            encoded = tokenizer(
+                list(missing.keys()), add_special_tokens=False, truncation=False, padding=False,
+                return_attention_mask=False, return_token_type_ids=False, verbose=False
+            )["input_ids"]
+        with _lock:
+            for (text, positions), ids in zip(missing.items(), encoded):
+                for i in positions:
+                    counts[i] = len(ids)
+                if len(text) <= TOKEN_COUNT_CACHE_MAX_CHARS:
+                    _cache_put(text, len(ids))
+    return counts
+
+def estimate_tokens(text):
+    """Token count of a single text, the one estimate used for chunking, batching and prompt budgets.
+
+    Counts are embedding-model word pieces; LLM tokenizers split English
+    text at a similar rate, so this also serves for prompt budgeting.
+    """
+    return max(1, count_tokens([text])[0])
+
+def get_token_count_stats():
+    """Return hit/miss counts, entries and approximate bytes of the token count cache."""
+    with _lock:
+        return dict(_stats, size=len(_counts), bytes=_cache_bytes)
@@ -0,0 +1,241 @@
+import contextvars
+import functools
+import itertools
+import json
+import numbers
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from config import TRACING_ENABLED, TRACE_BUFFER_SIZE, TRACE_EXPORT_PATH, TRACE_LATENCY_BUCKETS
+
+# Spans time one pipeline stage each and nest by call order. While tracing is
+# off, span() hands back a shared no-op context manager and annotate() returns
+# straight away, so instrumented code pays one flag check per stage.
+# The process-wide default can be overridden per execution context, so one
+# Streamlit session (a script-run thread) switching tracing on doesn't switch
+# it on or off for the others.
+_enabled = TRACING_ENABLED
+_context_enabled = contextvars.ContextVar("tracing_enabled", default=None)
+_current_span = contextvars.ContextVar("current_span", default=None)
+_span_ids = itertools.count(1)
+
+# Finished spans, and per-name aggregates for the metrics export
+_spans = deque(maxlen=TRACE_BUFFER_SIZE)
+_stats = {}
+_lock = threading.Lock()
+
+_NOOP_SPAN = nullcontext()
+METRIC_PREFIX = "pdf_assistant_stage"
+
+def set_tracing_enabled(enabled):
+    """Switch span recording on or off for the whole process (contexts with their own setting excepted)."""
+    global _enabled
+    _enabled = bool(enabled)
+
+def set_context_tracing(enabled):
+    """Switch span recording on or off for the current context only, e.g. one session's script run.
+
+    Threads started with a copy of this context inherit the setting.
+    """
+    _context_enabled.set(bool(enabled))
+
+def is_tracing_enabled():
+    enabled = _context_enabled.get()
+    return _enabled if enabled is None else enabled
+
+def _open(name, attributes, parent):
+    record = {
+        "name": name,
+        "trace_id": parent["trace_id"] if parent else uuid.uuid4().hex[:16],
+        "span_id": next(_span_ids),
+        "parent_id": parent["span_id"] if parent else None,
+        "start": time.time(),
+        "seconds": 0.0,
+        "attributes": attributes
+    }
+    return {"record": record, "token": _current_span.set(record), "start": time.perf_counter()}
+
+def start_span(name, **attributes):
+    """Open a span that stays current until finish_span, for stages that don't fit in a with block.
+
+    Returns a handle for finish_span, or None while tracing is off.
+    """
+    if not is_tracing_enabled():
+        return None
+    return _open(name, attributes, _current_span.get())
+
+def start_trace(name, **attributes):
+    """Like start_span, but always opens a new trace rather than nesting under the current span."""
+    if not is_tracing_enabled():
+        return None
+    return _open(name, attributes, None)
+
+def finish_span(handle, error=None):
+    """Close a span opened by start_span or start_trace, record it and return its record.
+
+    Finishing an already finished span does nothing.
+    """
+    if handle is None:
+        return None
+    record = handle["record"]
+    token = handle.pop("token", None)
+    if token is None:
+        return record
+    record["seconds"] = time.perf_counter() - handle["start"]
+    if error:
+        record["error"] = error
+    _current_span.reset(token)
+    _record(record)
+    return record
+
+@contextmanager
+def _recording_span(name, attributes):
+    handle = _open(name, attributes, _current_span.get())
+    try:
+        yield
+    except BaseException as e:
+        finish_span(handle, error=type(e).__name__)
+        raise
+    finish_span(handle)
+
+def span(name, **attributes):
+    """Context manager timing the enclosed block as stage name, nested under the current span."""
+    if not is_tracing_enabled():
+        return _NOOP_SPAN
+    return _recording_span(name, attributes)
+
+def traced(name):
+    """Decorator recording each call of the function as a span called name."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not is_tracing_enabled():
+                return func(*args, **kwargs)
+            with _recording_span(name, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def annotate(**attributes):
+    """Attach attributes (bytes, chunks, cache hits, ...) to the innermost open span."""
+    if not is_tracing_enabled():
+        return
+    record = _current_span.get()
+    if record is not None:
+        record["attributes"].update(attributes)
+
+def _json_value(value):
+    # numpy scalars and other non-JSON attribute values
+    return value.item() if hasattr(value, "item") else str(value)
+
+def _record(record):
+    seconds = record["seconds"]
+    with _lock:
+        _spans.append(record)
+        stats = _stats.get(record["name"])
+        if stats is None:
+            stats = _stats[record["name"]] = {
+                "count": 0, "errors": 0, "seconds_sum": 0.0, "seconds_max": 0.0,
+                "buckets": [0] * (len(TRACE_LATENCY_BUCKETS) + 1), "attributes": {}
+            }
+        stats["count"] += 1
+        stats["errors"] += "error" in record
+        stats["seconds_sum"] += seconds
+        stats["seconds_max"] = max(stats["seconds_max"], seconds)
+        stats["buckets"][bisect_left(TRACE_LATENCY_BUCKETS, seconds)] += 1
+        # Numeric attributes are summed (booleans count how often they were true)
+        for key, value in record["attributes"].items():
+            if isinstance(value, numbers.Number):
+                stats["attributes"][key] = stats["attributes"].get(key, 0) + value
+
+        if TRACE_EXPORT_PATH:
+            try:
+                with open(TRACE_EXPORT_PATH, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record, default=_json_value) + "\n")
+            except OSError as e:
+                print(f"Error writing trace span: {e}")
+
+def get_spans(trace_id=None, limit=None):
+    """Return recorded spans oldest first, optionally only one trace's or only the last limit."""
+    with _lock:
+        spans = [dict(record) for record in _spans if trace_id is None or record["trace_id"] == trace_id]
+    return spans[-limit:] if limit else spans
+
+def get_trace_stats():
+    """Per-stage count, errors, total/mean/max seconds and summed numeric attributes."""
+    with _lock:
+        return {
+            name: {
+                "count": stats["count"],
+                "errors": stats["errors"],
+                "seconds_sum": stats["seconds_sum"],
+                "seconds_mean": stats["seconds_sum"] / stats["count"],
+                "seconds_max": stats["seconds_max"],
+                "attributes": dict(stats["attributes"])
+            }
+            for name, stats in sorted(_stats.items())
+        }
+
+def trace_rows(spans):
+    """Flatten one trace's spans into display rows in start order, with stage names indented by depth."""
+    depths = {}
+    rows = []
+    for record in sorted(spans, key=lambda record: record["start"]):
+        depth = depths.get(record["parent_id"], -1) + 1
+        depths[record["span_id"]] = depth
+        rows.append({
+            "stage": "  " * depth + record["name"],
+            "ms": round(record["seconds"] * 1000, 2),
+            "details": ", ".join(f"{key}={value}" for key, value in record["attributes"].items())
+                       + (f" error={record['error']}" if "error" in record else "")
+        })
+    return rows
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def export_prometheus():
+    """Render the per-stage aggregates in the Prometheus text exposition format."""
+    with _lock:
+        stats_items = sorted((name, dict(stats, buckets=list(stats["buckets"]), attributes=dict(stats["attributes"])))
+                             for name, stats in _stats.items())
+    lines = [
+        f"# HELP {METRIC_PREFIX}_seconds Latency of RAG pipeline stages.",
+        f"# TYPE {METRIC_PREFIX}_seconds histogram"
+    ]
+    for name, stats in stats_items:
+        cumulative = 0
+        for bound, count in zip(TRACE_LATENCY_BUCKETS, stats["buckets"]):
+            cumulative += count
+            lines.append(f'{METRIC_PREFIX}_seconds_bucket{{stage="{_label(name)}",le="{bound}"}} {cumulative}')
+        lines.append(f'{METRIC_PREFIX}_seconds_bucket{{stage="{_label(name)}",le="+Inf"}} {stats["count"]}')
+        lines.append(f'{METRIC_PREFIX}_seconds_sum{{stage="{_label(name)}"}} {stats["seconds_sum"]}')
+        lines.append(f'{METRIC_PREFIX}_seconds_count{{stage="{_label(name)}"}} {stats["count"]}')
+
+    lines += [
+        f"# HELP {METRIC_PREFIX}_errors_total Pipeline stage calls that raised.",
+        f"# TYPE {METRIC_PREFIX}_errors_total counter"
+    ]
+    lines += [f'{METRIC_PREFIX}_errors_total{{stage="{_label(name)}"}} {stats["errors"]}' for name, stats in stats_items]
+
+    lines += [
+        f"# HELP {METRIC_PREFIX}_attribute_total Sum of numeric span attributes (bytes, chunks, cache hits, ...).",
+        f"# TYPE {METRIC_PREFIX}_attribute_total counter"
+    ]
+    for name, stats in stats_items:
+        for key, value in sorted(stats["attributes"].items()):
+            lines.append(f'{METRIC_PREFIX}_attribute_total{{stage="{_label(name)}",attribute="{_label(key)}"}} {float(value)}')
+    return "\n".join(lines) + "\n"
+
+def export_json_lines(trace_id=None):
+    """Recorded spans as newline-delimited JSON, one span per line."""
+    return "".join(json.dumps(record, default=_json_value) + "\n" for record in get_spans(trace_id))
+
+def reset_tracing():
+    """Drop all recorded spans and aggregates."""
+    with _lock:
+        _spans.clear()
+        _stats.clear()